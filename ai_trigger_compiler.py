@@ -1,9 +1,6 @@
 
-from google import genai
-from google.genai import types
-import os
-import json
 import logging
+from llm_gateway import llm_gateway, ADMIN
 
 class TriggerEngine:
     """
@@ -37,7 +34,6 @@ async def ai_trigger_compiler(natural_language_description: str) -> dict:
     Função principal que utiliza IA para traduzir descrições humanas em 
     objetos de configuração de gatilhos estruturados.
     """
-    client = genai.Client(api_key=os.environ.get("API_KEY"))
     model_name = "gemini-3-flash-preview"
 
     prompt = f"""
@@ -57,14 +53,7 @@ async def ai_trigger_compiler(natural_language_description: str) -> dict:
     """
 
     try:
-        response = client.models.generate_content(
-            model=model_name,
-            contents=prompt,
-            config=types.GenerateContentConfig(
-                response_mime_type="application/json",
-            )
-        )
-        return json.loads(response.text)
+        return await llm_gateway.generate_json(prompt, model=model_name, priority=ADMIN, operation="compile_trigger")
     except Exception as e:
         logging.error(f"Erro na compilação do gatilho: {str(e)}")
         return {
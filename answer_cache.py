@@ -0,0 +1,184 @@
+import os
+import re
+import time
+import logging
+import numpy as np
+from typing import List, Dict, Optional, Any
+from database_service import db_service
+from embedding_service import embedding_service
+
+logger = logging.getLogger("AnswerCache")
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "false").lower() == "true"
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.92"))
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "500"))
+# Pausa mínima desde a última mensagem para que a pergunta conte como avulsa (novo atendimento)
+ANSWER_CACHE_IDLE_GAP_SECONDS = int(os.getenv("ANSWER_CACHE_IDLE_GAP_SECONDS", "1800"))
+
+# Intenções transacionais (pedido, pagamento, dados pessoais) nunca passam pelo cache.
+# Perguntas informativas ("vocês aceitam PIX?") continuam cacheáveis.
+NON_CACHEABLE_PATTERN = re.compile(
+    r"\b(quero|queria|pedir|pedido|pe[cç]o|fechar|finalizar|comprar|encomendar|pagar|paguei|pagamento|"
+    r"link|gerar|cancelar|cancela|trocar|reembolso|estorno|recibo|comprovante|endere[cç]o|"
+    r"meu|minha|meus|minhas|atrasad[oa]|cad[eê])\b|\d+\s*(x|pizzas?|unidades?)\b",
+    re.IGNORECASE
+)
+# Respostas que acionaram ferramentas transacionais também não são armazenadas.
+NON_CACHEABLE_TOOLS = {"process_payment_pix", "generate_and_send_receipt", "manage_inventory_stock", "delegate_task_to_staff"}
+# Pedido em aberto: a última dessas ferramentas no histórico gerou cobrança e ainda não houve recibo
+ORDER_OPENING_TOOL, ORDER_CLOSING_TOOL = "process_payment_pix", "generate_and_send_receipt"
+USER_NAME_PLACEHOLDER = "{{cliente}}"
+# Nomes mais curtos que isso não viram placeholder (risco de trocar pedaços de palavras)
+MIN_USER_NAME_LENGTH = 3
+INVALIDATION_CHANNELS = ("menu_update", "vector_store_update", "lessons_update")
+
+class SemanticAnswerCache:
+    """
+    Cache semântico de respostas para perguntas repetidas (horário, área de entrega, PIX...).
+    Perguntas são comparadas por similaridade de embedding; acima do limiar a resposta
+    anterior é reaproveitada sem executar o workflow do agente. Só perguntas avulsas usam o
+    cache: respostas a continuações ("qual o total?", "e a de calabresa?") dependem do histórico
+    de cada cliente. Avulsa é decidida a cada turno (is_standalone): sem tool call pendente,
+    sem pedido em aberto e após uma pausa desde a última mensagem.
+    Invalidado quando cardápio, base de conhecimento ou lições mudam (em todos os workers).
+    """
+    def __init__(self, enabled: bool = ANSWER_CACHE_ENABLED, threshold: float = ANSWER_CACHE_THRESHOLD,
+                 ttl_seconds: int = ANSWER_CACHE_TTL_SECONDS, max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+                 idle_gap_seconds: int = ANSWER_CACHE_IDLE_GAP_SECONDS):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.idle_gap_seconds = idle_gap_seconds
+        self.entries: List[Dict[str, Any]] = []
+        self.matrix: Optional[np.ndarray] = None
+        self.version = 0
+        self.stats = {"lookups": 0, "hits": 0, "misses": 0, "bypassed_followup": 0,
+                      "bypassed_uncacheable": 0, "stored": 0, "invalidations": 0}
+
+    @staticmethod
+    def is_cacheable(message: str) -> bool:
+        return bool(message and message.strip()) and not NON_CACHEABLE_PATTERN.search(message)
+
+    def is_standalone(self, messages: List[Any], last_activity: Optional[float]) -> bool:
+        """
+        Se a mensagem nova abre um atendimento independente do histórico salvo: nenhuma
+        tool call pendente, nenhum pedido em aberto e a última atividade (timestamp do
+        checkpoint) há pelo menos `idle_gap_seconds`.
+        """
+        if not messages:
+            return True
+        if getattr(messages[-1], "tool_calls", None):
+            return False
+        # Cobranças abandonadas deixam de contar quando a compactação remove as mensagens antigas
+        for m in reversed(messages):
+            if getattr(m, "type", None) == "tool" and m.name in (ORDER_OPENING_TOOL, ORDER_CLOSING_TOOL):
+                if m.name == ORDER_OPENING_TOOL:
+                    return False
+                break
+        return last_activity is not None and time.time() - last_activity >= self.idle_gap_seconds
+
+    async def _embed(self, text: str) -> np.ndarray:
+        vector = np.asarray(await embedding_service.aembed_query(text.strip().lower()), dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def _rebuild_matrix(self):
+        self.matrix = np.vstack([e["embedding"] for e in self.entries]) if self.entries else None
+
+    def _expire(self):
+        now = time.time()
+        alive = [e for e in self.entries if now - e["created_at"] < self.ttl_seconds]
+        if len(alive) != len(self.entries):
+            self.entries = alive
+            self._rebuild_matrix()
+
+    async def lookup(self, message: str, user_name: Optional[str] = None, standalone: bool = True) -> Optional[str]:
+        """Retorna a resposta em cache para uma pergunta semanticamente equivalente, se houver."""
+        if not self.enabled:
+            return None
+        self.stats["lookups"] += 1
+        if not standalone:
+            self.stats["bypassed_followup"] += 1
+            return None
+        if not self.is_cacheable(message):
+            self.stats["bypassed_uncacheable"] += 1
+            return None
+        self._expire()
+        if self.matrix is None:
+            self.stats["misses"] += 1
+            return None
+
+        query = await self._embed(message)
+        scores = self.matrix @ query
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            self.stats["misses"] += 1
+            return None
+
+        entry = self.entries[best]
+        entry["hits"] += 1
+        self.stats["hits"] += 1
+        return entry["answer"].replace(USER_NAME_PLACEHOLDER, user_name or "")
+
+    async def store(self, message: str, answer: str, tools_used: List[str], user_name: Optional[str] = None,
+                    version: Optional[int] = None, standalone: bool = True):
+        """`version` é o valor lido antes de gerar a resposta; se houve invalidação no meio, descarta."""
+        if not self.enabled or not standalone or not answer or not self.is_cacheable(message):
+            return
+        if version is not None and version != self.version:
+            return
+        if NON_CACHEABLE_TOOLS.intersection(tools_used):
+            return
+        # Respostas personalizadas: o nome do cliente vira placeholder e é reposto no replay
+        if user_name and len(user_name.strip()) >= MIN_USER_NAME_LENGTH:
+            answer = re.sub(rf"\b{re.escape(user_name.strip())}\b", USER_NAME_PLACEHOLDER, answer)
+        embedding = await self._embed(message)
+        if version is not None and version != self.version:
+            return
+        self.entries.append({
+            "question": message,
+            "embedding": embedding,
+            "answer": answer,
+            "created_at": time.time(),
+            "hits": 0
+        })
+        if len(self.entries) > self.max_entries:
+            self.entries = self.entries[-self.max_entries:]
+        self._rebuild_matrix()
+        self.stats["stored"] += 1
+
+    async def invalidate(self, event: Optional[Dict] = None):
+        if self.entries:
+            logger.info(f"Cache de respostas invalidado ({len(self.entries)} entradas).")
+        self.entries = []
+        self.matrix = None
+        self.version += 1
+        self.stats["invalidations"] += 1
+
+    async def start(self):
+        """Assina os canais de invalidação (LISTEN/NOTIFY) para manter os workers coerentes."""
+        if not self.enabled:
+            return
+        try:
+            for channel in INVALIDATION_CHANNELS:
+                await db_service.listen(channel, self.invalidate)
+        except Exception as e:
+            # Sem invalidação confiável o cache não pode ser usado com segurança
+            self.enabled = False
+            logger.error(f"Cache semântico desativado: falha ao assinar invalidações ({e}).")
+
+    def get_stats(self) -> Dict[str, Any]:
+        searched = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "enabled": self.enabled,
+            "entries": len(self.entries),
+            "threshold": self.threshold,
+            "idle_gap_seconds": self.idle_gap_seconds,
+            # Entre as perguntas que chegaram a consultar o cache / entre todos os turnos
+            "hit_rate": round(self.stats["hits"] / searched, 4) if searched else 0.0,
+            "turn_hit_rate": round(self.stats["hits"] / self.stats["lookups"], 4) if self.stats["lookups"] else 0.0
+        }
+
+answer_cache = SemanticAnswerCache()
@@ -1,107 +1,237 @@
 
+import os
 import time
-import operator
+import uuid
+import asyncio
 import json
 import logging
-from typing import TypedDict, Annotated, List, Literal, Union, Optional, Dict
-from langgraph.graph import StateGraph, END
-from langgraph.prebuilt import ToolNode
-from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, ToolMessage, SystemMessage
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.tools import tool
-from system_prompt import get_compiled_prompt
+from datetime import datetime
+from contextvars import ContextVar
+from typing import TypedDict, Annotated, List, Literal, Union, Optional, Dict, Callable, Awaitable, Any
+from langgraph.graph import StateGraph, START, END
+from langgraph.graph.message import add_messages
+from langchain_core.messages import (
+    BaseMessage, HumanMessage, AIMessage, ToolMessage, SystemMessage, RemoveMessage
+)
+from system_prompt import STATIC_SYSTEM_PROMPT, build_turn_context
 from optimization_engine import optimizer
 from database_service import db_service
-from mcp_service import mcp_manager
+from tool_registry import tool_registry
+from answer_cache import answer_cache
+from retrieval_cache import retrieval_cache
+from context_packer import context_packer, estimate_tokens, RAG_CONTEXT_CANDIDATES
+from llm_registry import model_registry
+from llm_gateway import llm_gateway, CUSTOMER
+from checkpoint_store import checkpoint_saver
+from prompt_cache import prompt_cache
+from provider_pool import provider_pool
+from specialist_manager import specialist_service
+from embedding_service import LatencyTracker
+from intent_router import intent_router
+
+# Quantidade pré-carregada por turno: cobre o limite usado por search_knowledge_base,
+# que assim é atendido pelo memo do turno sem nova busca.
+RETRIEVAL_PREFETCH_K = RAG_CONTEXT_CANDIDATES
+
+# Compactação do histórico persistido: acima do limite, os turnos mais antigos viram um resumo
+AGENT_HISTORY_TOKEN_LIMIT = int(os.getenv("AGENT_HISTORY_TOKEN_LIMIT", "3000"))
+AGENT_HISTORY_KEEP_TURNS = int(os.getenv("AGENT_HISTORY_KEEP_TURNS", "3"))
+
+# Destino dos tokens do turno atual (painel/WhatsApp); sem destino o modelo responde de uma vez
+_token_sink: ContextVar[Optional[Callable[[str], Awaitable[Any]]]] = ContextVar("agent_token_sink", default=None)
+# Avisado ao fim de cada passo do modelo (True se o passo chamou ferramentas)
+_step_sink: ContextVar[Optional[Callable[[bool], Awaitable[Any]]]] = ContextVar("agent_step_sink", default=None)
+
+def _content_text(content) -> str:
+    """Texto de um conteúdo de mensagem, que pode vir como string ou lista de partes."""
+    if isinstance(content, str):
+        return content
+    return "".join(
+        part if isinstance(part, str) else part.get("text", "")
+        for part in content or [] if isinstance(part, (str, dict))
+    )
+
+async def _generate_text(prompt: str, operation: str) -> str:
+    """Chamada auxiliar (resumo, roteamento) no modelo ativo do registro, na vaga de atendimento ao vivo."""
+    model = await model_registry.get_model()
+    async with llm_gateway.slot(CUSTOMER, operation):
+        response = await model.ainvoke(prompt)
+    return _content_text(response.content).strip()
 
 # Definição do Estado do Agente
 class AgentState(TypedDict):
-    messages: Annotated[List[BaseMessage], operator.add]
+    # add_messages (e não operator.add): a compactação remove mensagens antigas via RemoveMessage
+    messages: Annotated[List[BaseMessage], add_messages]
+    summary: str
     context_rag: str
     user_info: dict
     proactive_suggestion: str
     is_human_managed: bool
     thread_id: str
+    # Preenchidos pelo estágio de entrada paralelo
+    lessons: str
+    lead: Optional[dict]
+    route_specialist: bool
+    specialist_id: Optional[str]
+
+# Estágios de entrada: rodam em paralelo (mesmo superstep) e se juntam antes do modelo
+ENTRY_STAGES = ("compact", "retrieve", "route", "customer", "lessons")
 
 class LangGraphAgent:
-    def __init__(self, model_name="gemini-3-flash-preview"):
-        self.model = ChatGoogleGenerativeAI(model=model_name)
+    def __init__(self, model_name: Optional[str] = None):
+        # Clientes LLM são criados sob demanda e reaproveitados pelo registro; sem model_name,
+        # vale o padrão do registro (DEFAULT_LLM_MODEL)
+        if model_name:
+            model_registry.default_model = model_name
         
         # 1. Ferramentas estáticas iniciais
         import rag_tool
         self.base_tools = rag_tool.tools
+        tool_registry.set_base_tools(self.base_tools)
         
+        # Latência por nó do grafo (o turno custa o máximo dos estágios de entrada, não a soma)
+        self.stage_latency = LatencyTracker()
+
         # O workflow é construído de forma que as ferramentas possam ser consultadas dinamicamente
         self.workflow = self._build_graph()
 
+    def _timed(self, name: str, node: Callable):
+        async def run(state: AgentState):
+            started = time.perf_counter()
+            try:
+                return await node(state)
+            finally:
+                self.stage_latency.record(name, (time.perf_counter() - started) * 1000)
+        return run
+
     async def _get_all_tools(self) -> List:
-        """Agrega ferramentas base e ferramentas dinâmicas via MCP."""
-        mcp_caps = await mcp_manager.get_all_capabilities()
-        mcp_tools_defs = mcp_caps.get("tools", [])
-        
-        dynamic_tools = []
-        for t_def in mcp_tools_defs:
-            # Wrapper para transformar a definição MCP em uma ferramenta LangChain
-            async def run_mcp_tool(arguments: Dict = None, tool_full_name=t_def["name"]):
-                server_name, original_tool_name = tool_full_name.split("_", 1)
-                return await mcp_manager.call_tool(server_name, original_tool_name, arguments or {})
-
-            mcp_tool = tool(run_mcp_tool, name=t_def["name"])
-            mcp_tool.description = t_def.get("description", "Ferramenta externa via MCP.")
-            dynamic_tools.append(mcp_tool)
-            
-        return self.base_tools + dynamic_tools
+        """Ferramentas base + MCP, reconstruídas apenas quando a versão do catálogo muda."""
+        return await tool_registry.get_tools()
+
+    async def _compact_history(self, state: AgentState):
+        """
+        Resume os turnos mais antigos quando o histórico da conversa passa do limite de tokens.
+        O corte é sempre no início de um turno, para não separar tool calls de suas respostas.
+        """
+        messages = state['messages']
+        if sum(estimate_tokens(_content_text(m.content)) for m in messages) <= AGENT_HISTORY_TOKEN_LIMIT:
+            return {}
+        turn_starts = [i for i, m in enumerate(messages) if isinstance(m, HumanMessage)]
+        if len(turn_starts) <= AGENT_HISTORY_KEEP_TURNS:
+            return {}
+        old = messages[:turn_starts[-AGENT_HISTORY_KEEP_TURNS]]
+
+        roles = {HumanMessage: "Cliente", AIMessage: "Atendente", ToolMessage: "Ferramenta"}
+        transcript = "\n".join(
+            f"{roles.get(type(m), 'Sistema')}: {_content_text(m.content)[:500]}"
+            for m in old if _content_text(m.content)
+        )
+        prompt = f"""Resuma a conversa abaixo entre um cliente e o atendimento da pizzaria em até 8 linhas.
+Preserve nome, endereço, preferências, pedidos feitos ou em andamento, valores e pendências.
+
+RESUMO ANTERIOR: {state.get('summary') or "Nenhum."}
+
+CONVERSA:
+{transcript}
+
+Responda APENAS com o resumo atualizado."""
+        try:
+            summary = await _generate_text(prompt, "history_summary")
+        except Exception as e:
+            # Sem resumo, o histórico segue inteiro e a compactação é tentada no próximo turno
+            logging.error(f"Falha ao compactar histórico de {state.get('thread_id')}: {e}")
+            return {}
+        return {"summary": summary, "messages": [RemoveMessage(id=m.id) for m in old]}
 
     async def _retrieve_context(self, state: AgentState):
         last_user_message = next((m.content for m in reversed(state['messages']) if isinstance(m, HumanMessage)), None)
         context = "Nenhuma informação específica encontrada."
         if last_user_message:
-            search_results = await db_service.search_rag(last_user_message, limit=3)
-            if search_results:
-                context = "\n".join(search_results)
+            search_results = await db_service.search_rag(last_user_message, limit=RETRIEVAL_PREFETCH_K)
+            packed = context_packer.pack(last_user_message, search_results)
+            if packed:
+                context = "\n\n".join(r['content'] for r in packed)
         return {"context_rag": context}
 
+    async def _route_specialist(self, state: AgentState):
+        """Roteamento pelo supervisor, em paralelo à recuperação (só quando o chamador pede)."""
+        if not state.get('route_specialist'):
+            return {"specialist_id": None}
+        last_user_message = next((m.content for m in reversed(state['messages']) if isinstance(m, HumanMessage)), "")
+        try:
+            specialists = await specialist_service.get_all_specialists()
+            return {"specialist_id": await supervisor.route(last_user_message, specialists, state.get('thread_id'))}
+        except Exception as e:
+            logging.error(f"Falha no roteamento de especialista: {e}")
+            return {"specialist_id": None}
+
+    async def _load_customer(self, state: AgentState):
+        """Lead e estado de intervenção humana da conversa, consultados em paralelo."""
+        conversation_id = state.get('thread_id')
+        lead, intervention = await asyncio.gather(
+            db_service.get_lead_by_phone(conversation_id),
+            db_service.get_intervention_state(conversation_id),
+            return_exceptions=True
+        )
+        for result in (lead, intervention):
+            if isinstance(result, Exception):
+                logging.error(f"Falha ao consultar dados do cliente {conversation_id}: {result}")
+        return {
+            "lead": None if isinstance(lead, Exception) else lead,
+            "is_human_managed": intervention is True
+        }
+
+    async def _load_lessons(self, state: AgentState):
+        return {"lessons": await optimizer.get_active_lessons()}
+
     async def _call_model(self, state: AgentState):
         """Invocação do modelo com binding dinâmico de ferramentas."""
         if state.get('is_human_managed', False):
-            return {"messages": [AIMessage(content="[CONTROLE HUMANO ATIVO]")]}
-
-        # Carregar configuração ativa do LLM
-        try:
-            config = await db_service.get_active_llm_config()
-            if config:
-                provider = config['provider'].lower()
-                model_name = config['model']
-                api_key = config['apiKey']
-                
-                if provider == 'gemini':
-                    self.model = ChatGoogleGenerativeAI(model=model_name, google_api_key=api_key)
-                elif provider == 'openai':
-                    from langchain_openai import ChatOpenAI
-                    self.model = ChatOpenAI(model=model_name, api_key=api_key)
-                elif provider == 'groq':
-                    from langchain_groq import ChatGroq
-                    self.model = ChatGroq(model=model_name, api_key=api_key)
-        except Exception as e:
-            print(f"Error loading LLM config: {e}. Using default.")
+            # Nada entra no histórico: o atendente humano responde pela conversa
+            return {}
 
-        # Buscamos as ferramentas no momento da chamada para garantir atualização do MCP
+        # Ferramentas vinculadas por provedor ficam em cache até mudar a configuração
+        # ou a versão do catálogo de ferramentas (register/unregister MCP)
         current_tools = await self._get_all_tools()
-        model_with_tools = self.model.bind_tools(current_tools)
+        cached = None
 
+        # Prefixo estático primeiro e seções do turno depois: o prefixo se repete em todas as
+        # requisições e é reaproveitado pelo cache de contexto do provedor
         messages = state['messages']
         if not any(isinstance(m, SystemMessage) for m in messages):
-            user_name = state.get('user_info', {}).get('user_name', 'Cliente')
-            lessons = await optimizer.get_active_lessons()
-            system_content = get_compiled_prompt(
+            lead = state.get('lead') or {}
+            user_name = state.get('user_info', {}).get('user_name') or lead.get('userName') or 'Cliente'
+            turn_context = build_turn_context(
                 context=state.get('context_rag', 'Nenhum contexto adicional.'),
-                history="",
-                lessons=lessons,
-                user_name=user_name
+                history=state.get('summary', ''),
+                lessons=state.get('lessons', ''),
+                user_name=user_name,
+                profile=lead
             )
-            messages = [SystemMessage(content=system_content)] + messages
+            cached_model = await prompt_cache.get_cached_model(current_tools, tool_registry.version)
+            if cached_model is not None:
+                # Prompt estático e ferramentas já estão no cache do provedor; só o turno vai no slot de sistema
+                cached = (cached_model, [SystemMessage(content=turn_context)] + messages)
+            messages = [SystemMessage(content=f"{STATIC_SYSTEM_PROMPT}\n\n{turn_context}")] + messages
+
+        sink = _token_sink.get()
+        started = time.perf_counter()
+        async def forward(chunk):
+            # Streaming: cada pedaço de texto vai ao destino assim que chega
+            text = _content_text(chunk.content)
+            if text:
+                await sink(text)
 
-        response = model_with_tools.invoke(messages)
+        async with llm_gateway.slot(CUSTOMER, "agent"):
+            # Pool de provedores: hedge para um secundário quando o primário passa do prazo e
+            # failover em caso de erro; os chunks são somados na mensagem final do passo.
+            # Com cache explícito, o primário usa o modelo em cache (e cai no caminho normal se falhar)
+            response = await provider_pool.generate(messages, current_tools, tool_registry.version,
+                                                    on_chunk=forward if sink is not None else None,
+                                                    cached=cached)
+        prompt_cache.record(response, (time.perf_counter() - started) * 1000)
+        if (step_end := _step_sink.get()) is not None:
+            await step_end(bool(response.tool_calls))
         return {"messages": [response]}
 
     def _should_continue(self, state: AgentState) -> Literal["tools", END]:
@@ -118,48 +248,118 @@ class LangGraphAgent:
         if not isinstance(last_message, AIMessage) or not last_message.tool_calls:
             return {"messages": []}
 
+        # Chamadas independentes rodam em paralelo, cada uma com seu prazo (por ferramenta e
+        # pelo orçamento restante do turno); timeouts voltam como ToolMessage de erro.
         tool_calls = last_message.tool_calls
-        results = []
-        
-        # 1. Obter todas as ferramentas disponíveis (estáticas + dinâmicas)
-        all_tools = await self._get_all_tools()
-        tool_map = {t.name: t for t in all_tools}
-
-        for tool_call in tool_calls:
-            tool_name = tool_call['name']
-            tool_args = tool_call['args']
-            tool_id = tool_call['id']
-            
-            if tool_name in tool_map:
-                try:
-                    tool_instance = tool_map[tool_name]
-                    # Executa a ferramenta (pode ser síncrona ou assíncrona)
-                    if hasattr(tool_instance, "ainvoke"):
-                        output = await tool_instance.ainvoke(tool_args)
-                    else:
-                        output = tool_instance.invoke(tool_args)
-                except Exception as e:
-                    output = f"Erro ao executar ferramenta {tool_name}: {str(e)}"
-            else:
-                output = f"Ferramenta {tool_name} não encontrada."
-
-            results.append(ToolMessage(content=str(output), tool_call_id=tool_id, name=tool_name))
-
+        outputs = await asyncio.gather(*[
+            tool_registry.run_tool(tool_call['name'], tool_call['args']) for tool_call in tool_calls
+        ])
+        results = [
+            ToolMessage(content=output, tool_call_id=tool_call['id'], name=tool_call['name'],
+                        status="error" if status != "ok" else "success")
+            for tool_call, (output, status) in zip(tool_calls, outputs)
+        ]
         return {"messages": results}
 
     def _build_graph(self):
         graph = StateGraph(AgentState)
         
-        graph.add_node("retrieve", self._retrieve_context)
-        graph.add_node("agent", self._call_model)
-        graph.add_node("tools", self._execute_tool)
+        nodes = {
+            "compact": self._compact_history,
+            "retrieve": self._retrieve_context,
+            "route": self._route_specialist,
+            "customer": self._load_customer,
+            "lessons": self._load_lessons,
+            "agent": self._call_model,
+            "tools": self._execute_tool,
+        }
+        for name, node in nodes.items():
+            graph.add_node(name, self._timed(name, node))
         
-        graph.set_entry_point("retrieve")
-        graph.add_edge("retrieve", "agent")
+        # Fan-out: todos os estágios de entrada começam juntos; o modelo espera o último
+        for stage in ENTRY_STAGES:
+            graph.add_edge(START, stage)
+        graph.add_edge(list(ENTRY_STAGES), "agent")
         graph.add_conditional_edges("agent", self._should_continue, {"tools": "tools", END: END})
         graph.add_edge("tools", "agent")
         
-        return graph.compile()
+        # Estado persistido por thread_id (conversation_id): cada turno retoma o histórico salvo
+        return graph.compile(checkpointer=checkpoint_saver)
+
+    async def run_turn(self, message: str, conversation_id: str, user_info: Optional[dict] = None,
+                       on_token: Optional[Callable[[str], Awaitable[Any]]] = None,
+                       on_step_end: Optional[Callable[[bool], Awaitable[Any]]] = None, route: bool = False) -> Dict:
+        """
+        Executa um turno completo para uma mensagem do cliente.
+        Perguntas repetidas e não transacionais são respondidas pelo cache semântico.
+        Com `on_token`, o modelo roda em streaming e cada pedaço de texto é repassado ao callback;
+        `on_step_end(tool_calls)` marca o fim de cada passo do modelo.
+        Com `route`, o supervisor escolhe o especialista em paralelo à recuperação.
+        Turnos da mesma conversa rodam um de cada vez (em todos os workers): cada um parte
+        do checkpoint deixado pelo anterior.
+        """
+        thread_id = conversation_id or str(uuid.uuid4())
+        async with db_service.conversation_lock(thread_id):
+            return await self._run_turn(message, thread_id, user_info or {}, on_token, on_step_end, route)
+
+    async def _run_turn(self, message: str, thread_id: str, user_info: dict,
+                        on_token: Optional[Callable[[str], Awaitable[Any]]],
+                        on_step_end: Optional[Callable[[bool], Awaitable[Any]]], route: bool) -> Dict:
+        user_name = user_info.get('user_name')
+        config = {"configurable": {"thread_id": thread_id}}
+        # Cache de respostas só para perguntas avulsas (decidido a cada turno) e nunca sob controle humano
+        standalone = False
+        if answer_cache.enabled:
+            human_control, snapshot = await asyncio.gather(
+                db_service.get_intervention_state(thread_id), self.workflow.aget_state(config),
+                return_exceptions=True
+            )
+            if human_control is False and not isinstance(snapshot, Exception):
+                last_activity = datetime.fromisoformat(snapshot.created_at).timestamp() if snapshot.created_at else None
+                standalone = answer_cache.is_standalone(snapshot.values.get("messages") or [], last_activity)
+        cached = await answer_cache.lookup(message, user_name, standalone=standalone)
+        if cached is not None:
+            # A resposta do cache também entra no histórico da conversa
+            try:
+                await self.workflow.aupdate_state(
+                    config, {"messages": [HumanMessage(content=message), AIMessage(content=cached)]}, as_node="agent"
+                )
+            except Exception as e:
+                logging.error(f"Falha ao registrar resposta em cache no histórico de {thread_id}: {e}")
+            return {"response": cached, "cached": True, "tools_used": [], "specialist_id": None, "human_managed": False}
+
+        cache_version = answer_cache.version
+        turn_token = retrieval_cache.begin_turn()
+        tools_token = tool_registry.begin_turn()
+        sink_token = _token_sink.set(on_token)
+        step_token = _step_sink.set(on_step_end)
+        try:
+            result = await self.workflow.ainvoke({
+                "messages": [HumanMessage(content=message)],
+                "context_rag": "",
+                "user_info": user_info,
+                "proactive_suggestion": "",
+                "is_human_managed": False,
+                "thread_id": thread_id,
+                "route_specialist": route
+            }, config)
+        finally:
+            _step_sink.reset(step_token)
+            _token_sink.reset(sink_token)
+            tool_registry.end_turn(tools_token)
+            retrieval_cache.end_turn(turn_token)
+        human_managed = bool(result.get("is_human_managed"))
+        response = "" if human_managed else _content_text(result["messages"][-1].content)
+        # Só as ferramentas deste turno (o estado traz o histórico inteiro da conversa)
+        turn_start = max((i for i, m in enumerate(result["messages"]) if isinstance(m, HumanMessage)), default=0)
+        tools_used = [m.name for m in result["messages"][turn_start:] if isinstance(m, ToolMessage)]
+        if not human_managed:
+            await answer_cache.store(message, response, tools_used, user_name, version=cache_version,
+                                     standalone=standalone)
+        return {
+            "response": response, "cached": False, "tools_used": tools_used,
+            "specialist_id": result.get("specialist_id"), "human_managed": human_managed
+        }
 
 class SupervisorAgent:
     """
@@ -167,11 +367,15 @@ class SupervisorAgent:
     e delega para o especialista mais adequado.
     """
     
-    async def route(self, message: str, specialists: list) -> str:
+    async def route(self, message: str, specialists: list, conversation_id: Optional[str] = None) -> str:
         """
-        Usa Gemini para classificar a intenção e retornar o ID do especialista.
-        Retorna o specialist_id mais adequado para a mensagem.
+        Retorna o specialist_id mais adequado para a mensagem. O roteador local decide quando
+        está confiante; só mensagens ambíguas chegam ao LLM (_route_with_llm).
         """
+        return await intent_router.route(message, specialists, conversation_id, escalate=self._route_with_llm)
+
+    async def _route_with_llm(self, message: str, specialists: List[Dict]) -> str:
+        """Usa o modelo ativo para classificar a intenção quando o roteador local fica em dúvida."""
         specialists_desc = "\n".join([f"- {s['id']}: {s['name']} — {s['description']}" for s in specialists])
         prompt = f"""Você é um supervisor de atendimento de pizzaria. 
 Analise a mensagem do cliente e escolha o especialista mais adequado.
@@ -182,16 +386,7 @@ ESPECIALISTAS DISPONÍVEIS:
 MENSAGEM DO CLIENTE: {message}
 
 Responda APENAS com o ID do especialista (ex: a1). Sem explicações."""
-        
-        try:
-            from google import genai
-            import os
-            client = genai.Client(api_key=os.environ.get("API_KEY"))
-            response = client.models.generate_content(model='gemini-2.0-flash', contents=prompt)
-            return response.text.strip()
-        except Exception as e:
-            print(f"Supervisor routing error: {e}")
-            return specialists[0]['id'] if specialists else "default"
+        return await _generate_text(prompt, "supervisor")
     
     async def execute(self, message: str, conversation_id: str) -> str:
         """
@@ -200,5 +395,6 @@ Responda APENAS com o ID do especialista (ex: a1). Sem explicações."""
         # Implementação futura
         return "Supervisor execution placeholder"
 
-agent_executor = LangGraphAgent().workflow
+agent = LangGraphAgent()
+agent_executor = agent.workflow
 supervisor = SupervisorAgent()
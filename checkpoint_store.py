@@ -0,0 +1,158 @@
+import os
+import logging
+from typing import Any, AsyncIterator, Dict, Optional, Sequence, Tuple
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    BaseCheckpointSaver, ChannelVersions, Checkpoint, CheckpointMetadata, CheckpointTuple,
+    WRITES_IDX_MAP, get_checkpoint_id, get_checkpoint_metadata
+)
+from database_service import db_service
+
+logger = logging.getLogger("CheckpointStore")
+
+# Checkpoints mantidos por conversa (cada turno gera alguns: entrada + um por passo do grafo)
+AGENT_CHECKPOINTS_KEEP = int(os.getenv("AGENT_CHECKPOINTS_KEEP", "8"))
+
+class PostgresCheckpointSaver(BaseCheckpointSaver):
+    """
+    Checkpointer do LangGraph sobre o pool asyncpg do db_service, chaveado por thread_id
+    (o conversation_id). O estado inteiro do checkpoint é serializado em uma única linha;
+    a cada novo turno os checkpoints mais antigos da conversa são podados, então o tamanho
+    armazenado acompanha o histórico compactado, e não o número de turnos.
+    """
+    def __init__(self, keep: int = AGENT_CHECKPOINTS_KEEP):
+        super().__init__()
+        self.keep = keep
+
+    @staticmethod
+    def _config(thread_id: str, checkpoint_ns: str, checkpoint_id: str) -> RunnableConfig:
+        return {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint_id}}
+
+    async def _load_writes(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str):
+        rows = await db_service._fetch_all(
+            """SELECT task_id, channel, value_type, value FROM agent_checkpoint_writes
+               WHERE thread_id = $1 AND checkpoint_ns = $2 AND checkpoint_id = $3
+               ORDER BY task_path, task_id, idx""",
+            thread_id, checkpoint_ns, checkpoint_id
+        )
+        return [(r['task_id'], r['channel'], self.serde.loads_typed((r['value_type'], r['value']))) for r in rows]
+
+    async def _to_tuple(self, row: Dict) -> CheckpointTuple:
+        thread_id, checkpoint_ns, checkpoint_id = row['thread_id'], row['checkpoint_ns'], row['checkpoint_id']
+        return CheckpointTuple(
+            config=self._config(thread_id, checkpoint_ns, checkpoint_id),
+            checkpoint=self.serde.loads_typed((row['checkpoint_type'], row['checkpoint'])),
+            metadata=self.serde.loads_typed((row['metadata_type'], row['metadata'])),
+            parent_config=(self._config(thread_id, checkpoint_ns, row['parent_checkpoint_id'])
+                           if row['parent_checkpoint_id'] else None),
+            pending_writes=await self._load_writes(thread_id, checkpoint_ns, checkpoint_id)
+        )
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        if checkpoint_id := get_checkpoint_id(config):
+            row = await db_service._fetch_one(
+                "SELECT * FROM agent_checkpoints WHERE thread_id = $1 AND checkpoint_ns = $2 AND checkpoint_id = $3",
+                thread_id, checkpoint_ns, checkpoint_id
+            )
+        else:
+            row = await db_service._fetch_one(
+                """SELECT * FROM agent_checkpoints WHERE thread_id = $1 AND checkpoint_ns = $2
+                   ORDER BY checkpoint_id DESC LIMIT 1""",
+                thread_id, checkpoint_ns
+            )
+        return await self._to_tuple(row) if row else None
+
+    async def alist(self, config: Optional[RunnableConfig], *, filter: Optional[Dict[str, Any]] = None,
+                    before: Optional[RunnableConfig] = None, limit: Optional[int] = None) -> AsyncIterator[CheckpointTuple]:
+        clauses, args = [], []
+        if config:
+            args.append(config["configurable"]["thread_id"])
+            clauses.append(f"thread_id = ${len(args)}")
+            if "checkpoint_ns" in config["configurable"]:
+                args.append(config["configurable"]["checkpoint_ns"])
+                clauses.append(f"checkpoint_ns = ${len(args)}")
+        if before and (before_id := get_checkpoint_id(before)):
+            args.append(before_id)
+            clauses.append(f"checkpoint_id < ${len(args)}")
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = await db_service._fetch_all(f"SELECT * FROM agent_checkpoints {where} ORDER BY checkpoint_id DESC", *args)
+        returned = 0
+        for row in rows:
+            result = await self._to_tuple(row)
+            # Metadados são serializados pelo serde, então o filtro é aplicado aqui
+            if filter and any(result.metadata.get(k) != v for k, v in filter.items()):
+                continue
+            yield result
+            returned += 1
+            if limit is not None and returned >= limit:
+                break
+
+    async def aput(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+                   new_versions: ChannelVersions) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_type, checkpoint_data = self.serde.dumps_typed(checkpoint)
+        metadata = get_checkpoint_metadata(config, metadata)
+        metadata_type, metadata_data = self.serde.dumps_typed(metadata)
+        await db_service._execute(
+            """INSERT INTO agent_checkpoints
+               (thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, checkpoint_type, checkpoint, metadata_type, metadata)
+               VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
+               ON CONFLICT (thread_id, checkpoint_ns, checkpoint_id) DO UPDATE SET
+               checkpoint_type = EXCLUDED.checkpoint_type, checkpoint = EXCLUDED.checkpoint,
+               metadata_type = EXCLUDED.metadata_type, metadata = EXCLUDED.metadata""",
+            thread_id, checkpoint_ns, checkpoint["id"], config["configurable"].get("checkpoint_id"),
+            checkpoint_type, checkpoint_data, metadata_type, metadata_data
+        )
+        if metadata.get("source") == "input":
+            await self._prune(thread_id, checkpoint_ns)
+        return self._config(thread_id, checkpoint_ns, checkpoint["id"])
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str,
+                          task_path: str = "") -> None:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        # Escritas especiais (erro, interrupção...) substituem a anterior; as demais são idempotentes
+        on_conflict = ("DO UPDATE SET channel = EXCLUDED.channel, value_type = EXCLUDED.value_type, value = EXCLUDED.value"
+                       if all(channel in WRITES_IDX_MAP for channel, _ in writes) else "DO NOTHING")
+        rows = []
+        for idx, (channel, value) in enumerate(writes):
+            value_type, value_data = self.serde.dumps_typed(value)
+            rows.append((thread_id, checkpoint_ns, checkpoint_id, task_id, task_path,
+                         WRITES_IDX_MAP.get(channel, idx), channel, value_type, value_data))
+        if not db_service.pool: await db_service.initialize()
+        async with db_service.pool.acquire() as conn:
+            await conn.executemany(
+                f"""INSERT INTO agent_checkpoint_writes
+                    (thread_id, checkpoint_ns, checkpoint_id, task_id, task_path, idx, channel, value_type, value)
+                    VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
+                    ON CONFLICT (thread_id, checkpoint_ns, checkpoint_id, task_id, idx) {on_conflict}""",
+                rows
+            )
+
+    async def _prune(self, thread_id: str, checkpoint_ns: str):
+        """Remove checkpoints (e suas escritas) além dos `keep` mais recentes da conversa."""
+        if not db_service.pool: await db_service.initialize()
+        async with db_service.pool.acquire() as conn:
+            async with conn.transaction():
+                cutoff = await conn.fetchval(
+                    """SELECT checkpoint_id FROM agent_checkpoints WHERE thread_id = $1 AND checkpoint_ns = $2
+                       ORDER BY checkpoint_id DESC OFFSET $3 LIMIT 1""",
+                    thread_id, checkpoint_ns, self.keep - 1
+                )
+                if cutoff is None:
+                    return
+                for table in ("agent_checkpoint_writes", "agent_checkpoints"):
+                    await conn.execute(
+                        f"DELETE FROM {table} WHERE thread_id = $1 AND checkpoint_ns = $2 AND checkpoint_id < $3",
+                        thread_id, checkpoint_ns, cutoff
+                    )
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        for table in ("agent_checkpoint_writes", "agent_checkpoints"):
+            await db_service._execute(f"DELETE FROM {table} WHERE thread_id = $1", thread_id)
+
+checkpoint_saver = PostgresCheckpointSaver()
@@ -0,0 +1,58 @@
+import os
+import re
+import hashlib
+import numpy as np
+from typing import Dict, List
+
+RAG_DEDUP_SCOPE = os.getenv("RAG_DEDUP_SCOPE", "document")  # off | document | kb
+RAG_DEDUP_THRESHOLD = float(os.getenv("RAG_DEDUP_THRESHOLD", "0.8"))  # Jaccard estimado
+RAG_DEDUP_SHINGLE_SIZE = int(os.getenv("RAG_DEDUP_SHINGLE_SIZE", "3"))
+
+NUM_PERM = 64
+LSH_BANDS = 16  # 16 faixas x 4 linhas: candidatos a partir de Jaccard ~0.5
+
+# Semente fixa: assinaturas gravadas no banco continuam comparáveis entre execuções e workers
+_rng = np.random.default_rng(20240601)
+_A = _rng.integers(1, 2**63, size=NUM_PERM, dtype=np.uint64) | np.uint64(1)
+_B = _rng.integers(0, 2**63, size=NUM_PERM, dtype=np.uint64)
+
+def minhash(text: str, shingle_size: int = RAG_DEDUP_SHINGLE_SIZE) -> np.ndarray:
+    """Assinatura MinHash (64 x uint32) do conjunto de shingles de palavras do texto."""
+    words = re.findall(r"\w+", text.lower())
+    shingles = {" ".join(words[i:i + shingle_size]) for i in range(max(1, len(words) - shingle_size + 1))}
+    digests = b"".join(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest() for s in shingles)
+    values = np.frombuffer(digests, dtype=np.uint64)
+    # Hash multiply-shift por permutação (aritmética módulo 2^64)
+    hashed = (np.outer(values, _A) + _B) >> np.uint64(32)
+    return hashed.min(axis=0).astype("<u4")
+
+def signature_to_bytes(signature: np.ndarray) -> bytes:
+    return signature.astype("<u4").tobytes()
+
+def signature_from_bytes(data: bytes) -> np.ndarray:
+    return np.frombuffer(data, dtype="<u4")
+
+class MinHashIndex:
+    """
+    Detecção de quase-duplicatas por MinHash + LSH: só assinaturas que coincidem em alguma
+    faixa são comparadas, e a similaridade de Jaccard é estimada pela fração de mínimos iguais.
+    """
+    def __init__(self, threshold: float = RAG_DEDUP_THRESHOLD):
+        self.threshold = threshold
+        self.rows = NUM_PERM // LSH_BANDS
+        self._buckets: List[Dict[bytes, List[np.ndarray]]] = [{} for _ in range(LSH_BANDS)]
+
+    def _keys(self, signature: np.ndarray):
+        for band in range(LSH_BANDS):
+            yield signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def add(self, signature: np.ndarray):
+        for bucket, key in zip(self._buckets, self._keys(signature)):
+            bucket.setdefault(key, []).append(signature)
+
+    def is_duplicate(self, signature: np.ndarray) -> bool:
+        for bucket, key in zip(self._buckets, self._keys(signature)):
+            for other in bucket.get(key, ()):
+                if np.mean(signature == other) >= self.threshold:
+                    return True
+        return False
@@ -0,0 +1,113 @@
+import os
+import re
+import math
+import unicodedata
+from typing import List, Dict, Optional, Any, Set
+
+RAG_CONTEXT_TOKEN_BUDGET = int(os.getenv("RAG_CONTEXT_TOKEN_BUDGET", "800"))
+RAG_CONTEXT_CANDIDATES = int(os.getenv("RAG_CONTEXT_CANDIDATES", "12"))
+RAG_MMR_LAMBDA = float(os.getenv("RAG_MMR_LAMBDA", "0.7"))
+RAG_LEXICAL_WEIGHT = float(os.getenv("RAG_LEXICAL_WEIGHT", "0.5"))
+RAG_NEAR_DUPLICATE_THRESHOLD = float(os.getenv("RAG_NEAR_DUPLICATE_THRESHOLD", "0.8"))
+
+STOPWORDS = {
+    "a", "o", "as", "os", "um", "uma", "de", "do", "da", "dos", "das", "em", "no", "na", "nos", "nas",
+    "por", "para", "com", "sem", "e", "ou", "que", "se", "ao", "aos", "é", "eu", "voce", "voces",
+    "tem", "ter", "qual", "quais", "como", "me", "meu", "minha", "isso", "esse", "essa", "mais", "tambem"
+}
+
+def estimate_tokens(text: str) -> int:
+    """Estimativa rápida (~4 caracteres por token), suficiente para orçamento de prompt."""
+    return max(1, math.ceil(len(text) / 4))
+
+def content_terms(text: str) -> Set[str]:
+    """Termos normalizados (minúsculas, sem acentos, sem stopwords) para comparação lexical."""
+    text = unicodedata.normalize("NFKD", text.lower()).encode("ascii", "ignore").decode("ascii")
+    return {t for t in re.findall(r"\w+", text) if len(t) > 1 and t not in STOPWORDS}
+
+def _jaccard(a: Set[str], b: Set[str]) -> float:
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+def _truncate_to_budget(text: str, budget: int) -> str:
+    """Corta no último fim de frase que cabe no orçamento (ou no limite de caracteres)."""
+    limit = budget * 4
+    cut = text[:limit]
+    end = max(cut.rfind(". "), cut.rfind("\n"))
+    return cut[:end + 1].rstrip() if end > limit // 2 else cut.rstrip()
+
+class ContextPacker:
+    """
+    Monta o contexto do RAG a partir de candidatos sobre-buscados no search_rag:
+    re-rank local (posição na fusão + sobreposição lexical com a pergunta), seleção por
+    MMR para diversidade, descarte de quase-duplicatas e empacotamento até o orçamento de tokens.
+    """
+    def __init__(self, token_budget: int = RAG_CONTEXT_TOKEN_BUDGET, mmr_lambda: float = RAG_MMR_LAMBDA,
+                 lexical_weight: float = RAG_LEXICAL_WEIGHT, duplicate_threshold: float = RAG_NEAR_DUPLICATE_THRESHOLD):
+        self.token_budget = token_budget
+        self.mmr_lambda = mmr_lambda
+        self.lexical_weight = lexical_weight
+        self.duplicate_threshold = duplicate_threshold
+        self.stats = {"packs": 0, "candidates": 0, "selected": 0, "duplicates": 0, "tokens": 0}
+
+    def _relevance(self, query_terms: Set[str], candidates: List[Dict], terms: List[Set[str]]) -> List[float]:
+        top_score = max((c.get("score") or 0.0 for c in candidates), default=0.0) or 1.0
+        scores = []
+        for rank, (candidate, chunk_terms) in enumerate(zip(candidates, terms)):
+            # Sem score (ex.: índice em memória), usa a posição na lista
+            fused = (candidate.get("score") or 0.0) / top_score if candidate.get("score") else 1.0 / (rank + 1)
+            lexical = len(query_terms & chunk_terms) / len(query_terms) if query_terms else 0.0
+            scores.append((1 - self.lexical_weight) * fused + self.lexical_weight * lexical)
+        return scores
+
+    def pack(self, query: str, candidates: List[Dict], token_budget: Optional[int] = None) -> List[Dict]:
+        """Retorna os chunks escolhidos, em ordem de seleção, com `tokens` estimados."""
+        budget = token_budget or self.token_budget
+        self.stats["packs"] += 1
+        self.stats["candidates"] += len(candidates)
+        if not candidates:
+            return []
+
+        query_terms = content_terms(query)
+        terms = [content_terms(c.get("content", "")) for c in candidates]
+        relevance = self._relevance(query_terms, candidates, terms)
+
+        remaining = list(range(len(candidates)))
+        selected: List[int] = []
+        packed: List[Dict] = []
+        used = 0
+        while remaining and used < budget:
+            def mmr(i: int) -> float:
+                redundancy = max((_jaccard(terms[i], terms[j]) for j in selected), default=0.0)
+                return self.mmr_lambda * relevance[i] - (1 - self.mmr_lambda) * redundancy
+
+            best = max(remaining, key=mmr)
+            remaining.remove(best)
+            if any(_jaccard(terms[best], terms[j]) >= self.duplicate_threshold for j in selected):
+                self.stats["duplicates"] += 1
+                continue
+
+            content = candidates[best].get("content", "")
+            tokens = estimate_tokens(content)
+            if used + tokens > budget:
+                if packed:
+                    continue  # um chunk menor adiante ainda pode caber
+                content = _truncate_to_budget(content, budget)
+                tokens = estimate_tokens(content)
+            selected.append(best)
+            packed.append({**candidates[best], "content": content, "tokens": tokens, "relevance": round(relevance[best], 4)})
+            used += tokens
+
+        self.stats["selected"] += len(packed)
+        self.stats["tokens"] += used
+        return packed
+
+    def get_stats(self) -> Dict[str, Any]:
+        packs = self.stats["packs"] or 1
+        return {
+            **self.stats,
+            "token_budget": self.token_budget,
+            "avg_chunks": round(self.stats["selected"] / packs, 2),
+            "avg_tokens": round(self.stats["tokens"] / packs, 1)
+        }
+
+context_packer = ContextPacker()
@@ -3,7 +3,7 @@
 CREATE EXTENSION IF NOT EXISTS vector;
 
 -- Histórico de Mensagens com Sentimento
-CREATE TABLE messages (
+CREATE TABLE IF NOT EXISTS messages (
     id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
     conversation_id VARCHAR(255) NOT NULL,
     sender VARCHAR(50) NOT NULL, -- 'user', 'agent', 'system'
@@ -14,7 +14,7 @@ CREATE TABLE messages (
 );
 
 -- Gestão de Leads e CRM
-CREATE TABLE leads (
+CREATE TABLE IF NOT EXISTS leads (
     id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
     phone_number VARCHAR(20) UNIQUE NOT NULL,
     user_name VARCHAR(100),
@@ -26,15 +26,15 @@ CREATE TABLE leads (
 );
 
 -- Métricas Agregadas para o Dashboard (Cache)
-CREATE TABLE dashboard_metrics (
+CREATE TABLE IF NOT EXISTS dashboard_metrics (
     key VARCHAR(50) PRIMARY KEY,
     value JSONB NOT NULL,
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
 
 -- Índices de Performance
-CREATE INDEX idx_messages_conv ON messages(conversation_id);
-CREATE INDEX idx_leads_potential ON leads(potential);
+CREATE INDEX IF NOT EXISTS idx_messages_conv ON messages(conversation_id);
+CREATE INDEX IF NOT EXISTS idx_leads_potential ON leads(potential);
 
 -- Itens do Cardápio
 CREATE TABLE IF NOT EXISTS menu_items (
@@ -56,7 +56,42 @@ CREATE TABLE IF NOT EXISTS vector_store (
     metadata JSONB DEFAULT '{}',
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
-CREATE INDEX IF NOT EXISTS idx_vector_store_embedding ON vector_store USING ivfflat (embedding vector_cosine_ops) WITH (lists = 100);
+-- Hash do conteúdo para reindexação incremental (só chunks alterados são revetorizados)
+ALTER TABLE vector_store ADD COLUMN IF NOT EXISTS content_hash CHAR(64);
+CREATE INDEX IF NOT EXISTS idx_vector_store_source_hash ON vector_store(source_file, content_hash);
+-- Assinatura MinHash do chunk para supressão de quase-duplicatas entre documentos
+ALTER TABLE vector_store ADD COLUMN IF NOT EXISTS minhash BYTEA;
+
+-- Busca full-text (português) para a recuperação híbrida
+ALTER TABLE vector_store ADD COLUMN IF NOT EXISTS content_tsv TSVECTOR
+    GENERATED ALWAYS AS (to_tsvector('portuguese', content)) STORED;
+CREATE INDEX IF NOT EXISTS idx_vector_store_content_tsv ON vector_store USING GIN (content_tsv);
+-- O índice ANN (HNSW ou IVFFlat) é criado pela aplicação conforme RAG_ANN_INDEX (database_service.rebuild_vector_index)
+
+-- Cache de Embeddings (chave: modelo + tipo de tarefa + sha256 do conteúdo)
+CREATE TABLE IF NOT EXISTS embedding_cache (
+    model VARCHAR(100) NOT NULL,
+    task_type VARCHAR(20) NOT NULL,
+    content_hash CHAR(64) NOT NULL,
+    embedding REAL[] NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (model, task_type, content_hash)
+);
+-- Tabelas antigas (sem task_type) misturam vetores de documento e de query: são esvaziadas
+ALTER TABLE embedding_cache ADD COLUMN IF NOT EXISTS task_type VARCHAR(20);
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_index i
+        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+        WHERE i.indrelid = 'embedding_cache'::regclass AND i.indisprimary AND a.attname = 'task_type'
+    ) THEN
+        TRUNCATE embedding_cache;
+        ALTER TABLE embedding_cache DROP CONSTRAINT IF EXISTS embedding_cache_pkey;
+        ALTER TABLE embedding_cache ALTER COLUMN task_type SET NOT NULL;
+        ALTER TABLE embedding_cache ADD PRIMARY KEY (model, task_type, content_hash);
+    END IF;
+END $$;
 
 -- Servidores MCP
 CREATE TABLE IF NOT EXISTS mcp_servers (
@@ -151,3 +186,41 @@ CREATE TABLE IF NOT EXISTS llm_configs (
     is_active BOOLEAN DEFAULT false,
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
+
+-- Checkpoints do agente (estado do LangGraph por conversa)
+CREATE TABLE IF NOT EXISTS agent_checkpoints (
+    thread_id VARCHAR(255) NOT NULL,
+    checkpoint_ns VARCHAR(255) NOT NULL DEFAULT '',
+    checkpoint_id VARCHAR(64) NOT NULL,
+    parent_checkpoint_id VARCHAR(64),
+    checkpoint_type VARCHAR(32) NOT NULL,
+    checkpoint BYTEA NOT NULL,
+    metadata_type VARCHAR(32) NOT NULL,
+    metadata BYTEA NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+);
+
+CREATE TABLE IF NOT EXISTS agent_checkpoint_writes (
+    thread_id VARCHAR(255) NOT NULL,
+    checkpoint_ns VARCHAR(255) NOT NULL DEFAULT '',
+    checkpoint_id VARCHAR(64) NOT NULL,
+    task_id VARCHAR(64) NOT NULL,
+    task_path TEXT NOT NULL DEFAULT '',
+    idx INTEGER NOT NULL,
+    channel VARCHAR(255) NOT NULL,
+    value_type VARCHAR(32),
+    value BYTEA,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+);
+
+-- Decisões de roteamento do supervisor (exemplos para o roteador local)
+CREATE TABLE IF NOT EXISTS routing_examples (
+    id UUID PRIMARY KEY,
+    specialist_id VARCHAR(50) NOT NULL,
+    message TEXT NOT NULL,
+    source VARCHAR(20) DEFAULT 'llm',
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_routing_examples_specialist ON routing_examples(specialist_id, created_at DESC);
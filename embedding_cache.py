@@ -0,0 +1,151 @@
+import os
+import asyncio
+import hashlib
+import logging
+from array import array
+from collections import OrderedDict
+from typing import List, Dict, Optional, Any
+from database_service import db_service
+
+logger = logging.getLogger("EmbeddingCache")
+
+EMBEDDING_CACHE_BACKEND = os.getenv("EMBEDDING_CACHE_BACKEND", "postgres")  # postgres | disk | memory
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "embedding_cache")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "20000"))
+
+# Tipo de tarefa do embedding: o provedor gera vetores diferentes para documento e query
+DOCUMENT, QUERY = "document", "query"
+
+class EmbeddingCache:
+    """
+    Cache de embeddings em dois níveis, indexado por (modelo, tipo de tarefa, sha256(texto)).
+    Nível 1: LRU em memória. Nível 2: Postgres (tabela embedding_cache) ou disco local.
+    """
+    def __init__(self, backend: str = EMBEDDING_CACHE_BACKEND, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES):
+        self.backend = backend
+        self.max_entries = max_entries
+        self._lru: "OrderedDict[tuple, List[float]]" = OrderedDict()
+        self.stats: Dict[str, Dict[str, int]] = {}
+        self.writes = 0
+
+    def _scope_stats(self, scope: str) -> Dict[str, int]:
+        return self.stats.setdefault(scope, {"memory_hits": 0, "persistent_hits": 0, "misses": 0})
+
+    @staticmethod
+    def content_hash(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    # --- NÍVEL 1: LRU EM MEMÓRIA ---
+    def _lru_get(self, key: tuple) -> Optional[List[float]]:
+        vector = self._lru.get(key)
+        if vector is not None:
+            self._lru.move_to_end(key)
+        return vector
+
+    def _lru_put(self, key: tuple, vector: List[float]):
+        self._lru[key] = vector
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+
+    # --- NÍVEL 2: PERSISTENTE ---
+    def _disk_path(self, model: str, task: str, digest: str) -> str:
+        safe_model = model.replace("/", "_")
+        return os.path.join(EMBEDDING_CACHE_DIR, safe_model, task, digest[:2], f"{digest}.f32")
+
+    def _disk_read(self, model: str, task: str, digests: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        for digest in digests:
+            path = self._disk_path(model, task, digest)
+            if os.path.exists(path):
+                data = array("f")
+                with open(path, "rb") as f:
+                    data.frombytes(f.read())
+                found[digest] = data.tolist()
+        return found
+
+    def _disk_write(self, model: str, task: str, entries: Dict[str, List[float]]):
+        for digest, vector in entries.items():
+            path = self._disk_path(model, task, digest)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(array("f", vector).tobytes())
+
+    async def _persistent_get(self, model: str, task: str, digests: List[str]) -> Dict[str, List[float]]:
+        if self.backend == "postgres":
+            return await db_service.get_cached_embeddings(model, task, digests)
+        if self.backend == "disk":
+            # E/S de arquivo fora do event loop
+            return await asyncio.to_thread(self._disk_read, model, task, digests)
+        return {}
+
+    async def _persistent_put(self, model: str, task: str, entries: Dict[str, List[float]]):
+        if self.backend == "postgres":
+            await db_service.save_cached_embeddings(model, task, entries)
+        elif self.backend == "disk":
+            await asyncio.to_thread(self._disk_write, model, task, entries)
+
+    # --- API PÚBLICA ---
+    async def get_many(self, model: str, task: str, texts: List[str], scope: str = "ingestion") -> List[Optional[List[float]]]:
+        """Retorna os vetores em cache na mesma ordem de `texts` (None para misses)."""
+        stats = self._scope_stats(scope)
+        digests = [self.content_hash(t) for t in texts]
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        pending: Dict[str, List[int]] = {}
+
+        for i, digest in enumerate(digests):
+            vector = self._lru_get((model, task, digest))
+            if vector is not None:
+                results[i] = vector
+                stats["memory_hits"] += 1
+            else:
+                pending.setdefault(digest, []).append(i)
+
+        if pending:
+            try:
+                found = await self._persistent_get(model, task, list(pending.keys()))
+            except Exception as e:
+                logger.warning(f"Falha ao consultar cache persistente: {e}")
+                found = {}
+            for digest, positions in pending.items():
+                vector = found.get(digest)
+                if vector is not None:
+                    self._lru_put((model, task, digest), vector)
+                    stats["persistent_hits"] += len(positions)
+                    for i in positions:
+                        results[i] = vector
+                else:
+                    stats["misses"] += len(positions)
+        return results
+
+    async def put_many(self, model: str, task: str, texts: List[str], vectors: List[List[float]]):
+        """Armazena novos vetores nos dois níveis. Vetores nulos (falhas) são ignorados."""
+        entries = {}
+        for text, vector in zip(texts, vectors):
+            if not vector or not any(vector):
+                continue
+            digest = self.content_hash(text)
+            self._lru_put((model, task, digest), list(vector))
+            entries[digest] = list(vector)
+        if not entries:
+            return
+        try:
+            await self._persistent_put(model, task, entries)
+            self.writes += len(entries)
+        except Exception as e:
+            logger.warning(f"Falha ao gravar cache persistente: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        scopes = {}
+        for scope, stats in self.stats.items():
+            hits = stats["memory_hits"] + stats["persistent_hits"]
+            total = hits + stats["misses"]
+            scopes[scope] = {**stats, "hit_rate": round(hits / total, 4) if total else 0.0}
+        return {
+            "backend": self.backend,
+            "memory_entries": len(self._lru),
+            "writes": self.writes,
+            "scopes": scopes
+        }
+
+embedding_cache = EmbeddingCache()
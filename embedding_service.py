@@ -0,0 +1,181 @@
+import os
+import time
+import asyncio
+import hashlib
+import re
+import logging
+from collections import deque
+from typing import List, Dict, Any, Optional, Tuple
+from langchain_google_genai import GoogleGenerativeAIEmbeddings
+from embedding_cache import embedding_cache, DOCUMENT, QUERY
+
+logger = logging.getLogger("EmbeddingService")
+
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "gemini")  # gemini | fake
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "models/embedding-001")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "100"))
+EMBEDDING_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "4"))
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "3"))
+EMBEDDING_RETRY_BASE_DELAY = float(os.getenv("EMBEDDING_RETRY_BASE_DELAY", "0.5"))
+
+class FakeEmbeddings:
+    """
+    Embedder determinístico e offline para testes e benchmarks: bag-of-words com feature
+    hashing, então textos com palavras em comum ficam próximos (a busca vetorial tem sinal real).
+    """
+    def __init__(self, size: int = 768):
+        self.size = size
+
+    def embed_query(self, text: str) -> List[float]:
+        vector = [0.0] * self.size
+        for token in re.findall(r"\w+", text.lower()) or [text]:
+            digest = hashlib.sha256(token.encode("utf-8")).digest()
+            index = int.from_bytes(digest[:4], "big") % self.size
+            vector[index] += 1.0 if digest[4] & 1 else -1.0
+        norm = sum(v * v for v in vector) ** 0.5 or 1.0
+        return [v / norm for v in vector]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.embed_query(t) for t in texts]
+
+class LatencyTracker:
+    """Janela deslizante de latências (ms) por operação."""
+    def __init__(self, window: int = 500):
+        self.samples: Dict[str, deque] = {}
+        self.counts: Dict[str, int] = {}
+        self.window = window
+
+    def record(self, operation: str, elapsed_ms: float):
+        self.samples.setdefault(operation, deque(maxlen=self.window)).append(elapsed_ms)
+        self.counts[operation] = self.counts.get(operation, 0) + 1
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        result = {}
+        for operation, samples in self.samples.items():
+            ordered = sorted(samples)
+            result[operation] = {
+                "calls": self.counts[operation],
+                "avg_ms": round(sum(ordered) / len(ordered), 2),
+                "p50_ms": round(ordered[int(0.50 * (len(ordered) - 1))], 2),
+                "p95_ms": round(ordered[int(0.95 * (len(ordered) - 1))], 2),
+            }
+        return result
+
+class EmbeddingService:
+    """
+    Serviço assíncrono único de embeddings, compartilhado por ingestão e busca.
+    Garante o mesmo modelo para documentos e queries, consulta o cache antes do provedor,
+    executa lotes fora do event loop e colapsa queries idênticas concorrentes.
+    """
+    def __init__(self, model: str = EMBEDDING_MODEL, embeddings=None,
+                 batch_size: int = EMBEDDING_BATCH_SIZE, max_concurrency: int = EMBEDDING_MAX_CONCURRENCY,
+                 max_retries: int = EMBEDDING_MAX_RETRIES):
+        # A chave de API é obtida automaticamente do ambiente (GOOGLE_API_KEY ou API_KEY)
+        if embeddings is None:
+            if EMBEDDING_PROVIDER == "fake":
+                embeddings = FakeEmbeddings()
+                model = f"fake-bow/{model}"
+            else:
+                embeddings = GoogleGenerativeAIEmbeddings(model=model)
+        self.model = model
+        self.embeddings = embeddings
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.latency = LatencyTracker()
+        self.collapsed_queries = 0
+
+    async def _with_retry(self, fn, *args):
+        """
+        Executa a chamada ao provedor fora do event loop, com retry e backoff exponencial.
+        A vaga de concorrência vale só para a chamada: o backoff não segura os outros lotes.
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self._semaphore:
+                    started = time.perf_counter()
+                    try:
+                        return await asyncio.to_thread(fn, *args)
+                    finally:
+                        self.latency.record(fn.__name__, (time.perf_counter() - started) * 1000)
+            except Exception as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = EMBEDDING_RETRY_BASE_DELAY * (2 ** attempt)
+                logger.warning(f"Falha ao gerar embeddings ({e}). Nova tentativa em {delay:.1f}s.")
+                await asyncio.sleep(delay)
+
+    async def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        vectors = await self._with_retry(self.embeddings.embed_documents, texts)
+        if len(vectors) != len(texts):
+            raise ValueError(f"Provedor retornou {len(vectors)} vetores para {len(texts)} textos.")
+        return vectors
+
+    async def aembed_documents(self, texts: List[str]) -> Tuple[List[Optional[List[float]]], List[Dict[str, Any]]]:
+        """
+        Gera embeddings consultando antes o cache; apenas textos inéditos vão ao provedor,
+        em lotes concorrentes e limitados. Retorna (vetores, lotes_falhos); itens de lotes
+        que falharam ficam como None em vez de virarem vetores zerados.
+        """
+        cached = await embedding_cache.get_many(self.model, DOCUMENT, texts)
+        missing = [i for i, v in enumerate(cached) if v is None]
+        failed_batches: List[Dict[str, Any]] = []
+        if not missing:
+            return cached, failed_batches
+
+        batches = [missing[i:i + self.batch_size] for i in range(0, len(missing), self.batch_size)]
+        results = await asyncio.gather(
+            *[self._embed_batch([texts[i] for i in batch]) for batch in batches],
+            return_exceptions=True
+        )
+
+        for batch, result in zip(batches, results):
+            if isinstance(result, BaseException):
+                logger.error(f"Lote de {len(batch)} embeddings falhou: {result}")
+                failed_batches.append({"indices": batch, "size": len(batch), "error": str(result)})
+                continue
+            batch_texts = [texts[i] for i in batch]
+            await embedding_cache.put_many(self.model, DOCUMENT, batch_texts, result)
+            for i, vector in zip(batch, result):
+                cached[i] = vector
+
+        logger.info(f"{len(texts) - len(missing)}/{len(texts)} embeddings reaproveitados do cache.")
+        return cached, failed_batches
+
+    async def _embed_query_uncollapsed(self, text: str) -> List[float]:
+        cached = (await embedding_cache.get_many(self.model, QUERY, [text], scope="query"))[0]
+        if cached is not None:
+            return cached
+        vector = await self._with_retry(self.embeddings.embed_query, text)
+        await embedding_cache.put_many(self.model, QUERY, [text], [vector])
+        return vector
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """Embedding de uma query; chamadas concorrentes com o mesmo texto compartilham a mesma requisição."""
+        started = time.perf_counter()
+        inflight = self._inflight.get(text)
+        if inflight is not None:
+            self.collapsed_queries += 1
+            return await asyncio.shield(inflight)
+
+        future = asyncio.ensure_future(self._embed_query_uncollapsed(text))
+        self._inflight[text] = future
+        try:
+            return await asyncio.shield(future)
+        finally:
+            self._inflight.pop(text, None)
+            self.latency.record("aembed_query", (time.perf_counter() - started) * 1000)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            "provider": EMBEDDING_PROVIDER,
+            "collapsed_queries": self.collapsed_queries,
+            "inflight_queries": len(self._inflight),
+            "latency": self.latency.summary(),
+            "cache": embedding_cache.get_stats()
+        }
+
+embedding_service = EmbeddingService()
@@ -0,0 +1,128 @@
+import os
+import time
+import uuid
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, Any, Optional
+from pydantic import BaseModel
+from database_service import db_service
+from rag_pipeline import rag_manager
+
+logger = logging.getLogger("IngestionJobs")
+
+RAG_INGESTION_MAX_CONCURRENT = int(os.getenv("RAG_INGESTION_MAX_CONCURRENT", "2"))
+# Jobs encerrados (concluídos, falhos ou cancelados) continuam consultáveis por este tempo
+RAG_INGESTION_JOB_TTL_SECONDS = int(os.getenv("RAG_INGESTION_JOB_TTL_SECONDS", "3600"))
+
+class IngestionJob(BaseModel):
+    id: str
+    file_name: str
+    content_hash: str
+    status: str  # 'queued', 'running', 'completed', 'failed', 'cancelled'
+    progress: Dict[str, int] = {}
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    created_at: str
+    updated_at: str
+
+class IngestionScheduler:
+    """
+    Executa ingestões RAG em background com concorrência limitada.
+    O progresso de cada job é publicado como INGESTION_PROGRESS no WebSocket.
+    Jobs encerrados são descartados após `job_ttl_seconds`.
+    """
+    def __init__(self, max_concurrent: int = RAG_INGESTION_MAX_CONCURRENT,
+                 job_ttl_seconds: int = RAG_INGESTION_JOB_TTL_SECONDS):
+        self.jobs: Dict[str, IngestionJob] = {}
+        self.job_ttl_seconds = job_ttl_seconds
+        self._finished_at: Dict[str, float] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._path_refs: Dict[str, int] = {}
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+
+    async def _publish(self, job: IngestionJob):
+        job.updated_at = datetime.now().isoformat()
+        await db_service._emit("INGESTION_PROGRESS", job.model_dump())
+
+    def _evict_finished(self):
+        cutoff = time.monotonic() - self.job_ttl_seconds
+        for job_id in [j for j, finished in self._finished_at.items() if finished < cutoff]:
+            del self._finished_at[job_id]
+            self.jobs.pop(job_id, None)
+
+    def _release_path(self, file_path: str):
+        """Arquivos temporários são endereçados por conteúdo; só são removidos sem jobs pendentes."""
+        self._path_refs[file_path] -= 1
+        if self._path_refs[file_path] <= 0:
+            del self._path_refs[file_path]
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+    async def submit(self, file_path: str, file_name: str, content_hash: str, user_id: str = "system") -> IngestionJob:
+        self._evict_finished()
+        now = datetime.now().isoformat()
+        job = IngestionJob(
+            id=str(uuid.uuid4()), file_name=file_name, content_hash=content_hash,
+            status="queued", created_at=now, updated_at=now
+        )
+        self.jobs[job.id] = job
+        self._path_refs[file_path] = self._path_refs.get(file_path, 0) + 1
+        self._tasks[job.id] = asyncio.create_task(self._run(job, file_path, user_id))
+        await self._publish(job)
+        return job
+
+    async def _run(self, job: IngestionJob, file_path: str, user_id: str):
+        async def on_progress(progress: Dict[str, int]):
+            job.progress = dict(progress)
+            await self._publish(job)
+
+        try:
+            # Uma ingestão por documento de cada vez: o diff incremental parte do que a anterior gravou
+            async with db_service.source_lock(job.file_name), self._semaphore:
+                job.status = "running"
+                await self._publish(job)
+                result = await rag_manager.process_and_index(
+                    file_path, user_id, source_name=job.file_name, on_progress=on_progress
+                )
+            job.result = result
+            if result["status"] == "error":
+                job.status = "failed"
+                job.error = result.get("message")
+            else:
+                job.status = "completed"
+                asyncio.create_task(self._refresh_vector_index())
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+        except Exception as e:
+            logger.error(f"Job de ingestão {job.id} falhou: {e}")
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            self._tasks.pop(job.id, None)
+            self._finished_at[job.id] = time.monotonic()
+            self._release_path(file_path)
+            await self._publish(job)
+
+    async def _refresh_vector_index(self):
+        try:
+            await db_service.maybe_rebuild_vector_index()
+        except Exception as e:
+            logger.error(f"Falha ao reconstruir o índice vetorial: {e}")
+
+    def get(self, job_id: str) -> Optional[IngestionJob]:
+        self._evict_finished()
+        return self.jobs.get(job_id)
+
+    async def cancel(self, job_id: str) -> bool:
+        task = self._tasks.get(job_id)
+        if not task:
+            return False
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        return True
+
+ingestion_scheduler = IngestionScheduler()
@@ -0,0 +1,228 @@
+import os
+import re
+import asyncio
+import json
+import time
+import hashlib
+import logging
+import unicodedata
+import numpy as np
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from context_packer import content_terms
+from embedding_service import embedding_service, LatencyTracker
+from database_service import db_service
+
+logger = logging.getLogger("IntentRouter")
+
+# Vantagem mínima do primeiro sobre o segundo colocado para decidir sem o LLM
+ROUTER_MIN_MARGIN = float(os.getenv("ROUTER_MIN_MARGIN", "0.15"))
+ROUTER_CACHE_TTL_SECONDS = int(os.getenv("ROUTER_CACHE_TTL_SECONDS", "1800"))
+ROUTER_CACHE_MAX_ENTRIES = int(os.getenv("ROUTER_CACHE_MAX_ENTRIES", "5000"))
+ROUTER_MAX_EXAMPLES = int(os.getenv("ROUTER_MAX_EXAMPLES", "200"))
+# Padrões extras por especialista, ex.: {"a1": ["\\bcombo\\b"], "a2": ["\\bnota fiscal\\b"]}
+ROUTER_PATTERNS: Dict[str, List[str]] = json.loads(os.getenv("ROUTER_PATTERNS", "{}"))
+
+# Peso do perfil (nome/papel/descrição) no centróide frente a cada exemplo aprendido
+PROFILE_WEIGHT = 3.0
+SCORE_WEIGHTS = {"regex": 0.4, "keyword": 0.2, "embedding": 0.4}
+
+# Padrões de intenção aplicados a especialistas cujo perfil contém alguma das pistas
+INTENT_PATTERNS = [
+    ({"venda", "vendas", "pedido", "pedidos", "upsell", "sales", "fechamento"},
+     r"\b(quero|queria|pedir|fazer (um )?pedido|comprar|cardapio|preco|quanto custa|promocao|combo|pix|sabores?)\b"),
+    ({"suporte", "problema", "problemas", "support", "success", "duvidas", "reclamacao"},
+     r"\b(atras\w*|demor\w*|errad\w*|reclama\w*|problema|cancel\w*|reembols\w*|estorno|frio|nao chegou|onde esta)\b"),
+]
+
+def _normalize(text: str) -> str:
+    """Minúsculas e sem acentos, para os padrões de intenção."""
+    return unicodedata.normalize("NFKD", text.lower()).encode("ascii", "ignore").decode("ascii")
+
+def _unit(vector) -> Optional[np.ndarray]:
+    array = np.asarray(vector, dtype=np.float32)
+    norm = float(np.linalg.norm(array))
+    return array / norm if norm else None
+
+def _as_dict(specialist: Any) -> Dict:
+    # Aceita SpecialistModel (pydantic) ou dict
+    return specialist.model_dump() if hasattr(specialist, "model_dump") else dict(specialist)
+
+async def _embed_as_queries(texts: List[str]) -> List[Optional[np.ndarray]]:
+    """
+    Perfis e exemplos usam o mesmo tipo de tarefa das mensagens roteadas (query): o provedor
+    gera vetores diferentes para documento e query, e o cosseno só compara o mesmo espaço.
+    """
+    vectors = await asyncio.gather(*[embedding_service.aembed_query(t) for t in texts], return_exceptions=True)
+    return [None if isinstance(v, BaseException) else _unit(v) for v in vectors]
+
+class SpecialistProfile:
+    def __init__(self, spec: Dict):
+        self.id = spec["id"]
+        self.text = f"{spec.get('name', '')}. {spec.get('role', '')}. {spec.get('description', '')}"
+        self.keywords: Set[str] = content_terms(f"{self.text} {spec.get('system_prompt', '')}")
+        sources = [pattern for hints, pattern in INTENT_PATTERNS if hints & self.keywords]
+        self.patterns = [re.compile(p) for p in sources + ROUTER_PATTERNS.get(self.id, [])]
+        self.profile_vector: Optional[np.ndarray] = None
+        self.centroid: Optional[np.ndarray] = None
+
+class IntentRouter:
+    """
+    Roteamento em camadas: regex de intenção, sobreposição de palavras-chave e similaridade
+    com o centróide de embeddings de cada especialista (perfil + decisões anteriores do LLM)
+    decidem localmente quando há margem suficiente; só mensagens ambíguas sem decisão prévia
+    na conversa escalam para o LLM, cuja escolha vira exemplo para o centróide.
+    """
+    def __init__(self, min_margin: float = ROUTER_MIN_MARGIN):
+        self.min_margin = min_margin
+        self._profiles: Dict[str, SpecialistProfile] = {}
+        self._fingerprint: Optional[str] = None
+        self._examples: Dict[str, deque] = {}
+        self._examples_loaded = False
+        self._conversations: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self.latency = LatencyTracker()
+        self.stats = {"requests": 0, "local": 0, "conversation_cache": 0, "llm": 0, "llm_errors": 0, "llm_invalid": 0}
+
+    # --- PERFIS ---
+    async def _load_examples(self):
+        if self._examples_loaded:
+            return
+        self._examples_loaded = True
+        try:
+            rows = await db_service.get_routing_examples(ROUTER_MAX_EXAMPLES)
+        except Exception as e:
+            logger.error(f"Exemplos de roteamento indisponíveis: {e}")
+            return
+        if not rows:
+            return
+        for row, unit in zip(rows, await _embed_as_queries([r["message"] for r in rows])):
+            if unit is not None:
+                self._examples.setdefault(row["specialist_id"], deque(maxlen=ROUTER_MAX_EXAMPLES)).append(unit)
+
+    def _update_centroid(self, profile: SpecialistProfile):
+        parts = [v for v in self._examples.get(profile.id, ())]
+        if profile.profile_vector is not None:
+            parts.append(profile.profile_vector * PROFILE_WEIGHT)
+        profile.centroid = _unit(np.sum(parts, axis=0)) if parts else None
+
+    async def _ensure_profiles(self, specialists: List[Dict]):
+        fingerprint = hashlib.sha256(json.dumps(
+            [(s["id"], s.get("name"), s.get("role"), s.get("description")) for s in specialists]
+        ).encode("utf-8")).hexdigest()
+        if fingerprint == self._fingerprint:
+            return
+        await self._load_examples()
+        profiles = {s["id"]: SpecialistProfile(s) for s in specialists}
+        for profile, unit in zip(profiles.values(), await _embed_as_queries([p.text for p in profiles.values()])):
+            profile.profile_vector = unit
+            self._update_centroid(profile)
+        self._profiles = profiles
+        self._fingerprint = fingerprint
+
+    # --- CLASSIFICAÇÃO LOCAL ---
+    def _scores(self, message: str, query_vector: Optional[np.ndarray]) -> List[Tuple[float, str]]:
+        normalized = _normalize(message)
+        terms = content_terms(message)
+        scored = []
+        for profile in self._profiles.values():
+            regex = 1.0 if any(p.search(normalized) for p in profile.patterns) else 0.0
+            keyword = len(terms & profile.keywords) / len(terms) if terms else 0.0
+            embedding = float(query_vector @ profile.centroid) if query_vector is not None and profile.centroid is not None else 0.0
+            score = (SCORE_WEIGHTS["regex"] * regex + SCORE_WEIGHTS["keyword"] * keyword
+                     + SCORE_WEIGHTS["embedding"] * max(0.0, embedding))
+            scored.append((score, profile.id))
+        return sorted(scored, reverse=True)
+
+    # --- CACHE POR CONVERSA ---
+    def _cached(self, conversation_id: Optional[str]) -> Optional[str]:
+        entry = self._conversations.get(conversation_id) if conversation_id else None
+        if entry and time.time() - entry[1] < ROUTER_CACHE_TTL_SECONDS and entry[0] in self._profiles:
+            return entry[0]
+        return None
+
+    def _remember(self, conversation_id: Optional[str], specialist_id: str):
+        if not conversation_id:
+            return
+        self._conversations[conversation_id] = (specialist_id, time.time())
+        self._conversations.move_to_end(conversation_id)
+        while len(self._conversations) > ROUTER_CACHE_MAX_ENTRIES:
+            self._conversations.popitem(last=False)
+
+    async def _learn(self, specialist_id: str, message: str, query_vector: Optional[np.ndarray]):
+        if query_vector is not None and specialist_id in self._profiles:
+            self._examples.setdefault(specialist_id, deque(maxlen=ROUTER_MAX_EXAMPLES)).append(query_vector)
+            self._update_centroid(self._profiles[specialist_id])
+        try:
+            await db_service.save_routing_example(specialist_id, message, "llm")
+        except Exception as e:
+            logger.error(f"Falha ao salvar exemplo de roteamento: {e}")
+
+    async def route(self, message: str, specialists: List[Any], conversation_id: Optional[str] = None,
+                    escalate: Optional[Callable[[str, List[Dict]], Awaitable[str]]] = None) -> str:
+        started = time.perf_counter()
+        self.stats["requests"] += 1
+        specs = [_as_dict(s) for s in specialists]
+        specs = [s for s in specs if s.get("status", "active") == "active"] or specs
+        # Ids repetidos viram um único perfil: a contagem abaixo precisa ser a de perfis
+        specs = list({s["id"]: s for s in specs}.values())
+        if not specs:
+            return "default"
+        if len(specs) == 1:
+            self.stats["local"] += 1
+            return specs[0]["id"]
+
+        await self._ensure_profiles(specs)
+        try:
+            query_vector = _unit(await embedding_service.aembed_query(message))
+        except Exception as e:
+            logger.error(f"Embedding indisponível para o roteamento: {e}")
+            query_vector = None
+        scored = self._scores(message, query_vector)
+        if len(scored) < 2:
+            self.stats["local"] += 1
+            return scored[0][1]
+        (top_score, top_id), (second_score, _) = scored[0], scored[1]
+
+        tier = "local"
+        if top_score - second_score >= self.min_margin:
+            specialist_id = top_id
+        elif (cached := self._cached(conversation_id)) is not None:
+            specialist_id, tier = cached, "conversation_cache"
+        elif escalate is not None:
+            tier = "llm"
+            try:
+                answer = (await escalate(message, specs)).strip()
+                chosen = next((s["id"] for s in specs if s["id"] == answer), None) or \
+                    next((s["id"] for s in specs if re.search(rf"\b{re.escape(s['id'])}\b", answer)), None)
+                if chosen is not None:
+                    # Só decisões válidas do LLM viram exemplo para o centróide
+                    await self._learn(chosen, message, query_vector)
+                else:
+                    self.stats["llm_invalid"] += 1
+                    logger.warning(f"Roteamento pelo LLM devolveu id desconhecido ({answer!r}), usando decisão local.")
+                specialist_id = chosen or top_id
+            except Exception as e:
+                self.stats["llm_errors"] += 1
+                logger.error(f"Roteamento pelo LLM falhou, usando decisão local: {e}")
+                specialist_id = top_id
+        else:
+            specialist_id = top_id
+
+        self.stats[tier] += 1
+        self._remember(conversation_id, specialist_id)
+        self.latency.record(tier, (time.perf_counter() - started) * 1000)
+        return specialist_id
+
+    def get_stats(self) -> Dict[str, Any]:
+        requests = self.stats["requests"] or 1
+        return {
+            **self.stats,
+            "llm_escalation_share": round(self.stats["llm"] / requests, 4),
+            "min_margin": self.min_margin,
+            "specialists": len(self._profiles),
+            "learned_examples": {k: len(v) for k, v in self._examples.items()},
+            "conversations_cached": len(self._conversations),
+            "latency": self.latency.summary()
+        }
+
+intent_router = IntentRouter()
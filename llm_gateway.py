@@ -0,0 +1,142 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Dict, List, Any, Optional, Tuple
+from google import genai
+from embedding_service import LatencyTracker
+
+logger = logging.getLogger("LLMGateway")
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+# Tetos das classes de menor prioridade: o restante das vagas fica sempre livre para atendimentos ao vivo
+LLM_BACKGROUND_MAX_CONCURRENCY = int(os.getenv("LLM_BACKGROUND_MAX_CONCURRENCY", "4"))
+LLM_ADMIN_MAX_CONCURRENCY = int(os.getenv("LLM_ADMIN_MAX_CONCURRENCY", "2"))
+DEFAULT_GENAI_MODEL = os.getenv("DEFAULT_GENAI_MODEL", "gemini-2.0-flash")
+
+# Classes de prioridade (menor número = atendido antes)
+CUSTOMER = "customer"      # turnos de clientes ao vivo (agente, supervisor, transcrição)
+BACKGROUND = "background"  # análises automáticas (sentimento, recomendação)
+ADMIN = "admin"            # ferramentas do painel (refinar prompt, gerar tabela, lições)
+PRIORITIES = {CUSTOMER: 0, BACKGROUND: 1, ADMIN: 2}
+
+class PriorityLimiter:
+    """
+    Semáforo com prioridade: vagas liberadas vão para o pedido de maior prioridade
+    (FIFO dentro da classe), respeitando o teto de concorrência de cada classe.
+    """
+    def __init__(self, capacity: int, class_limits: Dict[str, int]):
+        self.capacity = capacity
+        self.class_limits = class_limits
+        self.in_flight = {cls: 0 for cls in PRIORITIES}
+        self._waiters: List[Tuple[int, int, str, asyncio.Future]] = []
+        self._seq = 0
+
+    @property
+    def total_in_flight(self) -> int:
+        return sum(self.in_flight.values())
+
+    def queued(self) -> Dict[str, int]:
+        counts = {cls: 0 for cls in PRIORITIES}
+        for _, _, cls, _ in self._waiters:
+            counts[cls] += 1
+        return counts
+
+    def _can_run(self, cls: str) -> bool:
+        return (self.total_in_flight < self.capacity
+                and self.in_flight[cls] < self.class_limits.get(cls, self.capacity))
+
+    def _dispatch(self):
+        for waiter in list(self._waiters):
+            if self.total_in_flight >= self.capacity:
+                break
+            _, _, cls, future = waiter
+            if self._can_run(cls):
+                self._waiters.remove(waiter)
+                self.in_flight[cls] += 1
+                future.set_result(None)
+
+    async def acquire(self, cls: str):
+        future = asyncio.get_running_loop().create_future()
+        self._seq += 1
+        self._waiters.append((PRIORITIES[cls], self._seq, cls, future))
+        self._waiters.sort(key=lambda w: w[:2])
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(cls)
+            else:
+                self._waiters = [w for w in self._waiters if w[3] is not future]
+            raise
+
+    def release(self, cls: str):
+        self.in_flight[cls] -= 1
+        self._dispatch()
+
+class LLMGateway:
+    """
+    Ponto único de chamadas a LLMs: tudo é assíncrono (nada bloqueia o event loop) e passa
+    por um limite global de concorrência com classes de prioridade, de modo que rajadas de
+    ferramentas administrativas nunca deixam conversas de clientes na fila.
+    """
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY):
+        self.limiter = PriorityLimiter(max_concurrency, {
+            CUSTOMER: max_concurrency,
+            BACKGROUND: min(LLM_BACKGROUND_MAX_CONCURRENCY, max_concurrency),
+            ADMIN: min(LLM_ADMIN_MAX_CONCURRENCY, max_concurrency)
+        })
+        self.queue_latency = LatencyTracker()
+        self.call_latency = LatencyTracker()
+        self.errors: Dict[str, int] = {}
+        self._client = None
+
+    @property
+    def client(self):
+        # Criado na primeira chamada: importar os módulos não exige API_KEY
+        if self._client is None:
+            self._client = genai.Client(api_key=os.environ.get("API_KEY"))
+        return self._client
+
+    @asynccontextmanager
+    async def slot(self, priority: str = CUSTOMER, operation: str = "chat"):
+        """Reserva uma vaga para uma chamada (ou um stream) ao LLM, registrando a espera na fila."""
+        queued_at = time.perf_counter()
+        await self.limiter.acquire(priority)
+        started = time.perf_counter()
+        self.queue_latency.record(priority, (started - queued_at) * 1000)
+        try:
+            yield
+        except Exception:
+            self.errors[operation] = self.errors.get(operation, 0) + 1
+            raise
+        finally:
+            self.limiter.release(priority)
+            self.call_latency.record(operation, (time.perf_counter() - started) * 1000)
+
+    async def generate(self, contents: Any, model: str = DEFAULT_GENAI_MODEL, priority: str = ADMIN,
+                       operation: str = "generate", config: Optional[Dict] = None) -> str:
+        async with self.slot(priority, operation):
+            response = await self.client.aio.models.generate_content(model=model, contents=contents, config=config)
+        return (response.text or "").strip()
+
+    async def generate_json(self, contents: Any, model: str = DEFAULT_GENAI_MODEL, priority: str = ADMIN,
+                            operation: str = "generate_json") -> Any:
+        text = await self.generate(contents, model, priority, operation, config={"response_mime_type": "application/json"})
+        return json.loads(text)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "capacity": self.limiter.capacity,
+            "class_limits": self.limiter.class_limits,
+            "in_flight": dict(self.limiter.in_flight),
+            "queued": self.limiter.queued(),
+            "queue_ms": self.queue_latency.summary(),
+            "call_ms": self.call_latency.summary(),
+            "errors": self.errors
+        }
+
+llm_gateway = LLMGateway()
@@ -0,0 +1,196 @@
+import os
+import random
+import asyncio
+import hashlib
+import logging
+from urllib.parse import parse_qs
+from typing import Dict, List, Optional, Any, Tuple
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from database_service import db_service
+
+logger = logging.getLogger("LLMRegistry")
+
+DEFAULT_LLM_PROVIDER = os.getenv("DEFAULT_LLM_PROVIDER", "gemini")
+DEFAULT_LLM_MODEL = os.getenv("DEFAULT_LLM_MODEL", "gemini-3-flash-preview")
+LLM_CONFIG_CHANNEL = "llm_config_update"
+MAX_BOUND_VARIANTS = 32
+
+class FakeChatModel(BaseChatModel):
+    """
+    Provedor local para testes de failover/hedging, sem rede: responde após `latency_ms`
+    (+ jitter aleatório) e falha com probabilidade `error_rate`.
+    Configurado como provider "fake" com model "nome?latency_ms=800&error_rate=0.2".
+    """
+    name: str = "fake"
+    latency_ms: float = 200.0
+    jitter_ms: float = 0.0
+    error_rate: float = 0.0
+    reply: str = "Resposta simulada."
+
+    @classmethod
+    def from_spec(cls, spec: str) -> "FakeChatModel":
+        name, _, query = spec.partition("?")
+        params = {k: v[-1] for k, v in parse_qs(query).items()}
+        return cls(name=name or "fake", reply=params.get("reply", f"[{name or 'fake'}] Resposta simulada."),
+                   **{k: float(params[k]) for k in ("latency_ms", "jitter_ms", "error_rate") if k in params})
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-provider"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    async def _delay_or_fail(self):
+        await asyncio.sleep((self.latency_ms + random.uniform(0, self.jitter_ms)) / 1000)
+        if random.random() < self.error_rate:
+            raise RuntimeError(f"Falha simulada no provedor {self.name}")
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        return asyncio.run(self._agenerate(messages, stop, **kwargs))
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        await self._delay_or_fail()
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.reply))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await self._delay_or_fail()
+        for word in self.reply.split(" "):
+            yield ChatGenerationChunk(message=AIMessageChunk(content=f"{word} "))
+
+class ModelRegistry:
+    """
+    Cache de clientes LLM por (provedor, modelo, fingerprint da chave) e das variantes com
+    ferramentas vinculadas (bind_tools). A configuração ativa (llm_configs) é lida uma vez e
+    só é relida quando save_llm_config publica em `llm_config_update` (todos os workers).
+    """
+    def __init__(self, default_provider: str = DEFAULT_LLM_PROVIDER, default_model: str = DEFAULT_LLM_MODEL):
+        self.default_provider = default_provider
+        self.default_model = default_model
+        self._clients: Dict[Tuple[str, str, str], Any] = {}
+        self._bound: Dict[Tuple, Any] = {}
+        self._config: Optional[Dict] = None
+        self._config_loaded = False
+        self._configs: Optional[List[Dict]] = None
+        self.stats = {"client_builds": 0, "bind_builds": 0, "config_loads": 0, "invalidations": 0}
+
+    @staticmethod
+    def _fingerprint(api_key: Optional[str]) -> str:
+        return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12] if api_key else "env"
+
+    @staticmethod
+    def _create(provider: str, model: str, api_key: Optional[str], cached_content: Optional[str] = None):
+        if provider == 'fake':
+            return FakeChatModel.from_spec(model)
+        if provider == 'openai':
+            from langchain_openai import ChatOpenAI
+            return ChatOpenAI(model=model, api_key=api_key) if api_key else ChatOpenAI(model=model)
+        if provider == 'groq':
+            from langchain_groq import ChatGroq
+            return ChatGroq(model=model, api_key=api_key) if api_key else ChatGroq(model=model)
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        # Com CachedContent a instrução de sistema já está no cache e o provedor não aceita outra:
+        # a mensagem de sistema do turno segue como texto no início da conversa
+        extra = {"cached_content": cached_content, "convert_system_message_to_human": True} if cached_content else {}
+        return ChatGoogleGenerativeAI(model=model, google_api_key=api_key, **extra) if api_key else ChatGoogleGenerativeAI(model=model, **extra)
+
+    def _client_key(self, config: Optional[Dict]) -> Tuple[str, str, str]:
+        if not config:
+            return (self.default_provider, self.default_model, "env")
+        return (config['provider'].lower(), config['model'], self._fingerprint(config.get('apiKey')))
+
+    def get_client(self, provider: str, model: str, api_key: Optional[str] = None):
+        key = (provider.lower(), model, self._fingerprint(api_key))
+        client = self._clients.get(key)
+        if client is None:
+            client = self._create(key[0], model, api_key)
+            self._clients[key] = client
+            self.stats["client_builds"] += 1
+            logger.info(f"Cliente LLM criado: {key[0]}/{model}")
+        return client
+
+    async def get_active_config(self) -> Optional[Dict]:
+        if not self._config_loaded:
+            try:
+                self._config = await db_service.get_active_llm_config()
+                self._config_loaded = True
+                self.stats["config_loads"] += 1
+            except Exception as e:
+                # Sem marcar como carregado: a próxima chamada tenta o banco de novo
+                print(f"Error loading LLM config: {e}. Using default.")
+                return None
+        return self._config
+
+    async def get_configured(self) -> List[Dict]:
+        """Todos os provedores em llm_configs (o ativo primeiro), para o pool de failover."""
+        if self._configs is None:
+            try:
+                self._configs = await db_service.get_llm_configs()
+            except Exception as e:
+                print(f"Error loading LLM configs: {e}.")
+                return []
+        return self._configs
+
+    async def get_model(self, config: Optional[Dict] = None):
+        config = config or await self.get_active_config()
+        if not config:
+            return self.get_client(self.default_provider, self.default_model)
+        return self.get_client(config['provider'], config['model'], config.get('apiKey'))
+
+    async def get_bound_model(self, tools: List, tools_key: Optional[Any] = None, config: Optional[Dict] = None):
+        """
+        Modelo com as ferramentas vinculadas (o ativo, ou o de `config`); reaproveitado
+        enquanto modelo e ferramentas não mudam.
+        """
+        config = config or await self.get_active_config()
+        model = await self.get_model(config)
+        if tools_key is None:
+            tools_key = tuple((t.name, t.description) for t in tools)
+        key = (self._client_key(config), tools_key)
+        bound = self._bound.get(key)
+        if bound is None:
+            if len(self._bound) >= MAX_BOUND_VARIANTS:
+                self._bound.clear()
+            bound = model.bind_tools(tools)
+            self._bound[key] = bound
+            self.stats["bind_builds"] += 1
+        return bound
+
+    async def get_cached_model(self, cached_content: str):
+        """Modelo ativo apontando para um conteúdo em cache no provedor (Gemini), que já inclui as ferramentas."""
+        config = await self.get_active_config()
+        key = (self._client_key(config), "cached_content", cached_content)
+        client = self._bound.get(key)
+        if client is None:
+            provider, model, _ = self._client_key(config)
+            client = self._create(provider, model, config.get('apiKey') if config else None, cached_content=cached_content)
+            self._bound[key] = client
+            self.stats["client_builds"] += 1
+        return client
+
+    async def invalidate(self, event: Optional[Dict] = None):
+        self._clients.clear()
+        self._bound.clear()
+        self._config = None
+        self._config_loaded = False
+        self._configs = None
+        self.stats["invalidations"] += 1
+
+    async def start(self):
+        """Assina invalidações de configuração publicadas por qualquer worker."""
+        try:
+            await db_service.listen(LLM_CONFIG_CHANNEL, self.invalidate)
+        except Exception as e:
+            logger.error(f"Invalidação entre workers indisponível para a configuração do LLM: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "clients": len(self._clients),
+            "bound_variants": len(self._bound),
+            "active": self._client_key(self._config)[:2] if self._config_loaded else None
+        }
+
+model_registry = ModelRegistry()
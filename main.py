@@ -6,22 +6,33 @@ from typing import List, Optional, Dict, Any
 import asyncio
 import uuid
 import os
-import shutil
 import secrets
 import hashlib
 from datetime import datetime
-from google import genai
 
-from app.agent import LangGraphAgent, supervisor
+from app.agent import LangGraphAgent, agent
+from answer_cache import answer_cache
+from retrieval_cache import retrieval_cache
+from context_packer import context_packer
+from llm_registry import model_registry
+from llm_gateway import llm_gateway, ADMIN
+from prompt_cache import prompt_cache
+from provider_pool import provider_pool
+from intent_router import intent_router
+from tool_registry import tool_registry
 from database_service import db_service
 from mcp_service import mcp_manager
 from kafka_service import kafka_service
 from specialist_manager import specialist_service, SpecialistModel, SkillModel
 from optimization_engine import optimizer
-from rag_pipeline import rag_manager
+from ingestion_jobs import ingestion_scheduler
+from embedding_cache import embedding_cache
+from embedding_service import embedding_service
+from vector_index import vector_index, RAG_VECTOR_BACKEND
 from alerts_dispatcher import alerts_dispatcher
 from ai_trigger_compiler import ai_trigger_compiler
 from whatsapp_service import whatsapp_service
+from response_streaming import StreamingReply
 from health_check import health_checker
 
 app = FastAPI(title="LangGraph Real-Time Gateway")
@@ -59,6 +70,14 @@ db_service.set_event_callback(manager.broadcast)
 @app.on_event("startup")
 async def startup_event():
     await kafka_service.start()
+    if RAG_VECTOR_BACKEND == "numpy":
+        await vector_index.start()
+    await answer_cache.start()
+    await model_registry.start()
+    try:
+        await db_service.start_kb_version_sync()
+    except Exception as e:
+        print(f"KB version sync unavailable: {e}")
 
 @app.on_event("shutdown")
 async def shutdown_event():
@@ -215,20 +234,13 @@ async def whatsapp_webhook(instance_name: str, payload: dict):
         if not message_text:
             return {"status": "ignored", "reason": "no_text"}
 
-        # Salvar mensagem do usuário
-        await db_service.save_message(phone_number, "user", message_text, "neutral")
-        
-        # Verificar intervenção humana
-        intervention = await db_service.get_intervention_state(phone_number)
-        if not intervention:
-            # Executar agente
-            # agent_response = await agent_executor.ainvoke(...)
-            # Por enquanto, simulação simples
-            response_text = f"Recebi sua mensagem: {message_text}"
-            await whatsapp_service.send_text_message(instance_name, remote_jid, response_text)
-            await db_service.save_message(phone_number, "agent", response_text, "positive")
+        # Salvar mensagem do usuário e consultar intervenção humana ao mesmo tempo
+        _, intervention = await asyncio.gather(
+            db_service.save_message(phone_number, "user", message_text, "neutral"),
+            db_service.get_intervention_state(phone_number)
+        )
         
-        # Broadcast para frontend
+        # Broadcast para frontend (antes do agente, para os tokens aparecerem na conversa certa)
         await manager.broadcast({
             "type": "NEW_WHATSAPP_MESSAGE",
             "data": {
@@ -241,6 +253,20 @@ async def whatsapp_webhook(instance_name: str, payload: dict):
             }
         })
         
+        if not intervention:
+            # Executar agente em streaming: "digitando..." e, em seguida, cada frase pronta
+            reply = StreamingReply(phone_number, instance_name, remote_jid)
+            await reply.start()
+            try:
+                turn = await agent.run_turn(message_text, phone_number, {"user_name": data.get('pushName') or "Cliente"},
+                                            on_token=reply.on_token, on_step_end=reply.end_step)
+                # Intervenção ativada durante o turno: nada é enviado ao cliente
+                response_text = await reply.finish("" if turn["human_managed"] else turn["response"])
+            finally:
+                await reply.close()
+            if response_text:
+                await db_service.save_message(phone_number, "agent", response_text, "positive")
+        
         return {"status": "processed"}
     except Exception as e:
         print(f"Webhook error: {e}")
@@ -269,12 +295,11 @@ async def estimate_metrics(payload: dict):
 @app.post("/api/ai/suggest-menu")
 async def suggest_menu(payload: dict):
     item_name = payload.get('itemName')
-    client = genai.Client(api_key=os.environ.get("API_KEY"))
-    response = client.models.generate_content(
-        model='gemini-2.0-flash',
-        contents=f"Crie uma descrição curta, atraente e vendedora para este item de cardápio: {item_name}"
+    suggestion = await llm_gateway.generate(
+        f"Crie uma descrição curta, atraente e vendedora para este item de cardápio: {item_name}",
+        model='gemini-2.0-flash', priority=ADMIN, operation="suggest_menu"
     )
-    return {"suggestion": response.text.strip()}
+    return {"suggestion": suggestion}
 
 @app.post("/api/ai/analyze-sentiment")
 async def analyze_sentiment_endpoint(payload: dict):
@@ -284,12 +309,11 @@ async def analyze_sentiment_endpoint(payload: dict):
 @app.post("/api/ai/generate-trigger")
 async def generate_trigger(payload: dict):
     desc = payload.get('description')
-    client = genai.Client(api_key=os.environ.get("API_KEY"))
-    response = client.models.generate_content(
-        model='gemini-2.0-flash',
-        contents=f"Transforme esta descrição de alerta em uma condição lógica simplificada (ex: volume_mensagens > 50). Descrição: {desc}"
+    condition = await llm_gateway.generate(
+        f"Transforme esta descrição de alerta em uma condição lógica simplificada (ex: volume_mensagens > 50). Descrição: {desc}",
+        model='gemini-2.0-flash', priority=ADMIN, operation="generate_trigger"
     )
-    return {"condition": response.text.strip()}
+    return {"condition": condition}
 
 @app.post("/api/ai/summarize-insights")
 async def summarize_insights(payload: dict):
@@ -306,29 +330,66 @@ async def predict_intent(payload: dict):
 # --- LLM CONFIG ---
 @app.post("/api/llm/config")
 async def save_llm_config(config: dict):
-    # Salvar em memória ou DB
-    # db_service.save_llm_config(config)
-    return {"status": "saved", "config": config}
+    try:
+        await db_service.save_llm_config(config)
+    except KeyError as e:
+        raise HTTPException(status_code=400, detail=f"Campo obrigatório ausente: {e}")
+    await model_registry.invalidate()
+    return {"status": "saved", "config": {k: v for k, v in config.items() if k != 'apiKey'}}
+
+@app.get("/api/llm/registry/stats")
+async def get_llm_registry_stats():
+    return {**model_registry.get_stats(), "tools": tool_registry.get_stats()}
+
+@app.get("/api/llm/gateway/stats")
+async def get_llm_gateway_stats():
+    return llm_gateway.get_stats()
+
+@app.get("/api/llm/prompt-cache/stats")
+async def get_prompt_cache_stats():
+    return prompt_cache.get_stats()
+
+@app.get("/api/llm/providers/stats")
+async def get_provider_pool_stats():
+    return provider_pool.get_stats()
 
 # --- AGENT CHAT ---
 @app.post("/api/agent/chat")
 async def agent_chat(payload: dict):
     message = payload.get('message')
-    conversation_id = payload.get('conversation_id')
-    
-    # Roteamento via Supervisor
-    specialists = await specialist_service.get_all_specialists()
-    specialist_id = await supervisor.route(message, specialists)
+    # Id gerado aqui (e não no turno) para que os eventos AGENT_TOKEN já saiam com ele
+    conversation_id = payload.get('conversation_id') or str(uuid.uuid4())
     
-    # Execução (simulada por enquanto)
-    response = f"Especialista {specialist_id} respondendo: {message}"
+    # Tokens também vão ao painel (AGENT_TOKEN) enquanto a resposta é gerada; o roteamento
+    # do supervisor roda dentro do turno, em paralelo à recuperação
+    reply = StreamingReply(conversation_id)
+    try:
+        turn = await agent.run_turn(message, conversation_id, payload.get('user_info'), on_token=reply.on_token,
+                                    on_step_end=reply.end_step, route=True)
+        await reply.finish(turn["response"])
+    finally:
+        await reply.close()
     
     return {
-        "response": response,
-        "specialist_used": specialist_id,
-        "intent": "general"
+        "response": turn["response"],
+        "conversation_id": conversation_id,
+        "specialist_used": turn["specialist_id"],
+        "intent": "general",
+        "cached": turn["cached"]
     }
 
+@app.get("/api/agent/router/stats")
+async def get_agent_router_stats():
+    return intent_router.get_stats()
+
+@app.get("/api/agent/stages/stats")
+async def get_agent_stage_stats():
+    return agent.stage_latency.summary()
+
+@app.get("/api/agent/answer-cache/stats")
+async def get_answer_cache_stats():
+    return answer_cache.get_stats()
+
 # 1. Specialists CRUD
 @app.get("/api/specialists")
 async def get_specialists():
@@ -395,21 +456,74 @@ async def delete_menu_item(item_id: str):
 async def get_knowledge_files():
     return await db_service.get_vector_files()
 
-@app.post("/api/knowledge/upload")
+@app.post("/api/knowledge/upload", status_code=202)
 async def upload_knowledge(file: UploadFile = File(...)):
     try:
         temp_dir = "temp_uploads"
         os.makedirs(temp_dir, exist_ok=True)
-        file_path = os.path.join(temp_dir, file.filename)
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        result = await rag_manager.process_and_index(file_path)
-        os.remove(file_path)
-        if result["status"] == "error":
-             raise HTTPException(status_code=500, detail=result["message"])
-        return result
+        file_name = os.path.basename(file.filename or "documento")
+        ext = os.path.splitext(file_name)[1].lower()
+
+        # Streaming para um arquivo temporário único; o destino final é endereçado pelo conteúdo
+        digest = hashlib.sha256()
+        partial_path = os.path.join(temp_dir, f".{uuid.uuid4()}.part")
+        with open(partial_path, "wb") as buffer:
+            while chunk := await file.read(1024 * 1024):
+                digest.update(chunk)
+                # Escrita em disco fora do event loop: uploads grandes não travam os atendimentos
+                await asyncio.to_thread(buffer.write, chunk)
+        content_hash = digest.hexdigest()
+        file_path = os.path.join(temp_dir, f"{content_hash}{ext}")
+        os.replace(partial_path, file_path)
+
+        job = await ingestion_scheduler.submit(file_path, file_name, content_hash)
+        return {"job_id": job.id, "status": job.status, "file_name": file_name}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/knowledge/jobs/{job_id}")
+async def get_ingestion_job(job_id: str):
+    job = ingestion_scheduler.get(job_id)
+    if not job:
+        raise HTTPException(404, "Job not found")
+    return job
+
+@app.post("/api/knowledge/jobs/{job_id}/cancel")
+async def cancel_ingestion_job(job_id: str):
+    if not await ingestion_scheduler.cancel(job_id):
+        raise HTTPException(404, "Job not found or already finished")
+    return ingestion_scheduler.get(job_id)
+
+@app.get("/api/knowledge/embedding-cache/stats")
+async def get_embedding_cache_stats():
+    return embedding_cache.get_stats()
+
+@app.get("/api/knowledge/embeddings/stats")
+async def get_embedding_service_stats():
+    return embedding_service.get_stats()
+
+@app.get("/api/knowledge/retrieval-cache/stats")
+async def get_retrieval_cache_stats():
+    return {**retrieval_cache.get_stats(), "kb_version": db_service.kb_version}
+
+@app.get("/api/knowledge/context/stats")
+async def get_context_packing_stats():
+    return context_packer.get_stats()
+
+@app.get("/api/knowledge/index/stats")
+async def get_vector_index_stats():
+    return {**vector_index.get_stats(), "ann_index": db_service.get_vector_index_info()}
+
+@app.post("/api/knowledge/index/rebuild")
+async def rebuild_vector_index():
+    """Reconstrói o índice ANN (ex.: após ingestão em massa com IVFFlat)."""
+    try:
+        result = await db_service.rebuild_vector_index()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    if result.get("skipped"):
+        raise HTTPException(status_code=409, detail="Reconstrução do índice já em andamento em outro worker.")
+    return result
 
 @app.delete("/api/knowledge/{doc_id}")
 async def delete_knowledge_document(doc_id: str):
@@ -442,6 +556,9 @@ async def connect_mcp_server(req: MCPConnectRequest):
 
 @app.delete("/api/mcp/servers/{server_id}")
 async def delete_mcp_server(server_id: str):
+    name = await db_service.delete_mcp_server(server_id)
+    if name:
+        mcp_manager.unregister_server(name)
     return {"status": "deleted", "server_id": server_id}
 
 @app.post("/api/mcp/connectors/{connector_id}/sync")
@@ -604,7 +721,6 @@ async def schedule_report(schedule_config: dict):
 # 8. Prompts
 @app.post("/api/prompts/refine")
 async def refine_prompt_with_ai(req: PromptRefineRequest):
-    client = genai.Client(api_key=os.environ.get("API_KEY"))
     meta_prompt = f"""Você é um engenheiro de prompts especialista em agentes de atendimento para pizzarias via WhatsApp.
 Refine o seguinte prompt de sistema para torná-lo mais preciso, empático, focado em vendas e livre de ambiguidades.
 Mantenha o tom profissional e cordial. Retorne APENAS o prompt refinado, sem explicações.
@@ -612,20 +728,19 @@ Mantenha o tom profissional e cordial. Retorne APENAS o prompt refinado, sem exp
 PROMPT ORIGINAL:
 {req.prompt}"""
     try:
-        response = client.models.generate_content(model='gemini-2.0-flash', contents=meta_prompt)
-        return {"refined_prompt": response.text.strip()}
+        refined = await llm_gateway.generate(meta_prompt, model='gemini-2.0-flash', priority=ADMIN, operation="refine_prompt")
+        return {"refined_prompt": refined}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # 9. Database & Alerts (Staff)
 @app.post("/api/database/generate-table")
 async def generate_table_with_ai(req: TableGenRequest):
-    client = genai.Client(api_key=os.environ.get("API_KEY"))
     prompt = f"""Gere o SQL CREATE TABLE para PostgreSQL baseado nesta descrição: {req.description}
     Retorne APENAS o SQL, sem markdown."""
     try:
-        response = client.models.generate_content(model='gemini-3-flash-preview', contents=prompt)
-        sql = response.text.replace("```sql", "").replace("```", "").strip()
+        text = await llm_gateway.generate(prompt, model='gemini-3-flash-preview', priority=ADMIN, operation="generate_table")
+        sql = text.replace("```sql", "").replace("```", "").strip()
         return {"status": "generated", "schema": sql, "description": req.description}
     except Exception as e:
         return {"status": "error", "message": str(e)}
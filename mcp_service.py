@@ -20,6 +20,10 @@ class MCPManager:
     def __init__(self):
         self.servers: Dict[str, str] = {}  # name -> url
         self.tool_cache: Dict[str, List[Dict]] = {}
+        # Incrementada a cada register/unregister: consumidores reconstroem wrappers só quando muda
+        self.version = 0
+        self._capabilities: Optional[Dict[str, List[Dict]]] = None
+        self._capabilities_version = -1
         # Cliente HTTP otimizado para produção
         self._client = httpx.AsyncClient(
             timeout=httpx.Timeout(30.0, connect=10.0), # Timeouts mais permissivos para introspecção
@@ -42,6 +46,7 @@ class MCPManager:
 
             self.servers[name] = url
             self.tool_cache[name] = tools
+            self.version += 1
             logging.info(f"MCP: Servidor '{name}' registrado com {len(tools)} ferramentas.")
             return True
         except httpx.ConnectError:
@@ -54,6 +59,16 @@ class MCPManager:
             logging.error(f"MCP: Erro genérico ao registrar servidor {name}: {str(e)}")
             return False
 
+    def unregister_server(self, name: str) -> bool:
+        """Remove um servidor e suas ferramentas do catálogo."""
+        if name not in self.servers:
+            return False
+        self.servers.pop(name, None)
+        self.tool_cache.pop(name, None)
+        self.version += 1
+        logging.info(f"MCP: Servidor '{name}' removido.")
+        return True
+
     async def fetch_tools(self, url: str) -> List[Dict]:
         """Consulta as ferramentas disponíveis no servidor via JSON-RPC."""
         payload = {
@@ -76,15 +91,21 @@ class MCPManager:
             raise
 
     async def get_all_capabilities(self) -> Dict[str, List[Dict]]:
-        """Retorna todas as ferramentas de todos os servidores ativos."""
+        """Retorna todas as ferramentas de todos os servidores ativos (montado uma vez por versão)."""
+        if self._capabilities_version == self.version:
+            return self._capabilities
         all_tools = []
         for server_name, tools in self.tool_cache.items():
             for tool in tools:
                 # Adicionamos namespace para evitar colisões
                 tool_copy = tool.copy()
                 tool_copy["name"] = f"{server_name}_{tool['name']}"
+                tool_copy["server"] = server_name
+                tool_copy["original_name"] = tool["name"]
                 all_tools.append(tool_copy)
-        return {"tools": all_tools}
+        self._capabilities = {"tools": all_tools}
+        self._capabilities_version = self.version
+        return self._capabilities
 
     async def call_tool(self, server_name: str, tool_name: str, arguments: Dict[str, Any]) -> Any:
         """Executa uma ferramenta específica em um servidor MCP."""
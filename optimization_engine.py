@@ -1,14 +1,13 @@
 
 from typing import Dict
-from google import genai
-import os
 import json
+from database_service import db_service
+from llm_gateway import llm_gateway, ADMIN
 
 class AgentOptimizer:
     """Mecanismo de Reinforcement Learning from Human Feedback (RLHF)."""
     
     def __init__(self):
-        self.ai_client = genai.Client(api_key=os.environ.get("API_KEY"))
         self.model = 'gemini-3-pro-preview'
 
     async def process_negative_feedback(self, conversation_id: str, message_text: str, correction: str):
@@ -25,16 +24,13 @@ class AgentOptimizer:
         Seja específico e direto.
         """
         
-        response = await self.ai_client.models.generate_content(
-            model=self.model,
-            contents=prompt
-        )
-        
-        lesson = response.text.strip()
+        lesson = await llm_gateway.generate(prompt, model=self.model, priority=ADMIN, operation="lesson")
         
         # Simulação de persistência na tabela 'agent_lessons'
         # Em produção: await db.execute("INSERT INTO agent_lessons ...")
         print(f"OTIMIZAÇÃO: Nova lição aprendida: {lesson}")
+        # Respostas em cache foram geradas com as lições antigas
+        await db_service.notify("lessons_update", {"conversation_id": conversation_id})
         return lesson
 
     async def get_active_lessons(self) -> str:
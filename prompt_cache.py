@@ -0,0 +1,123 @@
+import os
+import json
+import time
+import logging
+from typing import Dict, List, Any, Optional
+from google import genai
+from system_prompt import STATIC_SYSTEM_PROMPT, PROMPT_VERSION
+from context_packer import estimate_tokens
+from embedding_service import LatencyTracker
+from llm_registry import model_registry
+
+logger = logging.getLogger("PromptCache")
+
+# implicit: só prefixo estável (cache automático de Gemini 2.5+/OpenAI/Groq) + métricas
+# explicit: também registra o prefixo (prompt + ferramentas) como CachedContent no Gemini
+PROMPT_CACHE_MODE = os.getenv("PROMPT_CACHE_MODE", "implicit")  # off | implicit | explicit
+PROMPT_CACHE_TTL_SECONDS = int(os.getenv("PROMPT_CACHE_TTL_SECONDS", "3600"))
+# Mínimo de tokens aceito pelo provedor para um cache explícito
+PROMPT_CACHE_MIN_TOKENS = int(os.getenv("PROMPT_CACHE_MIN_TOKENS", "1024"))
+# Preço do token de entrada lido do cache relativo ao preço normal (estimativa de economia)
+PROMPT_CACHE_PRICE_FACTOR = float(os.getenv("PROMPT_CACHE_PRICE_FACTOR", "0.25"))
+PROMPT_CACHE_RETRY_SECONDS = 300
+
+class PromptCache:
+    """
+    Cache de contexto do prefixo estático do system prompt. Registra, quando suportado,
+    o prefixo como conteúdo em cache no provedor e contabiliza acertos a partir do
+    usage_metadata das respostas (tokens lidos do cache, latência com e sem acerto).
+    """
+    def __init__(self, mode: str = PROMPT_CACHE_MODE):
+        self.mode = mode
+        self._explicit: Dict[tuple, Dict[str, Any]] = {}
+        self._retry_after: Dict[tuple, float] = {}
+        self.latency = LatencyTracker()
+        self.stats = {"requests": 0, "hits": 0, "input_tokens": 0, "cached_tokens": 0,
+                      "explicit_created": 0, "explicit_errors": 0}
+
+    @staticmethod
+    def _active_target(config: Optional[Dict]):
+        if not config:
+            return model_registry.default_provider, model_registry.default_model, None
+        return config['provider'].lower(), config['model'], config.get('apiKey')
+
+    async def _register(self, key: tuple, model: str, api_key: Optional[str], tools: List) -> Optional[Dict]:
+        from langchain_google_genai._function_utils import convert_to_genai_function_declarations
+        declarations = convert_to_genai_function_declarations(tools) if tools else []
+        size = estimate_tokens(STATIC_SYSTEM_PROMPT) + sum(
+            estimate_tokens(json.dumps(d.model_dump(exclude_none=True, mode="json"))) for d in declarations
+        )
+        if size < PROMPT_CACHE_MIN_TOKENS:
+            # Prefixo pequeno demais para cache explícito: fica só o cache implícito
+            self._retry_after[key] = float("inf")
+            logger.info(f"Prefixo v{PROMPT_VERSION} com ~{size} tokens, abaixo do mínimo para cache explícito.")
+            return None
+        client = genai.Client(api_key=api_key or os.environ.get("GOOGLE_API_KEY") or os.environ.get("API_KEY"))
+        cache = await client.aio.caches.create(model=model, config={
+            "display_name": f"bella-{PROMPT_VERSION}",
+            "system_instruction": STATIC_SYSTEM_PROMPT,
+            "tools": declarations or None,
+            "ttl": f"{PROMPT_CACHE_TTL_SECONDS}s"
+        })
+        self.stats["explicit_created"] += 1
+        logger.info(f"Prefixo v{PROMPT_VERSION} registrado em cache: {cache.name} (~{size} tokens).")
+        return {"name": cache.name, "expires": time.time() + PROMPT_CACHE_TTL_SECONDS}
+
+    async def get_cached_model(self, tools: List, tools_key: Any):
+        """
+        Cliente que usa o prefixo registrado no provedor (prompt estático + ferramentas já
+        incluídos no cache), ou None quando o cache explícito não se aplica.
+        """
+        if self.mode != "explicit":
+            return None
+        provider, model, api_key = self._active_target(await model_registry.get_active_config())
+        if provider != "gemini":
+            return None
+        key = (model, model_registry._fingerprint(api_key), PROMPT_VERSION, tools_key)
+        entry = self._explicit.get(key)
+        # Renova um pouco antes de expirar, para nunca mandar um nome de cache vencido
+        if entry is None or entry["expires"] - time.time() < 60:
+            if time.time() < self._retry_after.get(key, 0):
+                return None
+            try:
+                entry = await self._register(key, model, api_key, tools)
+            except Exception as e:
+                self.stats["explicit_errors"] += 1
+                self._retry_after[key] = time.time() + PROMPT_CACHE_RETRY_SECONDS
+                logger.error(f"Falha ao registrar cache de contexto: {e}")
+                return None
+            if entry is None:
+                return None
+            self._explicit[key] = entry
+        return await model_registry.get_cached_model(entry["name"])
+
+    def record(self, response, elapsed_ms: float):
+        """Contabiliza uma resposta do modelo (tokens lidos do cache e latência)."""
+        usage = getattr(response, "usage_metadata", None)
+        if not usage:
+            return
+        cached = (usage.get("input_token_details") or {}).get("cache_read") or 0
+        self.stats["requests"] += 1
+        self.stats["input_tokens"] += usage.get("input_tokens") or 0
+        self.stats["cached_tokens"] += cached
+        if cached:
+            self.stats["hits"] += 1
+        self.latency.record("hit" if cached else "miss", elapsed_ms)
+
+    def get_stats(self) -> Dict[str, Any]:
+        requests = self.stats["requests"] or 1
+        input_tokens = self.stats["input_tokens"] or 1
+        cached_share = self.stats["cached_tokens"] / input_tokens
+        return {
+            **self.stats,
+            "mode": self.mode,
+            "prompt_version": PROMPT_VERSION,
+            "hit_rate": round(self.stats["hits"] / requests, 4),
+            "cached_token_share": round(cached_share, 4),
+            # Fração do custo de entrada economizada frente a não ter cache
+            "estimated_input_cost_saving": round(cached_share * (1 - PROMPT_CACHE_PRICE_FACTOR), 4),
+            "latency": self.latency.summary(),
+            "explicit_caches": [e["name"] for e in self._explicit.values()]
+        }
+
+prompt_cache = PromptCache()
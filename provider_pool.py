@@ -0,0 +1,296 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from langchain_core.messages import AIMessage, message_chunk_to_message
+from embedding_service import LatencyTracker
+from llm_registry import model_registry
+
+logger = logging.getLogger("ProviderPool")
+
+# Provedores extras além dos cadastrados em llm_configs, ex.: "groq:llama-3.1-8b-instant,openai:gpt-4o-mini"
+# (provider "fake" aceita "fake:lento?latency_ms=3000&error_rate=0.2" para testes locais)
+LLM_FALLBACK_PROVIDERS = os.getenv("LLM_FALLBACK_PROVIDERS", "")
+# Provedores cadastrados mas inativos também entram como secundários
+LLM_FAILOVER_INCLUDE_INACTIVE = os.getenv("LLM_FAILOVER_INCLUDE_INACTIVE", "true").lower() == "true"
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "true").lower() == "true"
+# Prazo do hedge: p95 do tempo até a primeira saída do provedor x multiplicador (com piso);
+# enquanto não há amostras suficientes, vale o prazo padrão
+LLM_HEDGE_MULTIPLIER = float(os.getenv("LLM_HEDGE_MULTIPLIER", "1.2"))
+LLM_HEDGE_MIN_MS = float(os.getenv("LLM_HEDGE_MIN_MS", "800"))
+LLM_HEDGE_DEFAULT_MS = float(os.getenv("LLM_HEDGE_DEFAULT_MS", "4000"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_MAX_HEDGES = int(os.getenv("LLM_MAX_HEDGES", "1"))
+# Circuit breaker: falhas seguidas para abrir e tempo até liberar uma requisição de teste
+LLM_CIRCUIT_FAILURES = int(os.getenv("LLM_CIRCUIT_FAILURES", "3"))
+LLM_CIRCUIT_COOLDOWN_SECONDS = float(os.getenv("LLM_CIRCUIT_COOLDOWN_SECONDS", "30"))
+# Abaixo desta taxa de sucesso (média móvel) o provedor perde a vez para os saudáveis
+LLM_MIN_HEALTH = float(os.getenv("LLM_MIN_HEALTH", "0.5"))
+HEALTH_EWMA_ALPHA = 0.2
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+def _parse_fallbacks(spec: str) -> List[Dict]:
+    configs = []
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        provider, _, model = item.partition(":")
+        if provider and model:
+            configs.append({"provider": provider.strip().lower(), "model": model.strip(), "apiKey": None})
+        else:
+            logger.warning(f"Entrada inválida em LLM_FALLBACK_PROVIDERS: {item}")
+    return configs
+
+class ProviderHandle:
+    """Saúde de um provedor: taxa de sucesso (média móvel), latências e estado do circuit breaker."""
+    def __init__(self, config: Dict):
+        self.config = config
+        self.name = f"{config['provider']}:{config['model'].split('?')[0]}"
+        self.latency = LatencyTracker()
+        self.health = 1.0
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.stats = {"attempts": 0, "successes": 0, "errors": 0, "hedges": 0,
+                      "hedges_won": 0, "lost_races": 0, "circuit_opens": 0}
+
+    def available(self) -> bool:
+        if self.state == OPEN and time.time() - self.opened_at >= LLM_CIRCUIT_COOLDOWN_SECONDS:
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN:
+            # Meio aberto: uma única requisição de teste por vez
+            return not self.probe_in_flight
+        return self.state == CLOSED
+
+    def hedge_deadline_ms(self) -> float:
+        samples = self.latency.samples.get("first_output")
+        if not samples or len(samples) < LLM_HEDGE_MIN_SAMPLES:
+            return LLM_HEDGE_DEFAULT_MS
+        ordered = sorted(samples)
+        return max(LLM_HEDGE_MIN_MS, ordered[int(0.95 * (len(ordered) - 1))] * LLM_HEDGE_MULTIPLIER)
+
+    def started(self):
+        self.stats["attempts"] += 1
+        if self.state == HALF_OPEN:
+            self.probe_in_flight = True
+
+    def record_success(self, total_ms: float):
+        self.stats["successes"] += 1
+        self.latency.record("total", total_ms)
+        self.health += HEALTH_EWMA_ALPHA * (1.0 - self.health)
+        self.consecutive_failures = 0
+        self.probe_in_flight = False
+        if self.state != CLOSED:
+            logger.info(f"Provedor {self.name} respondeu ao teste; circuito fechado.")
+        self.state = CLOSED
+
+    def record_failure(self, error: Exception):
+        self.stats["errors"] += 1
+        self.health += HEALTH_EWMA_ALPHA * (0.0 - self.health)
+        self.consecutive_failures += 1
+        self.probe_in_flight = False
+        if self.state == HALF_OPEN or self.consecutive_failures >= LLM_CIRCUIT_FAILURES:
+            if self.state != OPEN:
+                self.stats["circuit_opens"] += 1
+                logger.warning(f"Circuito aberto para {self.name} após {self.consecutive_failures} falha(s): {error}")
+            self.state = OPEN
+            self.opened_at = time.time()
+
+    def record_lost(self, elapsed_ms: float):
+        # Perdeu a corrida sem responder: o tempo decorrido é um limite inferior da latência real
+        self.stats["lost_races"] += 1
+        self.latency.record("first_output", elapsed_ms)
+        self.probe_in_flight = False
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "state": self.state,
+            "health": round(self.health, 4),
+            "consecutive_failures": self.consecutive_failures,
+            "hedge_deadline_ms": round(self.hedge_deadline_ms(), 2),
+            "latency": self.latency.summary()
+        }
+
+class ProviderPool:
+    """
+    Pool de provedores LLM para os turnos do agente. O primário (config ativa) recebe a
+    requisição; se não produzir saída dentro do prazo derivado do seu p95, um secundário
+    recebe uma requisição em paralelo (hedge) e vence quem responder primeiro. Erros passam
+    para o próximo provedor, e provedores com falhas seguidas ficam de fora (circuit breaker)
+    até o fim do intervalo de espera.
+    """
+    def __init__(self, hedge_enabled: bool = LLM_HEDGE_ENABLED, max_hedges: int = LLM_MAX_HEDGES):
+        self.hedge_enabled = hedge_enabled
+        self.max_hedges = max_hedges
+        self.fallbacks = _parse_fallbacks(LLM_FALLBACK_PROVIDERS)
+        self._handles: Dict[Tuple[str, str, str], ProviderHandle] = {}
+        self.stats = {"requests": 0, "hedges": 0, "hedges_won": 0, "failovers": 0,
+                      "all_circuits_open": 0, "failed": 0, "cached_fallbacks": 0}
+
+    async def _configs(self) -> List[Dict]:
+        active = await model_registry.get_active_config()
+        configs = [active] if active else [{"provider": model_registry.default_provider,
+                                            "model": model_registry.default_model, "apiKey": None}]
+        if LLM_FAILOVER_INCLUDE_INACTIVE:
+            configs += [c for c in await model_registry.get_configured() if not c.get("isActive")]
+        return configs + self.fallbacks
+
+    async def _candidates(self) -> List[ProviderHandle]:
+        handles, seen = [], set()
+        for config in await self._configs():
+            key = model_registry._client_key(config)
+            if key in seen or not config.get("model"):
+                continue
+            seen.add(key)
+            handle = self._handles.get(key)
+            if handle is None:
+                handle = self._handles[key] = ProviderHandle(config)
+            handle.config = config
+            handles.append(handle)
+        available = [h for h in handles if h.available()]
+        if not available:
+            # Sem nenhum circuito fechado, tenta o que está aberto há mais tempo em vez de não responder
+            self.stats["all_circuits_open"] += 1
+            return sorted(handles, key=lambda h: h.opened_at)[:1]
+        # Ordem de configuração (primário primeiro), com os pouco saudáveis por último
+        return sorted(available, key=lambda h: h.health < LLM_MIN_HEALTH)
+
+    @staticmethod
+    async def _produce(handle: ProviderHandle, model: Any, messages: List, stream: bool,
+                       queue: asyncio.Queue, progress: Dict[str, bool]):
+        if not stream:
+            await queue.put((handle, "result", await model.ainvoke(messages)))
+            return
+        async for chunk in model.astream(messages):
+            progress["emitted"] = True
+            await queue.put((handle, "chunk", chunk))
+        await queue.put((handle, "done", None))
+
+    async def _attempt(self, handle: ProviderHandle, messages: List, tools: List, tools_key: Any,
+                       stream: bool, queue: asyncio.Queue, cached: Optional[Tuple[Any, List]] = None):
+        progress = {"emitted": False}
+        try:
+            if cached is not None:
+                try:
+                    await self._produce(handle, cached[0], cached[1], stream, queue, progress)
+                    return
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    if progress["emitted"]:
+                        raise
+                    # Conteúdo em cache vencido ou rejeitado: mesmo provedor, prompt completo
+                    self.stats["cached_fallbacks"] += 1
+                    logger.warning(f"Modelo com cache de contexto falhou em {handle.name} ({e}); usando o prompt completo.")
+            model = await model_registry.get_bound_model(tools, tools_key=tools_key, config=handle.config)
+            await self._produce(handle, model, messages, stream, queue, progress)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await queue.put((handle, "error", e))
+
+    async def generate(self, messages: List, tools: List, tools_key: Any = None,
+                       on_chunk: Optional[Callable[[Any], Awaitable[Any]]] = None,
+                       cached: Optional[Tuple[Any, List]] = None) -> AIMessage:
+        """
+        Executa o passo do modelo no pool. Com `on_chunk`, roda em streaming: só os pedaços do
+        provedor vencedor (o primeiro a produzir saída) são repassados ao callback.
+        `cached` é (modelo, mensagens) com cache de contexto do provedor ativo: usado nas
+        tentativas desse provedor, com `messages` como fallback e para os demais.
+        """
+        self.stats["requests"] += 1
+        pending = await self._candidates()
+        cached_key = model_registry._client_key(await model_registry.get_active_config()) if cached else None
+        queue: asyncio.Queue = asyncio.Queue()
+        tasks: Dict[ProviderHandle, Tuple[asyncio.Task, float]] = {}
+        hedged = set()
+        winner: Optional[ProviderHandle] = None
+        aggregated = None
+        last_error: Optional[Exception] = None
+
+        def launch(handle: ProviderHandle):
+            handle.started()
+            handle_cached = cached if cached and model_registry._client_key(handle.config) == cached_key else None
+            tasks[handle] = (asyncio.create_task(
+                self._attempt(handle, messages, tools, tools_key, on_chunk is not None, queue, handle_cached)
+            ), time.perf_counter())
+
+        launch(pending.pop(0))
+        try:
+            while True:
+                timeout = None
+                if winner is None and self.hedge_enabled and len(hedged) < self.max_hedges and pending:
+                    # O prazo do hedge conta a partir do lançamento mais recente
+                    newest, (_, launched_at) = max(tasks.items(), key=lambda item: item[1][1])
+                    elapsed = time.perf_counter() - launched_at
+                    timeout = max(0.0, newest.hedge_deadline_ms() / 1000 - elapsed)
+                try:
+                    handle, kind, payload = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    hedge = pending.pop(0)
+                    hedged.add(hedge)
+                    hedge.stats["hedges"] += 1
+                    self.stats["hedges"] += 1
+                    logger.info(f"Sem saída dentro do prazo; hedge para {hedge.name}.")
+                    launch(hedge)
+                    continue
+
+                if winner is not None and handle is not winner:
+                    continue  # saída atrasada de um perdedor já cancelado
+                elapsed_ms = (time.perf_counter() - tasks[handle][1]) * 1000
+
+                if kind == "error":
+                    tasks.pop(handle)
+                    handle.record_failure(payload)
+                    last_error = payload
+                    if winner is not None:
+                        raise payload  # falha no meio do stream já repassado ao cliente
+                    logger.warning(f"Provedor {handle.name} falhou: {payload}")
+                    if not tasks:
+                        if not pending:
+                            raise payload
+                        self.stats["failovers"] += 1
+                        launch(pending.pop(0))
+                    continue
+
+                if winner is None:
+                    winner = handle
+                    handle.latency.record("first_output", elapsed_ms)
+                    if handle in hedged:
+                        handle.stats["hedges_won"] += 1
+                        self.stats["hedges_won"] += 1
+                    for loser, (task, launched_at) in list(tasks.items()):
+                        if loser is not winner:
+                            task.cancel()
+                            loser.record_lost((time.perf_counter() - launched_at) * 1000)
+                            tasks.pop(loser)
+
+                if kind == "result":
+                    handle.record_success(elapsed_ms)
+                    return payload
+                if kind == "chunk":
+                    await on_chunk(payload)
+                    aggregated = payload if aggregated is None else aggregated + payload
+                    continue
+                handle.record_success(elapsed_ms)
+                return message_chunk_to_message(aggregated) if aggregated is not None else AIMessage(content="")
+        except Exception:
+            if last_error is not None:
+                self.stats["failed"] += 1
+            raise
+        finally:
+            for task, _ in tasks.values():
+                if not task.done():
+                    task.cancel()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "hedge_enabled": self.hedge_enabled,
+            "max_hedges": self.max_hedges,
+            "providers": {h.name: h.summary() for h in self._handles.values()}
+        }
+
+provider_pool = ProviderPool()
@@ -1,17 +1,45 @@
 
 import os
+import asyncio
+import hashlib
 import logging
-from typing import List, Dict, Any, Optional
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Optional, AsyncIterator, Callable, Awaitable
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.document_loaders import PyPDFLoader, TextLoader
 from langchain_core.documents import Document
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from database_service import db_service
+from embedding_service import embedding_service, EmbeddingService
+from chunk_dedup import RAG_DEDUP_SCOPE, MinHashIndex, minhash, signature_to_bytes, signature_from_bytes
 
 # Configuração de Logs
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("RAG_Pipeline")
 
+RAG_PARSE_WORKERS = int(os.getenv("RAG_PARSE_WORKERS", "2"))
+RAG_PDF_PAGES_PER_TASK = int(os.getenv("RAG_PDF_PAGES_PER_TASK", "8"))
+RAG_PIPELINE_QUEUE_SIZE = int(os.getenv("RAG_PIPELINE_QUEUE_SIZE", "4"))
+RAG_TEXT_BLOCK_SIZE = 64 * 1024
+
+_parse_pool: Optional[ProcessPoolExecutor] = None
+
+def _get_parse_pool() -> ProcessPoolExecutor:
+    global _parse_pool
+    if _parse_pool is None:
+        _parse_pool = ProcessPoolExecutor(max_workers=RAG_PARSE_WORKERS)
+    return _parse_pool
+
+# Funções de nível de módulo: executadas nos processos do pool de parsing.
+def _pdf_page_count(file_path: str) -> int:
+    from pypdf import PdfReader
+    return len(PdfReader(file_path).pages)
+
+def _extract_pdf_pages(file_path: str, start: int, end: int) -> List[str]:
+    from pypdf import PdfReader
+    reader = PdfReader(file_path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, end)]
+
 class DocumentProcessor:
     """Carrega documentos de diferentes formatos (PDF, TXT, DOCX)."""
     @staticmethod
@@ -39,6 +67,65 @@ class DocumentProcessor:
             logger.error(f"Erro ao processar {file_path}: {e}")
             raise
 
+    @staticmethod
+    async def iter_pages(file_path: str) -> AsyncIterator[Document]:
+        """
+        Versão em streaming de load_document: PDFs são extraídos no pool de processos,
+        poucas páginas por vez e em ordem; TXT é lido em blocos. Só uma janela limitada
+        de páginas fica em memória.
+        """
+        if not os.path.exists(file_path):
+             logger.error(f"Arquivo não encontrado: {file_path}")
+             raise FileNotFoundError(f"Arquivo não encontrado: {file_path}")
+
+        ext = os.path.splitext(file_path)[1].lower()
+        loop = asyncio.get_running_loop()
+        if ext == ".pdf":
+            pool = _get_parse_pool()
+            total = await loop.run_in_executor(pool, _pdf_page_count, file_path)
+            ranges = iter([(s, min(s + RAG_PDF_PAGES_PER_TASK, total)) for s in range(0, total, RAG_PDF_PAGES_PER_TASK)])
+            pending = deque()
+
+            def submit_next():
+                page_range = next(ranges, None)
+                if page_range:
+                    pending.append((page_range[0], loop.run_in_executor(pool, _extract_pdf_pages, file_path, *page_range)))
+
+            for _ in range(RAG_PARSE_WORKERS):
+                submit_next()
+            while pending:
+                start, future = pending.popleft()
+                texts = await future
+                submit_next()
+                for offset, text in enumerate(texts):
+                    yield Document(page_content=text, metadata={"source": file_path, "page": start + offset})
+        elif ext == ".txt":
+            with open(file_path, "r", encoding="utf-8", errors="replace") as f:
+                carry = ""
+                while True:
+                    block = await asyncio.to_thread(f.read, RAG_TEXT_BLOCK_SIZE)
+                    if not block:
+                        break
+                    # Corta na última linha (ou, sem quebras, no último espaço) para não partir
+                    # frases entre blocos; texto sem espaço algum é cortado no tamanho do bloco,
+                    # mantendo o que fica em memória limitado
+                    text = carry + block
+                    cut = text.rfind("\n")
+                    if cut <= 0:
+                        cut = max(text.rfind(" "), text.rfind("\t"))
+                    if cut <= 0:
+                        if len(text) < RAG_TEXT_BLOCK_SIZE:
+                            carry = text
+                            continue
+                        cut = RAG_TEXT_BLOCK_SIZE
+                    carry = text[cut:]
+                    yield Document(page_content=text[:cut], metadata={"source": file_path})
+                if carry.strip():
+                    yield Document(page_content=carry, metadata={"source": file_path})
+        else:
+            for doc in await asyncio.to_thread(DocumentProcessor.load_document, file_path):
+                yield doc
+
 class TextChunker:
     """Divide documentos em fragmentos menores para vetorização."""
     def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 200):
@@ -51,81 +138,189 @@ class TextChunker:
     def split(self, documents: List[Document]) -> List[Document]:
         return self.splitter.split_documents(documents)
 
-class EmbeddingFactory:
-    """Gera embeddings usando Google Gemini."""
-    def __init__(self):
-        # A chave de API é obtida automaticamente do ambiente (GOOGLE_API_KEY ou API_KEY)
-        self.embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
-
-    def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        try:
-            return self.embeddings.embed_documents(texts)
-        except Exception as e:
-            logger.error(f"Erro ao gerar embeddings: {e}")
-            # Retorna vetores zerados em caso de falha para não quebrar o pipeline em dev
-            return [[0.0] * 768 for _ in texts]
+    def split_page(self, page: Document) -> List[Document]:
+        return self.splitter.split_documents([page])
 
-    def embed_query(self, text: str) -> List[float]:
-        try:
-            return self.embeddings.embed_query(text)
-        except Exception as e:
-            logger.error(f"Erro ao gerar embedding da query: {e}")
-            return [0.0] * 768
+    def split_and_sign(self, page: Document) -> List[Document]:
+        """Divide a página e anexa a assinatura MinHash de cada chunk (para deduplicação)."""
+        chunks = self.split_page(page)
+        for chunk in chunks:
+            chunk.metadata["minhash"] = minhash(chunk.page_content)
+        return chunks
 
 class RAGPipeline:
     """Gerencia o ciclo de vida RAG: Ingestão -> Vetorização -> Persistência."""
-    def __init__(self):
-        self.embedder = EmbeddingFactory()
+    def __init__(self, embedder: Optional[EmbeddingService] = None):
+        # Mesmo serviço (e modelo) usado pela busca em db_service.search_rag
+        self.embedder = embedder or embedding_service
 
-    async def process_and_index(self, file_path: str, user_id: str = "system") -> Dict[str, Any]:
+    async def process_and_index(self, file_path: str, user_id: str = "system", source_name: Optional[str] = None,
+                                on_progress: Optional[Callable[[Dict[str, int]], Awaitable[None]]] = None) -> Dict[str, Any]:
         """
-        Executa o pipeline completo:
-        1. Carrega o arquivo
-        2. Divide em chunks
-        3. Gera vetores
-        4. Salva no Postgres (pgvector)
+        Executa o pipeline completo em estágios concorrentes ligados por filas limitadas:
+        1. Carrega o arquivo página a página (pool de processos)
+        2. Divide em chunks (streaming)
+        3. Gera vetores em lotes
+        4. Salva no Postgres (pgvector) conforme os lotes ficam prontos
+        Reingestão de um documento existente é incremental: chunks com o mesmo hash de conteúdo
+        são mantidos sem revetorização, os novos são inseridos e os que sumiram são removidos.
+        Quase-duplicatas (cabeçalhos, rodapés, boilerplate) são descartadas antes do embedding,
+        dentro do documento ou em toda a base conforme RAG_DEDUP_SCOPE.
+        A memória de pico independe do tamanho do documento e as filas aplicam backpressure.
+        Chunks mantidos recebem a posição (page, chunk_index) da nova versão. Se a ingestão é
+        cancelada ou falha no meio, os chunks já inseridos por ela são apagados e o documento
+        fica como na versão anterior.
+        `source_name` substitui o nome do arquivo no índice; `on_progress` recebe os contadores
+        (pages, chunks, duplicates, unchanged, embedded, stored) a cada lote.
         """
+        source = source_name or os.path.basename(file_path)
+        inserted: List[str] = []
         try:
             logger.info(f"RAG: Iniciando ingestão de {file_path}")
-            
-            # 1. Carregamento
-            docs = DocumentProcessor.load_document(file_path)
-            if not docs:
+            chunker = TextChunker()
+            embed_workers = max(1, self.embedder.max_concurrency)
+            chunk_queue: asyncio.Queue = asyncio.Queue(maxsize=RAG_PIPELINE_QUEUE_SIZE)
+            store_queue: asyncio.Queue = asyncio.Queue(maxsize=RAG_PIPELINE_QUEUE_SIZE)
+            stats = {"pages": 0, "chunks": 0, "duplicates": 0, "unchanged": 0, "embedded": 0, "stored": 0,
+                     "removed": 0, "repositioned": 0, "failed_batches": []}
+            # hash -> ids já indexados deste documento; o que sobrar no fim foi removido da nova versão
+            existing = await db_service.get_vector_hashes(source)
+            # (id, page, chunk_index) dos chunks mantidos, na posição que ocupam na nova versão
+            retained: List[tuple] = []
+            dedup = MinHashIndex() if RAG_DEDUP_SCOPE != "off" else None
+            if RAG_DEDUP_SCOPE == "kb":
+                for signature in await db_service.get_minhash_signatures(exclude_source=source):
+                    dedup.add(signature_from_bytes(signature))
+
+            async def report():
+                if on_progress:
+                    await on_progress({k: v for k, v in stats.items() if k != "failed_batches"})
+
+            # 1 + 2. Carregamento e chunking
+            async def parse_and_chunk():
+                batch = []
+                async for page in DocumentProcessor.iter_pages(file_path):
+                    stats["pages"] += 1
+                    for chunk in await asyncio.to_thread(chunker.split_and_sign, page):
+                        chunk.metadata["chunk_index"] = stats["chunks"]
+                        stats["chunks"] += 1
+                        signature = chunk.metadata.pop("minhash")
+                        if dedup is not None:
+                            if dedup.is_duplicate(signature):
+                                stats["duplicates"] += 1
+                                continue
+                            dedup.add(signature)
+                        chunk.metadata["signature"] = signature_to_bytes(signature)
+                        content_hash = hashlib.sha256(chunk.page_content.encode("utf-8")).hexdigest()
+                        if existing.get(content_hash):
+                            retained.append((existing[content_hash].pop(), chunk.metadata.get("page", 0),
+                                             chunk.metadata["chunk_index"]))
+                            stats["unchanged"] += 1
+                            continue
+                        chunk.metadata["content_hash"] = content_hash
+                        batch.append(chunk)
+                        if len(batch) >= self.embedder.batch_size:
+                            await chunk_queue.put(batch)
+                            batch = []
+                if batch:
+                    await chunk_queue.put(batch)
+                for _ in range(embed_workers):
+                    await chunk_queue.put(None)
+
+            # 3. Embedding (chunks de lotes falhos não são indexados)
+            async def embed():
+                while (batch := await chunk_queue.get()) is not None:
+                    vectors, failed_batches = await self.embedder.aembed_documents([c.page_content for c in batch])
+                    stats["failed_batches"].extend(failed_batches)
+                    storage_items = [
+                        {
+                            "content": chunk.page_content,
+                            "content_hash": chunk.metadata["content_hash"],
+                            "minhash": chunk.metadata["signature"],
+                            "embedding": vector,
+                            "metadata": {
+                                "source": source,
+                                "user_id": user_id,
+                                "page": chunk.metadata.get("page", 0),
+                                "chunk_index": chunk.metadata["chunk_index"]
+                            }
+                        }
+                        for chunk, vector in zip(batch, vectors) if vector is not None
+                    ]
+                    stats["embedded"] += len(storage_items)
+                    await report()
+                    if storage_items:
+                        await store_queue.put(storage_items)
+
+            # 4. Persistência
+            # A lógica de inserção no Postgres está encapsulada no db_service
+            async def store():
+                while (storage_items := await store_queue.get()) is not None:
+                    inserted.extend(await db_service.store_vectors(storage_items))
+                    stats["stored"] += len(storage_items)
+                    await report()
+
+            async with asyncio.TaskGroup() as tg:
+                tg.create_task(parse_and_chunk())
+                tg.create_task(store())
+                await asyncio.gather(*[tg.create_task(embed()) for _ in range(embed_workers)])
+                await store_queue.put(None)
+
+            if not stats["chunks"]:
                 logger.warning(f"RAG: Documento vazio {file_path}")
                 return {"status": "empty", "chunks": 0}
 
-            # 2. Chunking
-            chunker = TextChunker()
-            chunks = chunker.split(docs)
-            logger.info(f"RAG: Gerados {len(chunks)} fragmentos.")
-
-            # 3. Embedding
-            texts = [c.page_content for c in chunks]
-            vectors = self.embedder.embed_documents(texts)
-            
-            # 4. Preparação para Storage
-            storage_items = []
-            for i, chunk in enumerate(chunks):
-                storage_items.append({
-                    "content": chunk.page_content,
-                    "embedding": vectors[i],
-                    "metadata": {
-                        "source": os.path.basename(file_path),
-                        "user_id": user_id,
-                        "page": chunk.metadata.get("page", 0),
-                        "chunk_index": i
-                    }
-                })
-
-            # 5. Persistência
-            # A lógica de inserção no Postgres está encapsulada no db_service
-            await db_service.store_vectors(storage_items)
-            
-            return {"status": "success", "chunks": len(storage_items)}
+            stats["repositioned"] = await db_service.update_vector_positions(source, retained)
+            # Nova versão gravada: daqui em diante uma falha não desfaz mais o que foi inserido
+            inserted.clear()
+
+            # Chunks removidos só são apagados se a nova versão foi totalmente indexada,
+            # para não perder conteúdo antigo quando lotes de embedding falham.
+            failed_chunks = stats["chunks"] - stats["duplicates"] - stats["unchanged"] - stats["stored"]
+            if not failed_chunks:
+                removed_ids = [i for ids in existing.values() for i in ids]
+                stats["removed"] = await db_service.delete_vectors_by_ids(source, removed_ids)
+                await report()
 
+            logger.info(
+                f"RAG: {stats['pages']} páginas, {stats['chunks']} fragmentos "
+                f"({stats['duplicates']} quase-duplicados, {stats['unchanged']} inalterados, {stats['stored']} indexados, {stats['removed']} removidos)."
+            )
+            summary = {"chunks": stats["unchanged"] + stats["stored"], "added": stats["stored"],
+                       "unchanged": stats["unchanged"], "removed": stats["removed"], "duplicates": stats["duplicates"],
+                       "repositioned": stats["repositioned"], "pages": stats["pages"]}
+            if failed_chunks:
+                status = "error" if not stats["stored"] and not stats["unchanged"] else "partial"
+                return {
+                    "status": status,
+                    **summary,
+                    "failed_chunks": failed_chunks,
+                    "failed_batches": [{"size": b["size"], "error": b["error"]} for b in stats["failed_batches"]],
+                    "message": f"{failed_chunks} fragmentos não puderam ser vetorizados."
+                }
+            return {"status": "success", **summary}
+
+        except asyncio.CancelledError:
+            await self._rollback(source, inserted)
+            raise
         except Exception as e:
+            if isinstance(e, ExceptionGroup):
+                e = e.exceptions[0]
             logger.error(f"RAG Pipeline falhou: {e}")
-            return {"status": "error", "message": str(e)}
+            rolled_back = await self._rollback(source, inserted)
+            return {"status": "error", "message": str(e), "rolled_back": rolled_back}
+
+    async def _rollback(self, source: str, inserted: List[str]) -> int:
+        """Apaga os chunks inseridos por uma ingestão interrompida (a versão anterior não foi tocada)."""
+        if not inserted:
+            return 0
+        try:
+            removed = await db_service.delete_vectors_by_ids(source, inserted)
+            logger.warning(f"RAG: Ingestão de {source} interrompida; {removed} fragmentos novos desfeitos.")
+            return removed
+        except Exception as e:
+            logger.error(f"RAG: Falha ao desfazer ingestão parcial de {source}: {e}")
+            return 0
 
     async def remove_document(self, file_name: str) -> Dict[str, Any]:
         """Remove um documento e seus vetores do índice."""
@@ -3,6 +3,7 @@ from langchain_core.tools import tool
 from typing import List, Dict, Optional
 import json
 from database_service import db_service
+from context_packer import context_packer, RAG_CONTEXT_CANDIDATES
 
 @tool
 async def query_menu_database(query: Optional[str] = None) -> str:
@@ -19,14 +20,19 @@ async def query_menu_database(query: Optional[str] = None) -> str:
     return json.dumps({"status": "success", "source": "official_database", "menu": pizzas}, ensure_ascii=False)
 
 @tool
-async def search_knowledge_base(query: str) -> str:
+async def search_knowledge_base(query: str, vector_weight: float = 1.0, text_weight: float = 1.0) -> str:
     """
     Pesquisa na base de conhecimento semântica (RAG) por documentos, FAQs, manuais e políticas.
     Retorna os trechos mais relevantes do manual de operação ou PDFs indexados.
+    A busca é híbrida: aumente text_weight para nomes exatos (produtos, bairros, códigos de política)
+    e vector_weight para perguntas abertas. Peso 0 desativa a respectiva busca.
     """
     try:
-        results = await db_service.search_rag(query, limit=4)
-        
+        candidates = await db_service.search_rag(
+            query, limit=RAG_CONTEXT_CANDIDATES, vector_weight=vector_weight, text_weight=text_weight
+        )
+        results = context_packer.pack(query, candidates)
+
         if not results:
             return json.dumps({
                 "status": "empty",
@@ -37,7 +43,7 @@ async def search_knowledge_base(query: str) -> str:
         for r in results:
             formatted_results.append({
                 "source": r.get('metadata', {}).get('source', 'unknown'),
-                "content": r.get('content', '')[:500] + "..." # Truncar para não estourar contexto
+                "content": r.get('content', '')
             })
 
         return json.dumps({
@@ -1,14 +1,11 @@
 
 from typing import List, Optional, Dict
-from google import genai
-import os
-import json
+from llm_gateway import llm_gateway, BACKGROUND
 
 class RecommendationEngine:
     """Motor de IA Preditiva para Vendas Proativas (Next Best Offer)."""
     
     def __init__(self):
-        self.ai_client = genai.Client(api_key=os.environ.get("API_KEY"))
         self.model = 'gemini-3-flash-preview'
 
     async def analyze_and_suggest(self, last_message: str, history: List[str], menu_context: str) -> Optional[str]:
@@ -31,12 +28,7 @@ class RecommendationEngine:
         """
         
         try:
-            response = await self.ai_client.models.generate_content(
-                model=self.model,
-                contents=prompt,
-                config={'response_mime_type': 'application/json'}
-            )
-            data = json.loads(response.text)
+            data = await llm_gateway.generate_json(prompt, model=self.model, priority=BACKGROUND, operation="recommendation")
             return data.get('recommendation')
         except Exception as e:
             print(f"Erro no Motor de Recomendação: {e}")
@@ -0,0 +1,146 @@
+import os
+import re
+import asyncio
+import logging
+from typing import List, Optional
+from database_service import db_service
+from whatsapp_service import whatsapp_service
+
+logger = logging.getLogger("ResponseStreaming")
+
+WHATSAPP_STREAM_FIRST_MIN_CHARS = int(os.getenv("WHATSAPP_STREAM_FIRST_MIN_CHARS", "40"))
+WHATSAPP_STREAM_MAX_CHARS = int(os.getenv("WHATSAPP_STREAM_MAX_CHARS", "350"))
+
+# Fim de frase seguido de espaço, ou quebra de parágrafo
+_SENTENCE_END = re.compile(r"(?<=[.!?…:])\s+|\n{2,}")
+
+class SentenceSegmenter:
+    """
+    Agrupa tokens em mensagens de WhatsApp: a primeira sai na primeira frase completa
+    (resposta visível o quanto antes); as seguintes em quebras de parágrafo ou quando
+    o texto acumulado passa de max_chars, sempre cortando em fim de frase.
+    """
+    def __init__(self, first_min_chars: int = WHATSAPP_STREAM_FIRST_MIN_CHARS,
+                 max_chars: int = WHATSAPP_STREAM_MAX_CHARS):
+        self.first_min_chars = first_min_chars
+        self.max_chars = max_chars
+        self.buffer = ""
+        self.emitted = 0
+
+    def feed(self, token: str) -> List[str]:
+        self.buffer += token
+        segments = []
+        while True:
+            cut = self._find_cut()
+            if cut is None:
+                break
+            segment, self.buffer = self.buffer[:cut].strip(), self.buffer[cut:].lstrip()
+            if segment:
+                segments.append(segment)
+                self.emitted += 1
+        return segments
+
+    def _find_cut(self) -> Optional[int]:
+        cut = None
+        for match in _SENTENCE_END.finditer(self.buffer):
+            end = match.end()
+            if self.emitted == 0:
+                if match.start() >= self.first_min_chars:
+                    return end
+                continue
+            if "\n\n" in match.group():
+                return end
+            if match.start() >= self.max_chars:
+                return cut or end
+            cut = end
+        return None
+
+    def flush(self) -> Optional[str]:
+        segment, self.buffer = self.buffer.strip(), ""
+        if segment:
+            self.emitted += 1
+        return segment or None
+
+    def discard(self):
+        self.buffer = ""
+
+class StreamingReply:
+    """
+    Entrega de uma resposta do agente em streaming: tokens vão ao painel (AGENT_TOKEN via
+    WebSocket) assim que chegam e, no WhatsApp, cada trecho pronto é enviado em ordem por
+    uma tarefa dedicada, sem travar o consumo do stream do modelo. Cada passo do modelo
+    fecha seus próprios trechos (end_step): texto de um passo nunca é colado ao do seguinte.
+    """
+    def __init__(self, conversation_id: str, instance_name: Optional[str] = None, remote_jid: Optional[str] = None):
+        self.conversation_id = conversation_id
+        self.instance_name = instance_name
+        self.remote_jid = remote_jid
+        self.segmenter = SentenceSegmenter()
+        self._outbox: asyncio.Queue = asyncio.Queue()
+        self._sender: Optional[asyncio.Task] = None
+        self.sent: List[str] = []
+        self._step_start = 0
+        self._closed = False
+
+    @property
+    def _whatsapp(self) -> bool:
+        return bool(self.instance_name and self.remote_jid)
+
+    async def start(self):
+        if self._whatsapp:
+            # Indicador "digitando..." enquanto o modelo produz a primeira frase
+            await whatsapp_service.send_presence(self.instance_name, self.remote_jid, "composing")
+            self._sender = asyncio.create_task(self._send_loop())
+
+    async def _send_loop(self):
+        while (text := await self._outbox.get()) is not None:
+            result = await whatsapp_service.send_text_message(self.instance_name, self.remote_jid, text)
+            if isinstance(result, dict) and result.get("error"):
+                logger.error(f"Falha ao enviar trecho para {self.remote_jid}: {result['error']}")
+
+    def _enqueue(self, text: str):
+        self.sent.append(text)
+        if self._whatsapp:
+            self._outbox.put_nowait(text)
+
+    async def on_token(self, token: str):
+        await db_service._emit("AGENT_TOKEN", {"conversation_id": self.conversation_id, "token": token})
+        for segment in self.segmenter.feed(token):
+            self._enqueue(segment)
+
+    async def end_step(self, tool_calls: bool):
+        """
+        Fim de um passo do modelo. Num passo que chamou ferramentas, a narração ainda não
+        enviada ("vou verificar o cardápio...") é descartada, a menos que parte dela já tenha
+        saído; nos demais casos o restante do passo vira um trecho próprio.
+        """
+        if tool_calls and len(self.sent) == self._step_start:
+            self.segmenter.discard()
+        else:
+            tail = self.segmenter.flush()
+            if tail:
+                self._enqueue(tail)
+        self._step_start = len(self.sent)
+
+    async def close(self):
+        """Encerra a tarefa de envio (idempotente); chamar sempre, inclusive quando o turno falha."""
+        if self._closed:
+            return
+        self._closed = True
+        if self._sender:
+            self._outbox.put_nowait(None)
+            await self._sender
+
+    async def finish(self, response: str) -> str:
+        """
+        Envia o restante; sem streaming (ex.: cache de respostas) envia a resposta inteira.
+        Retorna exatamente o texto entregue ao cliente.
+        """
+        tail = self.segmenter.flush()
+        if tail:
+            self._enqueue(tail)
+        if not self.sent and response:
+            self._enqueue(response)
+        await self.close()
+        await db_service._emit("AGENT_STREAM_END", {"conversation_id": self.conversation_id, "response": response})
+        return "\n\n".join(self.sent)
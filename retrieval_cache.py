@@ -0,0 +1,116 @@
+import os
+import re
+import time
+import numpy as np
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import List, Dict, Optional, Any, Tuple
+
+RETRIEVAL_CACHE_MAX_ENTRIES = int(os.getenv("RETRIEVAL_CACHE_MAX_ENTRIES", "2000"))
+RETRIEVAL_CACHE_TTL_SECONDS = int(os.getenv("RETRIEVAL_CACHE_TTL_SECONDS", "900"))
+# Cosseno mínimo entre queries do mesmo turno para reaproveitar as buscas já feitas
+RETRIEVAL_TURN_SIMILARITY = float(os.getenv("RETRIEVAL_TURN_SIMILARITY", "0.8"))
+
+# Memo do turno atual: as buscas pré-carregadas em _retrieve_context (pela mensagem do cliente)
+# são reaproveitadas pela ferramenta search_knowledge_base, chamada com a query reescrita pelo modelo.
+_turn_memo: ContextVar[Optional[Dict[tuple, List[Dict[str, Any]]]]] = ContextVar("rag_turn_memo", default=None)
+
+def _unit(vector) -> Optional[np.ndarray]:
+    if vector is None:
+        return None
+    array = np.asarray(vector, dtype=np.float32)
+    norm = float(np.linalg.norm(array))
+    return array / norm if norm else None
+
+class RetrievalCache:
+    """
+    Cache das listas ranqueadas de cada busca do search_rag (vetorial e full-text), indexado por
+    (busca, query normalizada, parâmetros da busca, versão da base). Os parâmetros incluem o
+    número de candidatos, e a fusão (RRF) é refeita a cada pedido com os pesos e o limite dele,
+    então um acerto devolve exatamente o que a busca direta devolveria.
+    A versão da base (db_service.kb_version) muda a cada store_vectors/delete_vectors,
+    então entradas antigas simplesmente deixam de ser encontradas.
+    No memo do turno a chave é a intenção: mesma query normalizada ou embedding com cosseno
+    >= `turn_similarity` em relação a uma query já buscada no turno.
+    """
+    def __init__(self, max_entries: int = RETRIEVAL_CACHE_MAX_ENTRIES, ttl_seconds: int = RETRIEVAL_CACHE_TTL_SECONDS,
+                 turn_similarity: float = RETRIEVAL_TURN_SIMILARITY):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.turn_similarity = turn_similarity
+        self._lru: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+        self.stats = {"turn_hits": 0, "hits": 0, "misses": 0}
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        query = re.sub(r"\s+", " ", query.strip().lower())
+        return query.rstrip("?!.;, ")
+
+    # --- MEMO POR TURNO ---
+    def begin_turn(self):
+        return _turn_memo.set({})
+
+    def end_turn(self, token):
+        _turn_memo.reset(token)
+
+    def _turn_lookup(self, memo: Dict, scope: tuple, normalized: str, vector: Optional[np.ndarray]) -> Optional[List[Dict]]:
+        best, best_score = None, self.turn_similarity
+        for entry in memo.get(scope, ()):
+            if entry["query"] == normalized:
+                return entry["results"]
+            if vector is not None and entry["vector"] is not None:
+                score = float(vector @ entry["vector"])
+                if score >= best_score:
+                    best, best_score = entry["results"], score
+        return best
+
+    # --- API ---
+    def get(self, source: str, query: str, params: Tuple, kb_version: int,
+            query_vector: Optional[List[float]] = None) -> Optional[List[Dict]]:
+        """Lista ranqueada em cache da busca `source` ("vector" | "text"), ou None."""
+        normalized = self.normalize(query)
+        scope = (source, params, kb_version)
+        memo = _turn_memo.get()
+        if memo is not None:
+            results = self._turn_lookup(memo, scope, normalized, _unit(query_vector))
+            if results is not None:
+                self.stats["turn_hits"] += 1
+                return results
+
+        key = (normalized,) + scope
+        entry = self._lru.get(key)
+        if entry and time.time() - entry["created_at"] < self.ttl_seconds:
+            self._lru.move_to_end(key)
+            self.stats["hits"] += 1
+            if memo is not None:
+                memo.setdefault(scope, []).append({"query": normalized, "vector": _unit(query_vector),
+                                                   "results": entry["results"]})
+            return entry["results"]
+
+        self.stats["misses"] += 1
+        return None
+
+    def put(self, source: str, query: str, params: Tuple, kb_version: int, results: List[Dict],
+            query_vector: Optional[List[float]] = None):
+        normalized = self.normalize(query)
+        scope = (source, params, kb_version)
+        memo = _turn_memo.get()
+        if memo is not None:
+            memo.setdefault(scope, []).append({"query": normalized, "vector": _unit(query_vector), "results": results})
+        key = (normalized,) + scope
+        self._lru[key] = {"results": results, "created_at": time.time()}
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = sum(self.stats.values())
+        hits = self.stats["turn_hits"] + self.stats["hits"]
+        return {
+            **self.stats,
+            "entries": len(self._lru),
+            "turn_similarity": self.turn_similarity,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0
+        }
+
+retrieval_cache = RetrievalCache()
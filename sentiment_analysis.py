@@ -1,17 +1,14 @@
 
 from typing import Dict
-from google import genai
-from google.genai import types
-import os
+from llm_gateway import llm_gateway, BACKGROUND
 
 class SentimentAnalyzer:
     """Analisa o tom emocional e a urgência das conversas."""
     
     def __init__(self):
-        self.client = genai.Client(api_key=os.environ.get("API_KEY"))
         self.model_name = "gemini-3-flash-preview"
 
-    def analyze(self, text: str) -> Dict:
+    async def analyze(self, text: str) -> Dict:
         """
         Retorna um dicionário com score de sentimento, urgência e tom.
         """
@@ -26,15 +23,6 @@ class SentimentAnalyzer:
         - customer_mood: (ex: irritado, satisfeito, curioso, apressado)
         """
         
-        response = self.client.models.generate_content(
-            model=self.model_name,
-            contents=prompt,
-            config=types.GenerateContentConfig(
-                response_mime_type="application/json",
-            )
-        )
-        
-        import json
-        return json.loads(response.text)
+        return await llm_gateway.generate_json(prompt, model=self.model_name, priority=BACKGROUND, operation="sentiment")
 
 sentiment_engine = SentimentAnalyzer()
@@ -1,37 +1,11 @@
 
+import hashlib
 from datetime import datetime
+from typing import Optional
 
-SYSTEM_PROMPT_TEMPLATE = """
-Você é o Gerente Operacional IA da Pizzaria Bella Napoli. Você não apenas responde, você EXECUTA o negócio.
-
-SUAS CAPACIDADES TÉCNICAS:
-1. GESTÃO COMERCIAL: Se o cliente quiser pedir, use 'process_payment_pix' para fechar a venda. Não deixe o cliente esperando.
-2. GESTÃO DE ESTOQUE: Antes de confirmar uma pizza, valide se há ingredientes usando 'manage_inventory_stock'.
-3. DELEGAÇÃO: Se algo precisar de intervenção física (ex: limpeza, entrega atrasada), use 'delegate_task_to_staff'.
-4. DOCUMENTAÇÃO: Após o pagamento, gere o recibo com 'generate_and_send_receipt'.
-
-DIRETRIZES DE ESTILO:
-- No Brasil e LATAM, o atendimento deve ser caloroso mas extremamente eficiente.
-- Use o nome do cliente com frequência.
-- Se detectar que o cliente está com pressa, pule as sugestões e vá direto para o checkout.
-
-DIRETRIZES DE APRENDIZADO (LIÇÕES DA EQUIPE):
-{agent_lessons}
-
-CONTEXTO RAG:
-{context_knowledge_rag}
-
-HISTÓRICO:
-{user_conversation_history}
-
-DADOS ATUAIS:
-Data: {current_time} | Cliente: {user_name}
-
-Comande a operação agora:
-"""
-
-def get_compiled_prompt(context: str, history: str, lessons: str, user_name: str) -> str:
-    return f"""Você é um atendente virtual especializado da pizzaria Bella Napoli. Seu nome é Bella.
+# Prefixo estático (persona, ferramentas, regras): idêntico em todas as requisições, para que o
+# provedor reaproveite o prefixo em cache. Qualquer alteração aqui muda PROMPT_VERSION.
+STATIC_SYSTEM_PROMPT = """Você é um atendente virtual especializado da pizzaria Bella Napoli. Seu nome é Bella.
 
 PERSONALIDADE:
 - Calorosa, simpática e eficiente
@@ -45,14 +19,6 @@ FERRAMENTAS DISPONÍVEIS:
 - search_knowledge: Para buscar informações na base de conhecimento (políticas, horários, promoções)
 - [Ferramentas MCP]: Conectores externos conforme disponibilidade
 
-CONTEXTO DA BASE DE CONHECIMENTO:
-{context}
-
-CLIENTE: {user_name}
-
-LIÇÕES APRENDIDAS (regras de negócio importantes):
-{lessons if lessons else "Nenhuma lição registrada ainda."}
-
 REGRAS CRÍTICAS:
 1. SEMPRE use a ferramenta search_menu antes de citar preços
 2. Nunca ofereça desconto acima de 15% sem aprovação humana
@@ -60,4 +26,23 @@ REGRAS CRÍTICAS:
 4. Confirme sempre o endereço de entrega antes de finalizar o pedido
 5. Ao finalizar pedido, apresente o resumo completo com total
 
+As seções a seguir mudam a cada atendimento: use-as como dados do cliente e do momento atual."""
+
+PROMPT_VERSION = hashlib.sha256(STATIC_SYSTEM_PROMPT.encode("utf-8")).hexdigest()[:12]
+
+def build_turn_context(context: str, history: str, lessons: str, user_name: str, profile: Optional[dict] = None) -> str:
+    """Seções dinâmicas do turno, sempre depois do prefixo estático."""
+    profile_line = ""
+    if profile:
+        profile_line = f"\nPERFIL: último interesse {profile.get('lastIntent') or '-'}, potencial {profile.get('potential') or '-'}, status {profile.get('status') or '-'}"
+    now = datetime.now().strftime("%d/%m/%Y %H:%M")
+    return f"""CONTEXTO DA BASE DE CONHECIMENTO:
+{context}
+
+Data/Hora: {now}
+CLIENTE: {user_name}{profile_line}
+
+LIÇÕES APRENDIDAS (regras de negócio importantes):
+{lessons if lessons else "Nenhuma lição registrada ainda."}
+
 Histórico recente: {history if history else "Início de conversa."}"""
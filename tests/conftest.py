@@ -0,0 +1,8 @@
+import os
+import sys
+
+# Embedder e cache locais: os testes não dependem de provedor nem de banco
+os.environ.setdefault("EMBEDDING_PROVIDER", "fake")
+os.environ.setdefault("EMBEDDING_CACHE_BACKEND", "memory")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
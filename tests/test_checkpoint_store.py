@@ -0,0 +1,118 @@
+import re
+import asyncio
+import operator
+from contextlib import asynccontextmanager
+from typing import Annotated, List, TypedDict
+from langgraph.graph import StateGraph, START, END
+from database_service import db_service
+from checkpoint_store import PostgresCheckpointSaver
+
+class FakeConnection:
+    """Conexão asyncpg em memória que entende só as consultas do PostgresCheckpointSaver."""
+    def __init__(self):
+        self.checkpoints = {}
+        self.writes = {}
+
+    @asynccontextmanager
+    async def transaction(self):
+        yield
+
+    def _rows(self, query, args, table=None):
+        rows = sorted((table or self.checkpoints).values(), key=lambda r: r["checkpoint_id"], reverse=True)
+        for column, op, position in re.findall(r"(thread_id|checkpoint_ns|checkpoint_id) (=|<) \$(\d)", query):
+            value = args[int(position) - 1]
+            rows = [r for r in rows if (r[column] < value if op == "<" else r[column] == value)]
+        return rows
+
+    async def fetch(self, query, *args):
+        if "agent_checkpoint_writes" in query:
+            key = tuple(args)
+            return sorted((w for k, w in self.writes.items() if k[:3] == key),
+                          key=lambda w: (w["task_path"], w["task_id"], w["idx"]))
+        return self._rows(query, args)
+
+    async def fetchrow(self, query, *args):
+        rows = self._rows(query, args)
+        return rows[0] if rows else None
+
+    async def fetchval(self, query, *args):
+        rows = self._rows(query, args[:2])
+        return rows[args[2]]["checkpoint_id"] if len(rows) > args[2] else None
+
+    async def execute(self, query, *args):
+        if query.lstrip().startswith("INSERT"):
+            columns = ("thread_id", "checkpoint_ns", "checkpoint_id", "parent_checkpoint_id",
+                       "checkpoint_type", "checkpoint", "metadata_type", "metadata")
+            self.checkpoints[args[:3]] = dict(zip(columns, args))
+            return
+        table = self.writes if "agent_checkpoint_writes" in query else self.checkpoints
+        deleted = self._rows(query, args, table)
+        keep = {k: v for k, v in table.items() if v not in deleted}
+        table.clear()
+        table.update(keep)
+
+    async def executemany(self, query, rows):
+        columns = ("thread_id", "checkpoint_ns", "checkpoint_id", "task_id", "task_path", "idx", "channel", "value_type", "value")
+        for row in rows:
+            key = row[:4] + (row[5],)
+            if key not in self.writes or "DO UPDATE" in query:
+                self.writes[key] = dict(zip(columns, row))
+
+class FakePool:
+    def __init__(self):
+        self.conn = FakeConnection()
+
+    @asynccontextmanager
+    async def acquire(self):
+        yield self.conn
+
+class State(TypedDict):
+    messages: Annotated[List[str], operator.add]
+
+def _graph(saver):
+    builder = StateGraph(State)
+    builder.add_node("reply", lambda state: {"messages": [f"resposta {len(state['messages'])}"]})
+    builder.add_edge(START, "reply")
+    builder.add_edge("reply", END)
+    return builder.compile(checkpointer=saver)
+
+def test_state_survives_across_turns_and_old_checkpoints_are_pruned(monkeypatch):
+    pool = FakePool()
+    monkeypatch.setattr(db_service, "pool", pool)
+    saver = PostgresCheckpointSaver(keep=3)
+    graph = _graph(saver)
+    config = {"configurable": {"thread_id": "conversa-1"}}
+
+    async def run():
+        for turn in range(4):
+            await graph.ainvoke({"messages": [f"cliente {turn}"]}, config)
+        return await graph.aget_state(config)
+
+    state = asyncio.run(run())
+    assert state.values["messages"][-2:] == ["cliente 3", "resposta 7"]
+    assert len(state.values["messages"]) == 8
+    # Cada turno grava 3 checkpoints (entrada, loop e passo do nó); a poda mantém os `keep` mais recentes
+    # ao gravar a entrada, então sobram `keep` + os 2 gravados depois dela (sem poda seriam 12)
+    stored = [r for r in pool.conn.checkpoints.values() if r["thread_id"] == "conversa-1"]
+    assert len(stored) == saver.keep + 2
+    remaining = {r["checkpoint_id"] for r in stored}
+    assert all(key[2] in remaining for key in pool.conn.writes)
+
+def test_threads_are_isolated_and_delete_thread_removes_everything(monkeypatch):
+    pool = FakePool()
+    monkeypatch.setattr(db_service, "pool", pool)
+    saver = PostgresCheckpointSaver(keep=8)
+    graph = _graph(saver)
+    first, second = ({"configurable": {"thread_id": t}} for t in ("conversa-a", "conversa-b"))
+
+    async def run():
+        await graph.ainvoke({"messages": ["oi"]}, first)
+        await graph.ainvoke({"messages": ["olá"]}, second)
+        await saver.adelete_thread("conversa-a")
+        listed = [t async for t in saver.alist(second, limit=1)]
+        return await saver.aget_tuple(first), listed
+
+    deleted, listed = asyncio.run(run())
+    assert deleted is None
+    assert len(listed) == 1 and listed[0].checkpoint["channel_values"]["messages"] == ["olá", "resposta 1"]
+    assert all(key[0] == "conversa-b" for key in pool.conn.writes)
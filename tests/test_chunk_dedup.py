@@ -0,0 +1,26 @@
+import random
+from chunk_dedup import MinHashIndex, minhash, signature_to_bytes, signature_from_bytes
+
+def _text(seed: int, words: int = 120) -> str:
+    rng = random.Random(seed)
+    return " ".join(f"w{rng.randint(0, 50_000)}" for _ in range(words))
+
+def test_near_duplicate_is_detected():
+    base = _text(1)
+    # Mesmo rodapé com uma palavra trocada no fim
+    variant = base.rsplit(" ", 1)[0] + " alterada"
+    index = MinHashIndex(threshold=0.8)
+    index.add(minhash(base))
+    assert index.is_duplicate(minhash(variant))
+
+def test_distinct_text_is_not_a_duplicate():
+    index = MinHashIndex(threshold=0.8)
+    for seed in range(20):
+        index.add(minhash(_text(seed)))
+    assert not index.is_duplicate(minhash(_text(999)))
+
+def test_signature_is_stable_and_round_trips_through_bytes():
+    text = _text(7)
+    signature = minhash(text)
+    assert (minhash(text) == signature).all()
+    assert (signature_from_bytes(signature_to_bytes(signature)) == signature).all()
@@ -0,0 +1,37 @@
+from context_packer import ContextPacker, content_terms, estimate_tokens
+
+def _chunk(i, content, score=None):
+    return {"id": f"c{i}", "content": content, "metadata": {}, "score": score}
+
+def test_content_terms_drops_accents_and_stopwords():
+    assert content_terms("Qual é o preço da Pizza de Calabresa?") == {"preco", "pizza", "calabresa"}
+
+def test_near_duplicates_are_dropped_and_budget_respected():
+    packer = ContextPacker(token_budget=40, duplicate_threshold=0.8)
+    candidates = [
+        _chunk(1, "Pizza calabresa custa 48 reais no cardápio.", 0.03),
+        _chunk(2, "Pizza calabresa custa 48 reais no cardápio!", 0.029),
+        _chunk(3, "Entregamos na região central com taxa fixa de 8 reais.", 0.02),
+        _chunk(4, "Horário: terça a domingo, das 18h às 23h. " * 5, 0.01),
+    ]
+    packed = packer.pack("quanto custa a pizza calabresa?", candidates)
+    assert [c["id"] for c in packed] == ["c1", "c3"]
+    assert packer.stats["duplicates"] == 1
+    assert sum(c["tokens"] for c in packed) <= 40
+
+def test_first_chunk_over_budget_is_truncated_at_sentence_end():
+    packer = ContextPacker(token_budget=20)
+    content = "Primeira frase sobre o cardápio de pizzas. Segunda frase sobre bebidas geladas. " * 3
+    packed = packer.pack("cardápio", [_chunk(1, content)])
+    assert len(packed) == 1
+    assert packed[0]["content"].endswith(".")
+    assert packed[0]["tokens"] == estimate_tokens(packed[0]["content"]) <= 20
+
+def test_lexical_overlap_reranks_fused_candidates():
+    packer = ContextPacker(token_budget=200, lexical_weight=0.5)
+    candidates = [
+        _chunk(1, "Aceitamos PIX, cartão e dinheiro.", 0.032),
+        _chunk(2, "Horário de funcionamento: terça a domingo, das 18h às 23h.", 0.030),
+    ]
+    packed = packer.pack("qual o horário de funcionamento?", candidates)
+    assert packed[0]["id"] == "c2"
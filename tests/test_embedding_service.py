@@ -0,0 +1,69 @@
+import asyncio
+import itertools
+import embedding_service as embedding_module
+from embedding_service import EmbeddingService, FakeEmbeddings
+
+_models = itertools.count()
+
+def _service(embeddings, **kwargs) -> EmbeddingService:
+    # Modelo único por teste: o cache de embeddings é global
+    return EmbeddingService(model=f"test-{next(_models)}", embeddings=embeddings, **kwargs)
+
+class ScriptedEmbeddings(FakeEmbeddings):
+    """Falha nas primeiras `failures[texto]` chamadas de lotes que contêm o texto."""
+    def __init__(self, failures):
+        super().__init__(size=8)
+        self.failures = dict(failures)
+        self.completed = []
+
+    def embed_documents(self, texts):
+        for text in texts:
+            if self.failures.get(text, 0) > 0:
+                self.failures[text] -= 1
+                raise RuntimeError(f"falha simulada em {text}")
+        self.completed.append(list(texts))
+        return super().embed_documents(texts)
+
+def test_failed_batch_is_reported_and_others_are_kept(monkeypatch):
+    monkeypatch.setattr(embedding_module, "EMBEDDING_RETRY_BASE_DELAY", 0)
+    embeddings = ScriptedEmbeddings({"ruim": 10})
+    service = _service(embeddings, batch_size=2, max_concurrency=2, max_retries=1)
+
+    vectors, failed = asyncio.run(service.aembed_documents(["a", "b", "ruim", "c"]))
+
+    assert vectors[0] is not None and vectors[1] is not None
+    # O lote com a falha inteira fica sem vetor (nunca vetor zerado)
+    assert vectors[2] is None and vectors[3] is None
+    assert [f["indices"] for f in failed] == [[2, 3]]
+
+def test_transient_failure_is_retried(monkeypatch):
+    monkeypatch.setattr(embedding_module, "EMBEDDING_RETRY_BASE_DELAY", 0)
+    embeddings = ScriptedEmbeddings({"instavel": 1})
+    service = _service(embeddings, batch_size=10, max_retries=2)
+
+    vectors, failed = asyncio.run(service.aembed_documents(["instavel", "ok"]))
+
+    assert failed == []
+    assert all(v is not None for v in vectors)
+    assert embeddings.completed == [["instavel", "ok"]]
+
+def test_backoff_does_not_hold_the_concurrency_slot(monkeypatch):
+    monkeypatch.setattr(embedding_module, "EMBEDDING_RETRY_BASE_DELAY", 0.2)
+    embeddings = ScriptedEmbeddings({"instavel": 1})
+    service = _service(embeddings, batch_size=1, max_concurrency=1, max_retries=1)
+
+    vectors, failed = asyncio.run(service.aembed_documents(["instavel", "estavel"]))
+
+    assert failed == []
+    # Com uma única vaga, o lote estável roda enquanto o instável espera o backoff
+    assert embeddings.completed == [["estavel"], ["instavel"]]
+
+def test_repeated_texts_are_served_from_cache():
+    embeddings = ScriptedEmbeddings({})
+    service = _service(embeddings)
+
+    asyncio.run(service.aembed_documents(["margherita", "calabresa"]))
+    vectors, _ = asyncio.run(service.aembed_documents(["calabresa", "portuguesa"]))
+
+    assert embeddings.completed == [["margherita", "calabresa"], ["portuguesa"]]
+    assert all(v is not None for v in vectors)
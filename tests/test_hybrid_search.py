@@ -0,0 +1,37 @@
+import asyncio
+from database_service import DatabaseService, db_service
+
+def _doc(i, metadata=None):
+    return {"id": f"doc-{i}", "content": f"conteúdo {i}", "metadata": metadata}
+
+def test_rrf_rewards_documents_ranked_by_both_searches():
+    vector = [_doc(1), _doc(2), _doc(3)]
+    text = [_doc(3), _doc(4), _doc(2)]
+    fused = DatabaseService._reciprocal_rank_fusion([(1.0, vector), (1.0, text)], limit=4, k=60)
+    # doc-3 (3º e 1º) e doc-2 (2º e 3º) aparecem nas duas listas e passam à frente de doc-1
+    assert [r["id"] for r in fused] == ["doc-3", "doc-2", "doc-1", "doc-4"]
+    assert fused[0]["score"] == round(1 / 61 + 1 / 63, 6)
+    assert fused[2]["score"] == round(1 / 61, 6)
+
+def test_rrf_weights_limit_and_metadata_parsing():
+    vector = [_doc(1, '{"source": "menu.pdf"}'), _doc(2)]
+    text = [_doc(2), _doc(1)]
+    fused = DatabaseService._reciprocal_rank_fusion([(0.5, vector), (2.0, text)], limit=1, k=60)
+    # O peso da busca full-text decide o empate de posições
+    assert [r["id"] for r in fused] == ["doc-2"]
+    assert fused[0]["metadata"] == {}
+    fused = DatabaseService._reciprocal_rank_fusion([(1.0, vector)], limit=5, k=60)
+    assert fused[0]["metadata"] == {"source": "menu.pdf"}
+
+def test_search_rag_fuses_remaining_search_when_one_fails(monkeypatch):
+    async def search_vector(embedding, limit, ef_search=None, probes=None):
+        raise RuntimeError("pgvector indisponível")
+
+    async def search_fulltext(query, limit):
+        return [_doc(7), _doc(8)]
+
+    monkeypatch.setattr(db_service, "_search_vector", search_vector)
+    monkeypatch.setattr(db_service, "_search_fulltext", search_fulltext)
+    monkeypatch.setattr(db_service, "kb_version", db_service.kb_version + 1000)
+    results = asyncio.run(db_service.search_rag("falha parcial da busca vetorial", limit=2))
+    assert [r["id"] for r in results] == ["doc-7", "doc-8"]
@@ -0,0 +1,109 @@
+import asyncio
+import random
+import uuid
+import pytest
+from database_service import db_service
+from embedding_service import FakeEmbeddings
+from rag_pipeline import RAGPipeline
+
+def _paragraph(seed: int) -> str:
+    # Parágrafos com vocabulário distinto: nenhum vira quase-duplicata do outro
+    rng = random.Random(seed)
+    return " ".join(f"p{seed}w{rng.randint(0, 10_000)}" for _ in range(80))
+
+class FakeEmbedder:
+    """Embedder assíncrono mínimo; `block_after` trava as chamadas a partir da N-ésima."""
+    batch_size = 1
+    max_concurrency = 1
+
+    def __init__(self, block_after: int = None):
+        self.block_after = block_after
+        self.calls = 0
+        self.fake = FakeEmbeddings(size=8)
+
+    async def aembed_documents(self, texts):
+        self.calls += 1
+        if self.block_after is not None and self.calls > self.block_after:
+            await asyncio.Event().wait()
+        return self.fake.embed_documents(texts), []
+
+class FakeVectorStore:
+    def __init__(self, monkeypatch):
+        self.rows = {}
+        monkeypatch.setattr(db_service, "get_vector_hashes", self.get_vector_hashes)
+        monkeypatch.setattr(db_service, "get_minhash_signatures", self.get_minhash_signatures)
+        monkeypatch.setattr(db_service, "store_vectors", self.store_vectors)
+        monkeypatch.setattr(db_service, "update_vector_positions", self.update_vector_positions)
+        monkeypatch.setattr(db_service, "delete_vectors_by_ids", self.delete_vectors_by_ids)
+
+    async def get_vector_hashes(self, source):
+        hashes = {}
+        for vector_id, row in self.rows.items():
+            if row["metadata"]["source"] == source:
+                hashes.setdefault(row["content_hash"], []).append(vector_id)
+        return hashes
+
+    async def get_minhash_signatures(self, exclude_source=None):
+        return []
+
+    async def store_vectors(self, items):
+        ids = []
+        for item in items:
+            vector_id = str(uuid.uuid4())
+            self.rows[vector_id] = {"content": item["content"], "content_hash": item["content_hash"],
+                                    "metadata": dict(item["metadata"])}
+            ids.append(vector_id)
+        return ids
+
+    async def update_vector_positions(self, source, positions):
+        changed = 0
+        for vector_id, page, chunk_index in positions:
+            metadata = self.rows[vector_id]["metadata"]
+            if (metadata["page"], metadata["chunk_index"]) != (page, chunk_index):
+                metadata.update(page=page, chunk_index=chunk_index)
+                changed += 1
+        return changed
+
+    async def delete_vectors_by_ids(self, source, ids):
+        return sum(self.rows.pop(i, None) is not None for i in ids)
+
+    def index_of(self, text):
+        return {row["content"]: row["metadata"]["chunk_index"] for row in self.rows.values()}.get(text)
+
+def _write(tmp_path, paragraphs):
+    path = tmp_path / "manual.txt"
+    path.write_text("\n\n".join(paragraphs), encoding="utf-8")
+    return str(path)
+
+def test_retained_chunks_take_their_new_positions(monkeypatch, tmp_path):
+    store = FakeVectorStore(monkeypatch)
+    pipeline = RAGPipeline(embedder=FakeEmbedder())
+    a, b, c, d = (_paragraph(i) for i in range(4))
+
+    first = asyncio.run(pipeline.process_and_index(_write(tmp_path, [a, b, c]), source_name="manual.txt"))
+    assert first["status"] == "success" and first["added"] == 3
+
+    second = asyncio.run(pipeline.process_and_index(_write(tmp_path, [d, a, b]), source_name="manual.txt"))
+    assert second["status"] == "success"
+    assert (second["added"], second["unchanged"], second["removed"], second["repositioned"]) == (1, 2, 1, 2)
+    assert [store.index_of(p) for p in (d, a, b, c)] == [0, 1, 2, None]
+
+def test_cancelled_ingestion_rolls_back_its_inserts(monkeypatch, tmp_path):
+    store = FakeVectorStore(monkeypatch)
+    a, b, c, d = (_paragraph(i) for i in range(10, 14))
+    asyncio.run(RAGPipeline(embedder=FakeEmbedder()).process_and_index(
+        _write(tmp_path, [a, b]), source_name="manual.txt"))
+    before = {row["content"] for row in store.rows.values()}
+
+    async def cancel_mid_stream():
+        # O primeiro chunk novo é gravado; o segundo fica preso no embedding até o cancelamento
+        pipeline = RAGPipeline(embedder=FakeEmbedder(block_after=1))
+        task = asyncio.create_task(pipeline.process_and_index(_write(tmp_path, [c, d, a]), source_name="manual.txt"))
+        while len(store.rows) < 3:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(asyncio.wait_for(cancel_mid_stream(), 10))
+    assert {row["content"] for row in store.rows.values()} == before
@@ -0,0 +1,61 @@
+import asyncio
+import pytest
+from llm_gateway import PriorityLimiter, CUSTOMER, BACKGROUND, ADMIN
+
+def _limiter(capacity=1, **limits) -> PriorityLimiter:
+    return PriorityLimiter(capacity, {CUSTOMER: capacity, BACKGROUND: capacity, ADMIN: capacity, **limits})
+
+def test_released_slot_goes_to_highest_priority_waiter():
+    async def run():
+        limiter = _limiter(capacity=1)
+        order = []
+        await limiter.acquire(ADMIN)
+
+        async def worker(cls, name):
+            await limiter.acquire(cls)
+            order.append(name)
+            limiter.release(cls)
+
+        tasks = [asyncio.create_task(worker(cls, name)) for cls, name in
+                 [(ADMIN, "admin"), (BACKGROUND, "background"), (CUSTOMER, "customer-1"), (CUSTOMER, "customer-2")]]
+        await asyncio.sleep(0)
+        assert limiter.queued() == {CUSTOMER: 2, BACKGROUND: 1, ADMIN: 1}
+        limiter.release(ADMIN)
+        await asyncio.gather(*tasks)
+        return order
+
+    # Prioridade entre classes, FIFO dentro da classe
+    assert asyncio.run(run()) == ["customer-1", "customer-2", "background", "admin"]
+
+def test_class_limit_leaves_slots_for_customers():
+    async def run():
+        limiter = _limiter(capacity=3, **{ADMIN: 1})
+        await limiter.acquire(ADMIN)
+        second_admin = asyncio.create_task(limiter.acquire(ADMIN))
+        await asyncio.sleep(0)
+        # O teto de ADMIN segura o segundo pedido mesmo com vagas livres
+        assert not second_admin.done()
+        await asyncio.wait_for(limiter.acquire(CUSTOMER), 1)
+        await asyncio.wait_for(limiter.acquire(CUSTOMER), 1)
+        assert limiter.in_flight == {CUSTOMER: 2, BACKGROUND: 0, ADMIN: 1}
+        limiter.release(ADMIN)
+        await asyncio.wait_for(second_admin, 1)
+        assert limiter.in_flight[ADMIN] == 1
+
+    asyncio.run(run())
+
+def test_cancelled_waiter_does_not_leak_a_slot():
+    async def run():
+        limiter = _limiter(capacity=1)
+        await limiter.acquire(CUSTOMER)
+        waiting = asyncio.create_task(limiter.acquire(BACKGROUND))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        assert limiter.queued()[BACKGROUND] == 0
+        limiter.release(CUSTOMER)
+        assert limiter.total_in_flight == 0
+        await asyncio.wait_for(limiter.acquire(ADMIN), 1)
+
+    asyncio.run(run())
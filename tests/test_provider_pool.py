@@ -0,0 +1,87 @@
+import asyncio
+import provider_pool as pool_module
+from langchain_core.messages import HumanMessage
+from llm_registry import model_registry
+from provider_pool import ProviderPool, OPEN, HALF_OPEN, CLOSED
+
+MESSAGES = [HumanMessage(content="Oi, qual o cardápio?")]
+
+def _fake(name, latency_ms=0, error_rate=0, active=False):
+    return {"provider": "fake", "model": f"{name}?latency_ms={latency_ms}&error_rate={error_rate}&reply={name}",
+            "apiKey": None, "isActive": active}
+
+def _pool(monkeypatch, primary, *secondaries, hedge_enabled=True) -> ProviderPool:
+    async def get_active_config():
+        return primary
+
+    async def get_configured():
+        return [primary, *secondaries]
+
+    monkeypatch.setattr(model_registry, "get_active_config", get_active_config)
+    monkeypatch.setattr(model_registry, "get_configured", get_configured)
+    monkeypatch.setattr(pool_module, "LLM_FAILOVER_INCLUDE_INACTIVE", True)
+    pool = ProviderPool(hedge_enabled=hedge_enabled, max_hedges=1)
+    pool.fallbacks = []
+    return pool
+
+def test_slow_primary_is_hedged_and_secondary_wins(monkeypatch):
+    monkeypatch.setattr(pool_module, "LLM_HEDGE_DEFAULT_MS", 50)
+    pool = _pool(monkeypatch, _fake("lento", latency_ms=2000, active=True), _fake("rapido", latency_ms=10))
+    reply = asyncio.run(pool.generate(MESSAGES, tools=[], tools_key="t"))
+    assert reply.content == "rapido"
+    assert pool.stats["hedges"] == pool.stats["hedges_won"] == 1
+    providers = pool.get_stats()["providers"]
+    assert providers["fake:lento"]["lost_races"] == 1
+    assert providers["fake:rapido"]["successes"] == 1
+
+def test_streaming_forwards_only_winner_chunks(monkeypatch):
+    monkeypatch.setattr(pool_module, "LLM_HEDGE_DEFAULT_MS", 50)
+    pool = _pool(monkeypatch, _fake("lento", latency_ms=300, active=True), _fake("rapido", latency_ms=10))
+    chunks = []
+
+    async def on_chunk(chunk):
+        chunks.append(chunk.content)
+
+    async def run():
+        reply = await pool.generate(MESSAGES, tools=[], tools_key="t", on_chunk=on_chunk)
+        # Dá tempo ao perdedor cancelado de, se não tivesse sido cancelado, emitir algo
+        await asyncio.sleep(0.4)
+        return reply
+
+    reply = asyncio.run(run())
+    assert "".join(chunks).strip() == reply.content.strip() == "rapido"
+
+def test_error_fails_over_to_next_provider(monkeypatch):
+    pool = _pool(monkeypatch, _fake("quebrado", error_rate=1, active=True), _fake("reserva"), hedge_enabled=False)
+    reply = asyncio.run(pool.generate(MESSAGES, tools=[], tools_key="t"))
+    assert reply.content == "reserva"
+    assert pool.stats["failovers"] == 1
+    assert pool.get_stats()["providers"]["fake:quebrado"]["errors"] == 1
+
+def test_circuit_opens_after_consecutive_failures_and_probes_after_cooldown(monkeypatch):
+    monkeypatch.setattr(pool_module, "LLM_CIRCUIT_FAILURES", 2)
+    monkeypatch.setattr(pool_module, "LLM_CIRCUIT_COOLDOWN_SECONDS", 60)
+    pool = _pool(monkeypatch, _fake("quebrado", error_rate=1, active=True), _fake("reserva"), hedge_enabled=False)
+
+    async def run(times):
+        return [await pool.generate(MESSAGES, tools=[], tools_key="t") for _ in range(times)]
+
+    assert [r.content for r in asyncio.run(run(3))] == ["reserva"] * 3
+    broken = next(h for h in pool._handles.values() if h.name == "fake:quebrado")
+    # Depois de 2 falhas o circuito abre e o terceiro pedido vai direto ao secundário
+    assert broken.state == OPEN and broken.stats["attempts"] == 2
+
+    # Fim da espera: meio aberto, uma requisição de teste; a falha reabre o circuito
+    monkeypatch.setattr(pool_module, "LLM_CIRCUIT_COOLDOWN_SECONDS", 0)
+    assert broken.available() and broken.state == HALF_OPEN
+    assert asyncio.run(run(1))[0].content == "reserva"
+    assert broken.state == OPEN and broken.stats["attempts"] == 3 and broken.stats["circuit_opens"] == 2
+
+def test_half_open_probe_success_closes_circuit(monkeypatch):
+    monkeypatch.setattr(pool_module, "LLM_CIRCUIT_COOLDOWN_SECONDS", 0)
+    pool = _pool(monkeypatch, _fake("instavel", active=True), hedge_enabled=False)
+    asyncio.run(pool._candidates())
+    handle = next(iter(pool._handles.values()))
+    handle.state, handle.opened_at = OPEN, 0.0
+    assert asyncio.run(pool.generate(MESSAGES, tools=[], tools_key="t")).content == "instavel"
+    assert handle.state == CLOSED and handle.consecutive_failures == 0
@@ -0,0 +1,31 @@
+from response_streaming import SentenceSegmenter
+
+def _feed_tokens(segmenter: SentenceSegmenter, text: str, size: int = 3):
+    segments = []
+    for i in range(0, len(text), size):
+        segments.extend(segmenter.feed(text[i:i + size]))
+    return segments
+
+def test_first_segment_leaves_at_first_sentence_past_minimum():
+    segmenter = SentenceSegmenter(first_min_chars=20, max_chars=200)
+    segments = _feed_tokens(segmenter, "Oi! Tudo bem com você hoje? Temos promoção de calabresa")
+    # "Oi!" é curto demais para a primeira mensagem; sai junto com a frase seguinte
+    assert segments == ["Oi! Tudo bem com você hoje?"]
+    assert segmenter.flush() == "Temos promoção de calabresa"
+
+def test_later_segments_cut_at_paragraphs_and_sentence_ends_over_limit():
+    segmenter = SentenceSegmenter(first_min_chars=5, max_chars=40)
+    text = ("Claro, posso ajudar. A Margherita custa R$ 45. A Pepperoni custa R$ 52. "
+            "A Calabresa custa R$ 48.\n\nQuer pedir agora? ")
+    segments = _feed_tokens(segmenter, text) + [segmenter.flush()]
+    assert segments[0] == "Claro, posso ajudar."
+    # Nenhum trecho corta frase ao meio, e o parágrafo fecha o trecho mesmo abaixo do limite
+    assert all(s.endswith((".", "?")) for s in segments)
+    assert segments[-2].endswith("A Calabresa custa R$ 48.") and segments[-1] == "Quer pedir agora?"
+    assert " ".join(segments) == " ".join(text.split())
+
+def test_discard_drops_pending_text():
+    segmenter = SentenceSegmenter(first_min_chars=50)
+    assert segmenter.feed("Vou verificar o cardápio") == []
+    segmenter.discard()
+    assert segmenter.flush() is None
@@ -0,0 +1,74 @@
+import asyncio
+from database_service import db_service
+from retrieval_cache import retrieval_cache
+from context_packer import RAG_CONTEXT_CANDIDATES
+
+DOCS = [
+    {"id": f"00000000-0000-0000-0000-00000000000{i}", "content": text, "metadata": {}}
+    for i, text in enumerate([
+        "Horário de funcionamento da pizzaria: terça a domingo, das 18h às 23h.",
+        "Entregamos em toda a região central com taxa fixa.",
+        "Aceitamos PIX, cartão e dinheiro.",
+    ])
+]
+
+def _patch_searches(monkeypatch):
+    calls = {"vector": 0, "text": 0}
+
+    async def search_vector(embedding, limit, ef_search=None, probes=None):
+        calls["vector"] += 1
+        return DOCS[:limit]
+
+    async def search_fulltext(query, limit):
+        calls["text"] += 1
+        return list(reversed(DOCS))[:limit]
+
+    monkeypatch.setattr(db_service, "_search_vector", search_vector)
+    monkeypatch.setattr(db_service, "_search_fulltext", search_fulltext)
+    return calls
+
+def test_tool_call_with_rewritten_query_hits_turn_memo(monkeypatch):
+    calls = _patch_searches(monkeypatch)
+
+    async def turn():
+        token = retrieval_cache.begin_turn()
+        try:
+            # _retrieve_context: mensagem do cliente; search_knowledge_base: query reescrita pelo modelo
+            prefetched = await db_service.search_rag("Qual o horário de funcionamento da pizzaria?",
+                                                     limit=RAG_CONTEXT_CANDIDATES)
+            tool = await db_service.search_rag("horário de funcionamento da pizzaria", limit=RAG_CONTEXT_CANDIDATES,
+                                               vector_weight=1.0, text_weight=1.0)
+        finally:
+            retrieval_cache.end_turn(token)
+        return prefetched, tool
+
+    prefetched, tool = asyncio.run(turn())
+    assert calls == {"vector": 1, "text": 1}
+    assert tool == prefetched
+
+def test_smaller_limit_is_fused_from_its_own_candidate_pool(monkeypatch):
+    calls = _patch_searches(monkeypatch)
+
+    async def run():
+        large = await db_service.search_rag("aceitam pix?", limit=12)
+        small = await db_service.search_rag("aceitam pix?", limit=2)
+        return large, small
+
+    large, small = asyncio.run(run())
+    # Pools de candidatos diferentes (max(limit * 4, 20)) não são servidos pelo mesmo cache
+    assert calls == {"vector": 2, "text": 2}
+    assert len(small) == 2
+
+def test_unrelated_query_in_same_turn_misses(monkeypatch):
+    calls = _patch_searches(monkeypatch)
+
+    async def turn():
+        token = retrieval_cache.begin_turn()
+        try:
+            await db_service.search_rag("qual o horário de funcionamento?", limit=4)
+            await db_service.search_rag("vocês entregam no bairro jardim?", limit=4)
+        finally:
+            retrieval_cache.end_turn(token)
+
+    asyncio.run(turn())
+    assert calls == {"vector": 2, "text": 2}
@@ -0,0 +1,133 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from contextvars import ContextVar
+from typing import List, Dict, Any, Optional, Tuple
+from langchain_core.tools import tool, BaseTool
+from mcp_service import mcp_manager
+from embedding_service import LatencyTracker
+
+logger = logging.getLogger("ToolRegistry")
+
+AGENT_TOOL_TIMEOUT_SECONDS = float(os.getenv("AGENT_TOOL_TIMEOUT_SECONDS", "15"))
+# Limites por ferramenta, ex.: {"search_knowledge_base": 5, "logistica_rastrear_pedido": 8}
+AGENT_TOOL_TIMEOUTS: Dict[str, float] = json.loads(os.getenv("AGENT_TOOL_TIMEOUTS", "{}"))
+# Tempo total de ferramentas por turno (todas as rodadas de tool calls somadas)
+AGENT_TURN_TOOL_BUDGET_SECONDS = float(os.getenv("AGENT_TURN_TOOL_BUDGET_SECONDS", "30"))
+
+# Prazo absoluto (time.monotonic) das ferramentas do turno atual
+_turn_deadline: ContextVar[Optional[float]] = ContextVar("tool_turn_deadline", default=None)
+
+class ToolRegistry:
+    """
+    Catálogo versionado das ferramentas do agente (nativas + MCP).
+    Wrappers LangChain das ferramentas MCP e o mapa nome -> ferramenta são construídos
+    uma única vez por versão do mcp_manager (que muda a cada register/unregister).
+    """
+    def __init__(self):
+        self._base_tools: List[BaseTool] = []
+        self._tools: List[BaseTool] = []
+        self._tool_map: Dict[str, BaseTool] = {}
+        self._built_version = None
+        self.rebuilds = 0
+        self.latency = LatencyTracker()
+        self.outcomes = {"ok": 0, "error": 0, "timeout": 0, "not_found": 0}
+
+    def set_base_tools(self, tools: List[BaseTool]):
+        self._base_tools = list(tools)
+        self._built_version = None
+
+    @property
+    def version(self) -> int:
+        return mcp_manager.version
+
+    @staticmethod
+    def _wrap_mcp_tool(t_def: Dict[str, Any]) -> BaseTool:
+        # Wrapper para transformar a definição MCP em uma ferramenta LangChain;
+        # o schema de entrada do servidor vira o schema de argumentos da ferramenta
+        server_name = t_def.get("server") or t_def["name"].split("_", 1)[0]
+        original_tool_name = t_def.get("original_name") or t_def["name"].split("_", 1)[1]
+
+        async def run_mcp_tool(**arguments):
+            return await mcp_manager.call_tool(server_name, original_tool_name, arguments)
+
+        schema = t_def.get("inputSchema") or t_def.get("input_schema") or {"type": "object", "properties": {}}
+        return tool(
+            t_def["name"], description=t_def.get("description") or "Ferramenta externa via MCP.", args_schema=schema
+        )(run_mcp_tool)
+
+    async def _ensure_built(self):
+        version = self.version
+        if self._built_version == version:
+            return
+        caps = await mcp_manager.get_all_capabilities()
+        dynamic_tools = [self._wrap_mcp_tool(t_def) for t_def in caps.get("tools", [])]
+        self._tools = self._base_tools + dynamic_tools
+        self._tool_map = {t.name: t for t in self._tools}
+        self._built_version = version
+        self.rebuilds += 1
+        logger.info(f"Catálogo de ferramentas v{version}: {len(self._tools)} ferramentas ({len(dynamic_tools)} MCP).")
+
+    async def get_tools(self) -> List[BaseTool]:
+        await self._ensure_built()
+        return self._tools
+
+    async def get_tool_map(self) -> Dict[str, BaseTool]:
+        await self._ensure_built()
+        return self._tool_map
+
+    # --- EXECUÇÃO ---
+    def begin_turn(self, budget_seconds: float = AGENT_TURN_TOOL_BUDGET_SECONDS):
+        return _turn_deadline.set(time.monotonic() + budget_seconds)
+
+    def end_turn(self, token):
+        _turn_deadline.reset(token)
+
+    def timeout_for(self, tool_name: str) -> float:
+        """Menor entre o limite da ferramenta e o que resta do orçamento do turno."""
+        timeout = float(AGENT_TOOL_TIMEOUTS.get(tool_name, AGENT_TOOL_TIMEOUT_SECONDS))
+        deadline = _turn_deadline.get()
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.monotonic())
+        return max(0.0, timeout)
+
+    async def run_tool(self, tool_name: str, tool_args: Dict) -> Tuple[str, str]:
+        """Executa uma chamada com timeout; retorna (saída, status) e registra a latência."""
+        tool_map = await self.get_tool_map()
+        tool_instance = tool_map.get(tool_name)
+        if tool_instance is None:
+            self.outcomes["not_found"] += 1
+            return f"Ferramenta {tool_name} não encontrada.", "error"
+
+        timeout = self.timeout_for(tool_name)
+        if timeout <= 0:
+            self.outcomes["timeout"] += 1
+            return f"Erro: tempo de ferramentas deste atendimento esgotado; {tool_name} não foi executada.", "timeout"
+
+        started = time.perf_counter()
+        try:
+            # Ferramentas síncronas rodam em thread pelo próprio ainvoke
+            output, status = str(await asyncio.wait_for(tool_instance.ainvoke(tool_args), timeout)), "ok"
+        except asyncio.TimeoutError:
+            output, status = (f"Erro: a ferramenta {tool_name} excedeu o tempo limite de {timeout:.1f}s. "
+                              "Prossiga sem este resultado."), "timeout"
+        except Exception as e:
+            output, status = f"Erro ao executar ferramenta {tool_name}: {str(e)}", "error"
+        self.latency.record(tool_name, (time.perf_counter() - started) * 1000)
+        self.outcomes[status] += 1
+        if status == "timeout":
+            logger.warning(f"Ferramenta {tool_name} excedeu {timeout:.1f}s.")
+        return output, status
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "tools": len(self._tools),
+            "rebuilds": self.rebuilds,
+            "outcomes": self.outcomes,
+            "latency": self.latency.summary()
+        }
+
+tool_registry = ToolRegistry()
@@ -0,0 +1,156 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import numpy as np
+from typing import List, Dict, Optional, Any
+from database_service import db_service
+
+logger = logging.getLogger("VectorIndex")
+
+RAG_VECTOR_BACKEND = os.getenv("RAG_VECTOR_BACKEND", "pgvector")  # pgvector | numpy
+RAG_NUMPY_DTYPE = os.getenv("RAG_NUMPY_DTYPE", "float32")  # float32 | float16
+RAG_NUMPY_SNAPSHOT_DIR = os.getenv("RAG_NUMPY_SNAPSHOT_DIR", "vector_snapshot")
+
+class InMemoryVectorIndex:
+    """
+    Espelho em memória do vector_store para busca exata por produto interno.
+    A base é pequena (milhares de chunks), então top-k é um único produto matriz-vetor
+    sobre vetores normalizados (similaridade de cosseno), sem ida ao Postgres.
+    """
+    def __init__(self, dtype: str = RAG_NUMPY_DTYPE, snapshot_dir: str = RAG_NUMPY_SNAPSHOT_DIR):
+        self.dtype = np.dtype(dtype)
+        self.snapshot_dir = snapshot_dir
+        self.matrix: Optional[np.ndarray] = None
+        self.ids: List[str] = []
+        self.rows: List[Dict[str, Any]] = []  # content, source_file, metadata
+        self.ready = False
+        self._lock = asyncio.Lock()
+
+    # --- CONSTRUÇÃO ---
+    def _normalize(self, vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return np.ascontiguousarray(vectors / norms, dtype=self.dtype)
+
+    @staticmethod
+    def _parse_row(r: Dict) -> Dict[str, Any]:
+        metadata = r.get('metadata')
+        return {
+            "content": r['content'],
+            "source_file": r.get('source_file'),
+            "metadata": json.loads(metadata) if isinstance(metadata, str) else (metadata or {})
+        }
+
+    def _rows_to_matrix(self, records: List[Dict]) -> np.ndarray:
+        if not records:
+            return np.zeros((0, 0), dtype=self.dtype)
+        vectors = np.array(
+            [json.loads(r['embedding']) if isinstance(r['embedding'], str) else r['embedding'] for r in records],
+            dtype=np.float32
+        )
+        return self._normalize(vectors)
+
+    # --- SNAPSHOT (MEMORY-MAPPED) ---
+    def _snapshot_paths(self):
+        return (os.path.join(self.snapshot_dir, "embeddings.npy"), os.path.join(self.snapshot_dir, "rows.json"))
+
+    def _save_snapshot(self, fingerprint: str):
+        matrix_path, rows_path = self._snapshot_paths()
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        np.save(matrix_path + ".tmp.npy", self.matrix)
+        with open(rows_path + ".tmp", "w") as f:
+            json.dump({"fingerprint": fingerprint, "dtype": self.dtype.name, "ids": self.ids, "rows": self.rows}, f)
+        os.replace(matrix_path + ".tmp.npy", matrix_path)
+        os.replace(rows_path + ".tmp", rows_path)
+
+    def _load_snapshot(self, fingerprint: str) -> bool:
+        matrix_path, rows_path = self._snapshot_paths()
+        if not (os.path.exists(matrix_path) and os.path.exists(rows_path)):
+            return False
+        with open(rows_path) as f:
+            meta = json.load(f)
+        if meta.get("fingerprint") != fingerprint or meta.get("dtype") != self.dtype.name:
+            return False
+        self.matrix = np.load(matrix_path, mmap_mode="r")
+        self.ids = meta["ids"]
+        self.rows = meta["rows"]
+        return True
+
+    async def load(self):
+        """Carrega o índice do snapshot em disco, se estiver atualizado, ou do Postgres."""
+        async with self._lock:
+            started = time.perf_counter()
+            fingerprint = await db_service.get_vector_store_fingerprint()
+            origin = "snapshot"
+            if not self._load_snapshot(fingerprint):
+                origin = "postgres"
+                records = await db_service.get_vectors()
+                self.ids = [str(r['id']) for r in records]
+                self.rows = [self._parse_row(r) for r in records]
+                self.matrix = self._rows_to_matrix(records)
+                try:
+                    self._save_snapshot(fingerprint)
+                except Exception as e:
+                    logger.warning(f"Falha ao gravar snapshot do índice: {e}")
+            self.ready = True
+            logger.info(f"Índice vetorial carregado ({origin}): {len(self.ids)} vetores em {(time.perf_counter() - started) * 1000:.0f}ms.")
+
+    # --- ATUALIZAÇÃO INCREMENTAL ---
+    async def apply_update(self, event: Dict):
+        """Sincroniza os vetores de um source_file após eventos VECTOR_STORE_UPDATE."""
+        source = event.get("source")
+        if not self.ready or not source:
+            return
+        async with self._lock:
+            current_ids = set(await db_service.get_vector_ids_by_source(source))
+            keep = [i for i, row in enumerate(self.rows) if row["source_file"] != source or self.ids[i] in current_ids]
+            known = {self.ids[i] for i in keep}
+            new_ids = [i for i in current_ids if i not in known]
+            new_records = await db_service.get_vectors(new_ids) if new_ids else []
+
+            matrix = self.matrix[keep] if self.matrix is not None and self.matrix.size else None
+            if new_records:
+                new_matrix = self._rows_to_matrix(new_records)
+                matrix = new_matrix if matrix is None else np.vstack([matrix, new_matrix])
+            self.matrix = np.ascontiguousarray(matrix, dtype=self.dtype) if matrix is not None else None
+            self.ids = [self.ids[i] for i in keep] + [str(r['id']) for r in new_records]
+            self.rows = [self.rows[i] for i in keep] + [self._parse_row(r) for r in new_records]
+            logger.info(f"Índice vetorial: '{source}' sincronizado ({len(new_records)} novos, total {len(self.ids)}).")
+
+    # --- BUSCA ---
+    def search(self, query_embedding: List[float], limit: int) -> List[Dict]:
+        if self.matrix is None or not len(self.ids):
+            return []
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query /= (np.linalg.norm(query) or 1.0)
+        scores = self.matrix @ query.astype(self.dtype)
+        k = min(limit, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            {"id": self.ids[i], "content": self.rows[i]["content"], "metadata": self.rows[i]["metadata"], "similarity": float(scores[i])}
+            for i in top
+        ]
+
+    async def start(self):
+        """Carrega o índice e assina atualizações de todos os workers (LISTEN/NOTIFY)."""
+        try:
+            await self.load()
+            # Notificações perdidas numa queda da conexão de LISTEN exigem recarregar tudo
+            await db_service.listen("vector_store_update", self.apply_update, on_reconnect=self.load)
+        except Exception as e:
+            self.ready = False
+            logger.error(f"Índice vetorial em memória indisponível, usando pgvector: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "backend": RAG_VECTOR_BACKEND,
+            "ready": self.ready,
+            "vectors": len(self.ids),
+            "dtype": self.dtype.name,
+            "memory_mb": round(self.matrix.nbytes / 1024 / 1024, 2) if self.matrix is not None else 0.0
+        }
+
+vector_index = InMemoryVectorIndex()
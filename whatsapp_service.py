@@ -2,7 +2,7 @@ import os
 import httpx
 import base64
 from typing import Dict, List, Optional
-from google import genai
+from llm_gateway import llm_gateway, CUSTOMER
 
 class EvolutionAPIService:
     def __init__(self):
@@ -54,6 +54,14 @@ class EvolutionAPIService:
             "text": text
         })
 
+    async def send_presence(self, instance_name: str, to: str, presence: str = "composing", delay: int = 10000) -> dict:
+        """Indicador de presença ("digitando...", "gravando áudio...") enquanto a resposta é gerada."""
+        return await self._request("POST", f"chat/sendPresence/{instance_name}", {
+            "number": to,
+            "presence": presence,
+            "delay": delay
+        })
+
     async def send_list_message(self, instance_name: str, to: str, title: str, items: list) -> dict:
         # Evolution API format for lists
         # This is a simplified implementation
@@ -95,15 +103,10 @@ class EvolutionAPIService:
     async def transcribe_audio_base64(self, b64_audio: str) -> str:
         """Transcreve áudio em base64 usando Gemini multimodal."""
         try:
-            client = genai.Client(api_key=os.environ.get("API_KEY"))
-            response = client.models.generate_content(
-                model='gemini-2.0-flash',
-                contents=[
-                    {'mime_type': 'audio/mp3', 'data': b64_audio},
-                    "Transcreva este áudio de WhatsApp para texto em português. Retorne APENAS a transcrição."
-                ]
-            )
-            return response.text.strip()
+            return await llm_gateway.generate([
+                {'mime_type': 'audio/mp3', 'data': b64_audio},
+                "Transcreva este áudio de WhatsApp para texto em português. Retorne APENAS a transcrição."
+            ], model='gemini-2.0-flash', priority=CUSTOMER, operation="transcription")
         except Exception as e:
             print(f"Base64 Transcription error: {e}")
             return "[Erro na transcrição de áudio]"